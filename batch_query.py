@@ -0,0 +1,87 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from ecommerce_agent import config
+from ecommerce_agent.agents import AccessAgent
+from ecommerce_agent.batch import BatchRunner, iter_batch_items
+
+def main():
+    """
+    主函数：从 JSON Lines 文件读取问题，批量处理后把结果逐行写入输出文件。
+    """
+    parser = argparse.ArgumentParser(
+        description="批量回放问题（离线评估、缓存预热），输入和输出均为 JSON Lines。",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "input",
+        help="问题文件路径，每行一个 JSON 对象；'-' 表示从标准输入读取。"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        default=None,
+        help="结果文件路径（默认 <问题文件>.results.jsonl，从标准输入读取时默认 batch_results.jsonl）。"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="每批处理的问题数（默认读取 BATCH_SIZE，为64）。"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="同时调用 Agent 的问题数（默认读取 BATCH_AGENT_CONCURRENCY，为4）。"
+    )
+
+    print("\n--- 批量查询工具 ---")
+    print("""
+    输入文件每行一个问题，例如:
+    {"id": "q1", "question": "订单12345到哪了"}
+    {"id": "q2", "question": "适合冬天的外套", "mode": "search", "max_price": 500}
+    """)
+
+    args = parser.parse_args()
+
+    if args.input != "-" and not os.path.exists(args.input):
+        print(f"错误：找不到文件 '{args.input}'。请检查路径是否正确。")
+        return
+    output_path = args.output or ("batch_results.jsonl" if args.input == "-" else args.input + ".results.jsonl")
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+
+    # 与 app.py 使用相同的大模型配置；嵌入模型和向量索引在构造时同步加载
+    print("\n正在初始化 Agent（加载嵌入模型和向量索引）...")
+    access_agent = AccessAgent(llm_config={
+        "api_key": config.OPENAI_API_KEY,
+        "base_url": config.BASE_URL,
+        "model_name": "gemini-2.5-pro",
+        "temperature": 0.0,
+        "max_tokens": 4096
+    })
+    runner = BatchRunner(access_agent, batch_size=args.batch_size, concurrency=args.concurrency)
+
+    print(f"\n正在处理 '{args.input}' 中的问题，结果写入 '{output_path}'...")
+    input_file = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    try:
+        with open(output_path, "w", encoding="utf-8") as output:
+            for result in runner.run(iter_batch_items(input_file)):
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                # 逐条刷新，中途中断时已完成的结果不会丢失
+                output.flush()
+                if not result.get("success"):
+                    print(f"第 {result['index']} 条失败: {result.get('error')}")
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+
+    stats = runner.stats()
+    print(f"\n共处理 {stats['items']} 条，成功 {stats['succeeded']} 条，失败 {stats['failed']} 条，"
+          f"耗时 {stats['elapsed_seconds']}s ({stats['items_per_second']} 条/秒)。")
+    print("---------------------------------")
+
+if __name__ == "__main__":
+    main()
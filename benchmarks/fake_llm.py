@@ -0,0 +1,136 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from ecommerce_agent.agents.intent_router import ORDER_ID_PATTERN, PRODUCT_ID_PATTERN
+
+# --- 确定性的假大模型 ---
+# 按规则输出 react-chat-json 格式的工具调用，不访问网络，相同的问题总是得到相同的调用序列：
+#   - 问题中有订单号：调用 query_order（多个订单号一次传入列表）；问题还问到订单里的商品时，
+#     可用 query_order_details 则一次查询订单和商品，否则再用订单中的商品ID列表调用一次 query_product；
+#   - 问题中有用户ID（如 user0012）：调用 list_orders，"没发货" 转成状态过滤；
+#   - 问题中有商品ID：调用 query_product（多个商品ID一次传入列表）；
+#   - 其他问题：调用 search_products，"500元以内"、"有优惠" 这类说法转成过滤参数。
+# 拿到工具结果后输出 Final Answer（复述最后一个工具结果）。latency_ms 模拟每次调用大模型的网络和生成耗时。
+
+INPUT_MARKER = "Here is the user's input"
+TOOL_RESPONSE_MARKER = "TOOL RESPONSE:"
+USER_ID = re.compile(r"(user\d+)", re.IGNORECASE)
+MAX_PRICE = re.compile(r"(\d+(?:\.\d+)?)\s*元?\s*(?:以内|以下|之内)")
+MIN_PRICE = re.compile(r"(\d+(?:\.\d+)?)\s*元?\s*以上")
+ORDER_PRODUCT_IDS = re.compile(r"商品ID：\[([^\]]*)\]")
+TOOL_NAMES = re.compile(r"Must be one of ([^\n]+)")
+
+
+def _action(name, action_input):
+    return "```json\n" + json.dumps({"action": name, "action_input": action_input}, ensure_ascii=False) + "\n```"
+
+
+def _user_input(messages):
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage) and INPUT_MARKER in message.content:
+            return message.content.rsplit("\n\n", 1)[-1].strip()
+    return ""
+
+
+def _tool_names(messages):
+    """提示词中列出的可用工具名。"""
+    for message in messages:
+        match = TOOL_NAMES.search(str(message.content))
+        if match:
+            return {name.strip() for name in match.group(1).split(",")}
+    return set()
+
+
+def _observations(messages):
+    """当前问题已经得到的工具结果（按调用顺序）。"""
+    observations = []
+    for message in reversed(messages):
+        if not isinstance(message, HumanMessage):
+            continue
+        if not message.content.startswith(TOOL_RESPONSE_MARKER):
+            break
+        observation = message.content[len(TOOL_RESPONSE_MARKER):].split("\n\nUSER'S INPUT", 1)[0]
+        observations.append(observation.strip("-\n "))
+    return observations[::-1]
+
+
+def scripted_response(messages):
+    """根据问题和已有的工具结果给出下一步动作（JSON 代码块）。"""
+    question = _user_input(messages)
+    observations = _observations(messages)
+    step = len(observations)
+
+    orders = ORDER_ID_PATTERN.findall(question)
+    if orders:
+        about_products = "商品" in question or "买" in question
+        if step == 0:
+            if len(orders) > 1:
+                return _action("query_order", {"order_id": orders})
+            if about_products and "query_order_details" in _tool_names(messages):
+                return _action("query_order_details", {"order_id": orders[0]})
+            return _action("query_order", {"order_id": orders[0]})
+        product_ids = ORDER_PRODUCT_IDS.search(observations[0])
+        product_ids = [pid.strip() for pid in product_ids.group(1).split(",") if pid.strip()] if product_ids else []
+        if about_products and len(orders) == 1 and step == 1 and product_ids:
+            return _action("query_product", {"product_id": product_ids})
+    elif step == 0:
+        user = USER_ID.search(question)
+        if user:
+            action_input = {"user_id": user.group(1)}
+            if "没发货" in question or "未发货" in question:
+                action_input["status"] = "未发货"
+            return _action("list_orders", action_input)
+        products = [a or b for a, b in PRODUCT_ID_PATTERN.findall(question)]
+        if products:
+            return _action("query_product", {"product_id": products if len(products) > 1 else products[0]})
+        action_input = {"query": question}
+        max_price, min_price = MAX_PRICE.search(question), MIN_PRICE.search(question)
+        if max_price:
+            action_input["max_price"] = float(max_price.group(1))
+        if min_price:
+            action_input["min_price"] = float(min_price.group(1))
+        if "优惠" in question or "活动" in question:
+            action_input["has_activity"] = True
+        return _action("search_products", action_input)
+
+    # 像真实模型一样把工具结果整理后复述给用户，会话历史的长度与真实对话相近
+    answer = f"根据查询结果为您整理如下：\n{observations[-1]}" if observations else "暂时无法回答这个问题。"
+    return _action("Final Answer", answer)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """按 scripted_response 规则回答的聊天模型，可以替换 AccessAgent 中的 ChatOpenAI。"""
+
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-react-json"
+
+    def _result(self, messages):
+        content = scripted_response(messages)
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=content))],
+            llm_output={"model_name": self._llm_type,
+                        "token_usage": {"prompt_chars": prompt_chars, "completion_chars": len(content)}},
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self._result(messages)
@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ecommerce_agent import vector_index
+
+# --- 向量索引类型基准测试 ---
+# 对比 Flat / IVF-Flat / HNSW / IVF-PQ 在同一批向量上的召回率、查询延迟和索引体积，
+# 召回率以 Flat 精确检索的结果为准（recall@k）。
+
+
+def load_vectors(index_path):
+    """从已构建的商品索引中取出全部向量。"""
+    index = vector_index.ProductVectorIndex.load(index_path)
+    if index is None or len(index) == 0:
+        return None
+    ivf = faiss.try_extract_index_ivf(index.index)
+    if ivf is not None:
+        # IVF 索引按外部ID取回向量需要哈希直接映射（PQ 编码取回的是近似向量）
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    ids = np.array([entry["id"] for entry in index.manifest["products"].values()], dtype=np.int64)
+    return np.vstack([index.index.reconstruct(int(i)) for i in ids]).astype(np.float32)
+
+
+def synthetic_vectors(count, dim, seed=0):
+    """生成带聚类结构的随机向量，近似真实嵌入的分布。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, count // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.3 * rng.normal(size=(count, dim)).astype(np.float32)
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def default_configs(count, dim):
+    """按数据规模给出待测的索引类型及其查询参数。"""
+    nlist = max(1, min(4096, int(4 * np.sqrt(count))))
+    # 每个子量化器至少覆盖 8 维，否则训练很慢且压缩意义不大
+    pq_m = next((m for m in (64, 32, 16, 8, 4, 2) if dim % m == 0 and dim // m >= 8), 1)
+    return [
+        ("Flat", [{}]),
+        (f"IVF{nlist},Flat", [{"nprobe": n} for n in (1, 4, 16, 64) if n <= nlist]),
+        ("HNSW32", [{"efSearch": e} for e in (16, 64, 128)]),
+        (f"IVF{nlist},PQ{pq_m}", [{"nprobe": n} for n in (4, 16, 64) if n <= nlist]),
+    ]
+
+
+def recall_at_k(ground_truth, results, k):
+    hits = sum(len(set(gt[:k]) & set(res[:k])) for gt, res in zip(ground_truth, results))
+    return hits / (len(ground_truth) * k)
+
+
+def measure(index, queries, k):
+    """逐条查询（与在线检索一致），返回 (结果ID, 每次查询耗时毫秒)。"""
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(ids[0].tolist())
+    return results, np.array(latencies)
+
+
+def run(vectors, num_queries, k, train_size, configs=None, seed=0):
+    count, dim = vectors.shape
+    rng = np.random.default_rng(seed)
+    # 查询为库内向量加少量噪声，避免与某个向量完全重合
+    queries = vectors[rng.choice(count, min(num_queries, count), replace=False)]
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+    training = vectors[rng.choice(count, min(train_size, count), replace=False)]
+    ids = np.arange(count, dtype=np.int64)
+
+    ground_truth = None
+    rows = []
+    for factory, param_sets in configs or default_configs(count, dim):
+        started = time.perf_counter()
+        try:
+            index = vector_index.build_faiss_index(dim, factory, training)
+        except Exception as e:
+            print(f"--- 跳过 {factory}: {e}")
+            continue
+        index.add_with_ids(vectors, ids)
+        build_seconds = time.perf_counter() - started
+        size_bytes = int(faiss.serialize_index(index).nbytes)
+
+        for params in param_sets:
+            vector_index.apply_search_params(index, factory, nprobe=params.get("nprobe", 0),
+                                             ef_search=params.get("efSearch", 0))
+            results, latencies = measure(index, queries, k)
+            if ground_truth is None:
+                ground_truth = results  # 第一个配置为 Flat 精确检索
+            row = {
+                "factory": factory,
+                "params": params,
+                f"recall@{k}": round(recall_at_k(ground_truth, results, k), 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                "bytes": size_bytes,
+                "build_seconds": round(build_seconds, 2),
+            }
+            rows.append(row)
+            print(f"{factory:<20} {json.dumps(params):<20} recall@{k}={row[f'recall@{k}']:.4f}  "
+                  f"p50={row['p50_ms']:.3f}ms  p99={row['p99_ms']:.3f}ms  "
+                  f"size={size_bytes / 1024 / 1024:.1f}MB  build={row['build_seconds']}s")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="比较不同 FAISS 索引类型的召回率、查询延迟和索引体积，用于选择 FAISS_INDEX_FACTORY。",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--index-path", default="faiss_index",
+                        help="从已构建的商品索引读取向量（默认 faiss_index）。")
+    parser.add_argument("--synthetic", type=int, default=None,
+                        help="改用指定数量的合成向量，例如 --synthetic 100000。")
+    parser.add_argument("--dim", type=int, default=1024, help="合成向量的维度（默认1024，与 bge-large-zh 一致）。")
+    parser.add_argument("--queries", type=int, default=500, help="查询次数（默认500）。")
+    parser.add_argument("--k", type=int, default=5, help="召回率统计的 k（默认5，与商品检索一致）。")
+    parser.add_argument("--train-size", type=int, default=20000, help="训练样本数（默认20000）。")
+    parser.add_argument("--output", default=None, help="把结果写入指定的 JSON 文件。")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+        source = f"synthetic:{args.synthetic}x{args.dim}"
+    else:
+        vectors = load_vectors(args.index_path)
+        if vectors is None:
+            print(f"错误：'{args.index_path}' 中没有可用的索引，请先构建索引或使用 --synthetic。")
+            sys.exit(1)
+        source = args.index_path
+    print(f"--- 向量来源: {source}，共 {len(vectors)} 条，维度 {vectors.shape[1]} ---")
+
+    rows = run(vectors, args.queries, args.k, args.train_size)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"source": source, "count": len(vectors), "dim": int(vectors.shape[1]),
+                       "k": args.k, "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"--- 结果已写入 {args.output} ---")
+
+
+if __name__ == "__main__":
+    main()
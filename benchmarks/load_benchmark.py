@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ecommerce_agent import config
+from ecommerce_agent import tracing
+from ecommerce_agent.agents import AccessAgent
+from ecommerce_agent.cache import VersionedResultCache
+from benchmarks import synthetic_catalog as catalog
+from benchmarks.fake_llm import ScriptedChatModel
+
+# --- 端到端负载基准测试 ---
+# 不调用真实大模型，也不需要 MySQL：ScriptedChatModel 按规则输出 ReAct JSON 工具调用，
+# 合成目录写入 SQLite 替身（或 --db mysql 写入本地 MySQL），按场景并发调用 AccessAgent.handle_question。
+# 每个请求的链路 span 在内存中收集，请求耗时拆分为：
+#   agent（Agent 框架与大模型，其中 llm 为大模型调用本身）、embedding、faiss、bm25、sql。
+# 结果（QPS、p50/p95/p99 延迟、各部分耗时）写入 JSON，--compare 与之前的结果逐项对比。
+
+SCENARIOS = ("order", "search", "mixed")
+COMPONENTS = ("agent", "llm", "embedding", "faiss", "bm25", "sql")
+# 混合流量中订单问题的比例，其余为商品搜索
+MIXED_ORDER_RATIO = 0.4
+# AccessAgent 内部出错时的回答
+INTERNAL_ERROR = "处理您的问题时发生了内部错误"
+
+# (是否可由意图路由直接回答, 模板)
+ORDER_TEMPLATES = [
+    (True, "订单{order}到哪了"),
+    (True, "帮我查一下订单{order}的状态"),
+    (False, "订单{order}为什么还没到，能帮我看看吗"),
+    (False, "订单{order}里买的商品是什么材质的"),
+    (False, "我是{user}，我最近的订单有哪些"),
+    (False, "我是{user}，哪些订单还没发货"),
+]
+SEARCH_TEMPLATES = [
+    "适合{scene}的{category}",
+    "{material}{category}，{price}元以内",
+    "有优惠的{feature}{category}",
+    "{color}的{category}推荐一下",
+]
+
+
+def parse_size(text):
+    """'1k'、'100k'、'1M' 或整数。"""
+    text = text.strip().lower()
+    units = {"k": 1_000, "m": 1_000_000}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def make_questions(scenario, count, order_count, seed=0):
+    """生成 [(问题类型, 问题)]，相同参数总是得到相同的问题序列。"""
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        kind = scenario
+        if scenario == "mixed":
+            kind = "order" if rng.random() < MIXED_ORDER_RATIO else "search"
+        if kind == "order":
+            _, template = rng.choice(ORDER_TEMPLATES)
+            n = rng.randrange(order_count)
+            question = template.format(order=catalog.order_id(n), user=catalog.user_id(n))
+        else:
+            question = rng.choice(SEARCH_TEMPLATES).format(
+                scene=rng.choice(catalog.SCENES), category=rng.choice(catalog.CATEGORIES)[0],
+                material=rng.choice(catalog.MATERIALS), feature=rng.choice(catalog.FEATURES),
+                color=rng.choice(catalog.COLORS), price=rng.choice((100, 200, 300, 500, 800)),
+            )
+        questions.append((kind, question))
+    return questions
+
+
+class SpanCollector:
+    """在内存中按 trace 收集结束的 span，请求结束后取出整棵 span 树。"""
+
+    def __init__(self):
+        self._traces = {}
+        self._lock = threading.Lock()
+
+    def export(self, span_obj):
+        with self._lock:
+            self._traces.setdefault(span_obj.trace_id, []).append(span_obj)
+
+    def pop(self, trace_id):
+        with self._lock:
+            return self._traces.pop(trace_id, [])
+
+    def shutdown(self):
+        pass
+
+
+class _DisabledBackend:
+    """不缓存任何内容的缓存后端，用于测量未命中缓存时的完整链路。"""
+
+    shared = False
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def stats(self):
+        return {"backend": "disabled"}
+
+
+class BenchmarkAccessAgent(AccessAgent):
+    """使用 ScriptedChatModel 的 AccessAgent，嵌入模型和索引由基准测试注入。"""
+
+    def __init__(self, llm_latency_ms=0.0):
+        self.llm_latency_ms = llm_latency_ms
+        super().__init__(llm_config={}, lazy=True)
+
+    def _init_llm(self, config):
+        return ScriptedChatModel(latency_ms=self.llm_latency_ms)
+
+
+def create_agent(args):
+    config.TRACING_ENABLED = True
+    config.INTENT_ROUTER_ENABLED = not args.no_router
+    if not args.caches:
+        config.SEMANTIC_CACHE_ENABLED = False
+        config.PRODUCT_CACHE_MAX_ENTRIES = 1
+    agent = BenchmarkAccessAgent(llm_latency_ms=args.llm_latency_ms)
+    product_agent = agent.product_agent
+    if not args.caches:
+        product_agent.search_cache = VersionedResultCache("search", _DisabledBackend())
+    if args.embeddings == "model":
+        if product_agent.load_embeddings() is None:
+            raise RuntimeError("无法加载嵌入模型，请先运行 download_models.py，或使用 --embeddings fake。")
+    else:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        product_agent.embeddings = DeterministicFakeEmbedding(size=args.dim)
+        product_agent.embedding_model_name = "fake"
+    product_agent.search_loading = False
+    return agent
+
+
+def summarize_trace(spans, latency_ms, kind, error):
+    """把一个请求的 span 树汇总为各部分耗时（毫秒）。"""
+    record = dict.fromkeys(COMPONENTS, 0.0)
+    record.update(kind=kind, latency_ms=latency_ms, error=error, llm_calls=0, prompt_tokens=0, path=None)
+    names = {"llm": "llm", "embedding": "embedding", "faiss.search": "faiss", "bm25.search": "bm25"}
+    for span_obj in spans:
+        duration_ms = span_obj.duration * 1000
+        if span_obj.name in names:
+            record[names[span_obj.name]] += duration_ms
+            if span_obj.name == "llm":
+                record["llm_calls"] += 1
+        elif span_obj.name.startswith("sql."):
+            record["sql"] += duration_ms
+        elif span_obj.name == "question":
+            record["path"] = span_obj.attributes.get("path")
+            record["prompt_tokens"] = span_obj.attributes.get("prompt_tokens") or 0
+    # 其余时间都算作 Agent：大模型调用、提示词拼装、输出解析、工具调度、格式化等
+    record["agent"] = max(0.0, latency_ms - record["embedding"] - record["faiss"] - record["bm25"] - record["sql"])
+    return record
+
+
+def run_one(agent, collector, kind, question):
+    with tracing.span("benchmark.request", kind=kind) as root:
+        response = agent.handle_question(question)
+    error = response if response.startswith(INTERNAL_ERROR) else None
+    return summarize_trace(collector.pop(root.trace_id), root.duration * 1000, kind, error)
+
+
+async def arun_one(agent, collector, kind, question, semaphore):
+    async with semaphore:
+        with tracing.span("benchmark.request", kind=kind) as root:
+            response = await agent.ahandle_question(question)
+    error = response if response.startswith(INTERNAL_ERROR) else None
+    return summarize_trace(collector.pop(root.trace_id), root.duration * 1000, kind, error)
+
+
+def drive(agent, collector, questions, concurrency, mode):
+    """并发执行全部问题（闭环：每个并发槽位完成一个请求后立即发起下一个），返回 (请求记录, 总耗时秒数)。"""
+    started = time.perf_counter()
+    if mode == "async":
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(arun_one(agent, collector, kind, q, semaphore) for kind, q in questions))
+        records = asyncio.run(main())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+            records = list(pool.map(lambda item: run_one(agent, collector, *item), questions))
+    return records, time.perf_counter() - started
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {}
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+
+def summarize(records, wall_seconds):
+    latencies = [r["latency_ms"] for r in records]
+    total_latency = sum(latencies) or 1.0
+    components = {}
+    for name in COMPONENTS:
+        values = [r[name] for r in records]
+        components[name] = dict(percentiles(values), share=round(sum(values) / total_latency, 4))
+    by_kind = {}
+    for kind in sorted({r["kind"] for r in records}):
+        subset = [r for r in records if r["kind"] == kind]
+        by_kind[kind] = {"requests": len(subset), "latency_ms": percentiles([r["latency_ms"] for r in subset])}
+    return {
+        "requests": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "wall_seconds": round(wall_seconds, 3),
+        "qps": round(len(records) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": percentiles(latencies),
+        "components_ms": components,
+        "llm_calls_per_request": round(sum(r["llm_calls"] for r in records) / len(records), 3) if records else 0.0,
+        "prompt_tokens_per_request": round(sum(r["prompt_tokens"] for r in records) / len(records), 1) if records else 0.0,
+        "paths": dict(Counter(r["path"] or "unknown" for r in records)),
+        "by_kind": by_kind,
+    }
+
+
+def print_summary(size, scenario, summary):
+    latency = summary["latency_ms"]
+    print(f"{scenario:<8} {size:>9,} 件  QPS={summary['qps']:<9} "
+          f"p50={latency['p50']:.1f}ms  p95={latency['p95']:.1f}ms  p99={latency['p99']:.1f}ms  "
+          f"错误={summary['errors']}  LLM调用/请求={summary['llm_calls_per_request']}  "
+          f"提示词tokens/请求={summary['prompt_tokens_per_request']}")
+    parts = [f"{name}={summary['components_ms'][name]['p50']:.2f}ms({summary['components_ms'][name]['share']:.0%})"
+             for name in COMPONENTS]
+    print(f"{'':<8} p50 拆分: {'  '.join(parts)}")
+
+
+def compare(previous_path, runs):
+    """与之前保存的结果按 (目录规模, 场景) 对比 QPS 和延迟。"""
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = {(run["size"], run["scenario"]): run["summary"] for run in json.load(f)["runs"]}
+
+    def delta(new, old):
+        return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+    print(f"\n--- 与 {previous_path} 对比 ---")
+    for run in runs:
+        old = previous.get((run["size"], run["scenario"]))
+        if old is None:
+            continue
+        new = run["summary"]
+        line = [f"{run['scenario']:<8} {run['size']:>9,} 件  QPS {delta(new['qps'], old['qps'])}"]
+        for p in ("p50", "p95", "p99"):
+            line.append(f"{p} {delta(new['latency_ms'][p], old['latency_ms'][p])}")
+        for name in COMPONENTS:
+            line.append(f"{name}(p50) {delta(new['components_ms'][name]['p50'], old['components_ms'][name]['p50'])}")
+        if "prompt_tokens_per_request" in old:
+            line.append(f"提示词tokens {delta(new['prompt_tokens_per_request'], old['prompt_tokens_per_request'])}")
+        print("  ".join(line))
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="使用确定性的假大模型和合成商品目录，测量问答链路的吞吐量和延迟。",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--sizes", default="1k", help="商品目录规模，逗号分隔，如 1k,100k,1M（默认1k）。")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="场景，逗号分隔：order（订单查询）、search（商品语义搜索）、mixed（混合流量）。")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求数（默认200）。")
+    parser.add_argument("--warmup", type=int, default=20, help="每个场景正式计时前的预热请求数（默认20）。")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数（默认8）。")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync",
+                        help="sync：线程池调用 handle_question（Flask）；async：asyncio 调用 ahandle_question（ASGI）。")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0,
+                        help="假大模型每次调用的模拟耗时（默认0，只测量服务自身的开销）。")
+    parser.add_argument("--db", choices=("sqlite", "mysql"), default="sqlite",
+                        help="sqlite：临时 SQLite 文件替身（默认）；mysql：写入 .env 中配置的 MySQL，请使用单独的库。")
+    parser.add_argument("--embeddings", choices=("fake", "model"), default="fake",
+                        help="fake：确定性的假嵌入（默认）；model：加载本地 bge-large-zh 模型计算问题向量。")
+    parser.add_argument("--dim", type=int, default=128, help="假嵌入和合成向量的维度（默认128；--embeddings model 时取模型维度）。")
+    parser.add_argument("--factory", default=None, help="FAISS 索引类型（默认读取 FAISS_INDEX_FACTORY）。")
+    parser.add_argument("--orders", type=int, default=None, help="合成订单数（默认为商品数的1/10，至少1000）。")
+    parser.add_argument("--no-hybrid", action="store_true", help="不构建 BM25 索引，只使用向量检索。")
+    parser.add_argument("--no-router", action="store_true", help="关闭意图路由，所有问题都经过 Agent。")
+    parser.add_argument("--caches", action="store_true", help="保留搜索结果缓存、商品行缓存和语义缓存（默认关闭以测量完整链路）。")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（默认0）。")
+    parser.add_argument("--output", default=None,
+                        help="结果 JSON 文件（默认 benchmarks/results/load-<时间>.json）。")
+    parser.add_argument("--compare", default=None, help="与之前保存的结果 JSON 对比。")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        print(f"错误：未知的场景 {', '.join(unknown)}（可选 {', '.join(SCENARIOS)}）。")
+        sys.exit(1)
+    factory = args.factory or config.FAISS_INDEX_FACTORY
+
+    collector = SpanCollector()
+    tracing.set_exporter(collector)
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="load_benchmark_") as workdir:
+        for size in sizes:
+            # 先创建 Agent 以便在 --embeddings model 时确定向量维度，索引随后注入
+            agent = create_agent(args)
+            dim = args.dim
+            if args.embeddings == "model":
+                dim = len(agent.product_agent.embeddings.embed_query("维度"))
+            print(f"\n--- 准备 {size:,} 件商品的合成目录（{args.db}，{factory}，{dim} 维）---")
+            stand_in, index, lexical, order_count, build = catalog.prepare_catalog(
+                size, db=args.db, workdir=workdir, dim=dim, factory=factory,
+                model=agent.product_agent.embedding_model_name, hybrid=not args.no_hybrid,
+                orders=args.orders, seed=args.seed)
+            print("    构建耗时: " + "，".join(f"{name.replace('_seconds', '')} {seconds}s"
+                                          for name, seconds in build.items()))
+            agent.product_agent.vector_store = index
+            agent.product_agent.lexical_index = lexical
+
+            for scenario in scenarios:
+                warmup = make_questions(scenario, args.warmup, order_count, seed=args.seed + 1)
+                drive(agent, collector, warmup, args.concurrency, args.mode)
+                questions = make_questions(scenario, args.requests, order_count, seed=args.seed)
+                records, wall_seconds = drive(agent, collector, questions, args.concurrency, args.mode)
+                summary = summarize(records, wall_seconds)
+                print_summary(size, scenario, summary)
+                runs.append({"size": size, "scenario": scenario, "orders": order_count,
+                             "build_seconds": build, "summary": summary})
+            if stand_in is not None:
+                stand_in.close()
+
+    result = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "factory": factory,
+        },
+        "runs": runs,
+    }
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n--- 结果已写入 {output} ---")
+    if args.compare:
+        compare(args.compare, runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ecommerce_agent import config
+from ecommerce_agent import mysql_db
+from ecommerce_agent import tracing
+from ecommerce_agent import vector_index
+from ecommerce_agent.lexical_index import LexicalIndex
+from benchmarks import synthetic_catalog as catalog
+from benchmarks.load_benchmark import BenchmarkAccessAgent, SpanCollector, git_revision
+
+# --- 对话回放：统计每段对话的大模型调用次数和提示词 token 数 ---
+# 按顺序回放录制的多轮对话（同一对话共享会话历史），从链路 span 中统计每段对话的 LLM 调用、各工具调用次数
+# 和发送的提示词 token 数，用于评估工具设计和上下文预算对 Agent 往返次数和提示词大小的影响。
+# --exclude-tools 可以隐藏某些工具，--no-context-budget 关闭上下文压缩，在同一版本上得到对照组：
+#   python benchmarks/replay_transcripts.py benchmarks/transcripts/orders.jsonl --exclude-tools query_order_details
+#   python benchmarks/replay_transcripts.py benchmarks/transcripts/orders.jsonl --compare <上一次的结果>.json
+# 默认使用 ScriptedChatModel 和 SQLite 替身（写入 insert_test_data 的测试数据，商品搜索使用确定性的假嵌入），
+# --llm real 使用 .env 中配置的大模型、嵌入模型和 MySQL，反映真实模型对工具描述的选择。
+# 意图路由默认关闭，使每个问题都经过 Agent。
+
+
+def load_transcripts(path):
+    """每行一个对话：{"id": "c1", "turns": ["问题1", "问题2", ...]}。"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def create_agent(args):
+    config.TRACING_ENABLED = True
+    config.INTENT_ROUTER_ENABLED = args.router
+    # 回放的问题有重复的改写，关闭语义缓存以免后面的对话直接命中
+    config.SEMANTIC_CACHE_ENABLED = False
+    config.CONTEXT_BUDGET_ENABLED = not args.no_context_budget
+    if args.llm == "real":
+        from ecommerce_agent.agents import AccessAgent
+        # 与 app.py 使用相同的大模型配置
+        agent = AccessAgent(llm_config={
+            "api_key": config.OPENAI_API_KEY,
+            "base_url": config.BASE_URL,
+            "model_name": "gemini-2.5-pro",
+            "temperature": 0.0,
+            "max_tokens": 4096
+        }, lazy=True)
+    else:
+        agent = BenchmarkAccessAgent()
+        load_test_search(agent.product_agent)
+    excluded = {name.strip() for name in (args.exclude_tools or "").split(",") if name.strip()}
+    if excluded:
+        agent.tools = [tool for tool in agent.tools if tool.name not in excluded]
+        agent.executor = agent._create_agent_executor(agent.llm)
+    if args.llm == "real" and agent.product_agent.load_embeddings() is not None:
+        agent.product_agent.load_vector_store()
+    agent.product_agent.search_loading = False
+    return agent
+
+
+def load_test_search(product_agent, dim=64):
+    """用确定性的假嵌入为测试数据中的商品构建向量索引和关键词索引（不需要下载嵌入模型）。"""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    product_agent.embeddings = DeterministicFakeEmbedding(size=dim)
+    product_agent.embedding_model_name = "fake"
+    products = mysql_db.get_all_products_for_vectorization() or []
+    to_embed, to_remove, _ = vector_index.plan_index_sync(None, products)
+    product_agent.vector_store = vector_index.apply_index_sync(
+        None, product_agent.embeddings, "fake", to_embed, to_remove, factory="Flat")
+    product_agent.lexical_index = LexicalIndex()
+    product_agent.lexical_index.sync(products)
+
+
+def replay(agent, collector, conversation):
+    """回放一段对话，返回统计字典。"""
+    session_id = f"replay-{uuid.uuid4().hex}"
+    llm_calls, prompt_tokens, tools = 0, 0, Counter()
+    started = time.perf_counter()
+    for question in conversation["turns"]:
+        with tracing.span("benchmark.turn") as root:
+            agent.handle_question(question, session_id=session_id)
+        for span_obj in collector.pop(root.trace_id):
+            if span_obj.name == "llm":
+                llm_calls += 1
+            elif span_obj.name == "question":
+                prompt_tokens += span_obj.attributes.get("prompt_tokens") or 0
+            elif span_obj.name.startswith("tool."):
+                tools[span_obj.name[len("tool."):]] += 1
+    return {
+        "id": conversation.get("id"),
+        "turns": len(conversation["turns"]),
+        "llm_calls": llm_calls,
+        "prompt_tokens": prompt_tokens,
+        "tool_calls": dict(tools),
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def summarize(results):
+    conversations = len(results) or 1
+    turns = sum(r["turns"] for r in results) or 1
+    llm_calls = sum(r["llm_calls"] for r in results)
+    prompt_tokens = sum(r.get("prompt_tokens", 0) for r in results)
+    tools = Counter()
+    for r in results:
+        tools.update(r["tool_calls"])
+    return {
+        "conversations": len(results),
+        "turns": sum(r["turns"] for r in results),
+        "llm_calls": llm_calls,
+        "llm_calls_per_conversation": round(llm_calls / conversations, 3),
+        "llm_calls_per_turn": round(llm_calls / turns, 3),
+        "tool_calls_per_conversation": round(sum(tools.values()) / conversations, 3),
+        "prompt_tokens_per_turn": round(prompt_tokens / turns, 1),
+        "prompt_tokens_per_llm_call": round(prompt_tokens / llm_calls, 1) if llm_calls else 0.0,
+        "tool_calls": dict(tools),
+    }
+
+
+def compare(previous_path, summary):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        old = json.load(f)["summary"]
+    print(f"\n--- 与 {previous_path} 对比 ---")
+    for key in ("llm_calls_per_conversation", "llm_calls_per_turn", "tool_calls_per_conversation",
+                "prompt_tokens_per_turn", "prompt_tokens_per_llm_call"):
+        if key not in old:
+            continue
+        change = f"{(summary[key] - old[key]) / old[key]:+.1%}" if old[key] else "n/a"
+        print(f"{key:<30} {old[key]:>8} -> {summary[key]:<8} ({change})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="回放录制的对话，统计每段对话的大模型调用次数和工具调用次数。",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("transcripts", help="对话文件（JSON Lines），如 benchmarks/transcripts/orders.jsonl。")
+    parser.add_argument("--llm", choices=("scripted", "real"), default="scripted",
+                        help="scripted：确定性的假大模型 + SQLite 测试数据（默认）；real：.env 中配置的大模型和 MySQL。")
+    parser.add_argument("--exclude-tools", default=None, help="不提供给 Agent 的工具名，逗号分隔，用于对照。")
+    parser.add_argument("--no-context-budget", action="store_true",
+                        help="不压缩会话历史和工具输出（CONTEXT_BUDGET_ENABLED=False），用于对照。")
+    parser.add_argument("--router", action="store_true", help="开启意图路由（默认关闭，使每个问题都经过 Agent）。")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件（默认 benchmarks/results/replay-<时间>.json）。")
+    parser.add_argument("--compare", default=None, help="与之前保存的结果 JSON 对比。")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.transcripts):
+        print(f"错误：找不到文件 '{args.transcripts}'。")
+        sys.exit(1)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+    conversations = load_transcripts(args.transcripts)
+    collector = SpanCollector()
+    tracing.set_exporter(collector)
+
+    with tempfile.TemporaryDirectory(prefix="replay_") as workdir:
+        stand_in = None
+        if args.llm == "scripted":
+            stand_in = catalog.SQLiteStandIn(os.path.join(workdir, "test_data.sqlite3"))
+            stand_in.create_schema()
+            stand_in.install()
+            mysql_db.insert_test_data()
+        agent = create_agent(args)
+        print(f"\n--- 回放 {len(conversations)} 段对话（{args.llm}，工具：{', '.join(t.name for t in agent.tools)}）---")
+        results = []
+        for conversation in conversations:
+            result = replay(agent, collector, conversation)
+            results.append(result)
+            tools = ", ".join(f"{name}×{count}" for name, count in result["tool_calls"].items()) or "无"
+            print(f"{result['id']:<28} 轮数={result['turns']}  LLM调用={result['llm_calls']:<3} "
+                  f"提示词={result['prompt_tokens']:<6} 工具: {tools}")
+        if stand_in is not None:
+            stand_in.close()
+
+    summary = summarize(results)
+    print(f"\n平均每段对话 LLM 调用 {summary['llm_calls_per_conversation']} 次，"
+          f"每轮 {summary['llm_calls_per_turn']} 次，工具调用 {summary['tool_calls_per_conversation']} 次；"
+          f"每轮提示词 {summary['prompt_tokens_per_turn']} tokens，每次调用 {summary['prompt_tokens_per_llm_call']} tokens"
+          f"（{agent.context.stats()['tokenizer']}）。")
+    result = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "transcripts": args.transcripts,
+            "args": vars(args),
+            "tools": [tool.name for tool in agent.tools],
+        },
+        "summary": summary,
+        "conversations": results,
+    }
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"replay-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"--- 结果已写入 {output} ---")
+    if args.compare:
+        compare(args.compare, summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from ecommerce_agent import mysql_db
+from ecommerce_agent import tracing
+from ecommerce_agent import vector_index
+from ecommerce_agent.lexical_index import LexicalIndex
+from ecommerce_agent.product_filters import derive_product_attributes
+
+# --- 合成商品目录与数据库替身 ---
+# 按固定随机种子生成任意规模（1k / 100k / 1M）的商品和订单，字段格式与 insert_test_data 一致，
+# 写入 SQLite 替身（默认）或本地 MySQL，并直接构建对应规模的 FAISS 和 BM25 索引。
+# 商品向量是带聚类结构的随机向量（不调用嵌入模型），因此百万级目录也能在几分钟内准备好。
+
+CATEGORIES = [
+    ("T恤", "S/M/L/XL"), ("牛仔裤", "28/29/30/31/32（腰围）"), ("运动鞋", "39/40/41/42/43/44"),
+    ("连衣裙", "S/M/L"), ("夹克外套", "M/L/XL/XXL"), ("羊毛衫", "S/M/L/XL"), ("卫衣", "S/M/L/XL"),
+    ("衬衫", "38/39/40/41/42"), ("羽绒服", "M/L/XL/XXL"), ("帆布鞋", "35/36/37/38/39/40"),
+    ("背包", "均码"), ("帽子", "均码（可调节）"), ("围巾", "均码"), ("手套", "M/L"), ("冲锋衣", "M/L/XL/XXL"),
+]
+BRANDS = ["山野", "城市漫步", "极光", "木棉", "北纬", "轻行", "森屿", "暖冬", "疾风", "素简"]
+MATERIALS = ["纯棉", "羊毛混纺", "涤纶", "尼龙", "真丝", "麻质", "加绒", "防水面料"]
+FEATURES = ["透气舒适", "轻便保暖", "修身显瘦", "宽松百搭", "防风防水", "耐磨耐脏", "弹力舒适", "简约大方"]
+SCENES = ["日常通勤", "户外徒步", "运动健身", "商务休闲", "旅行度假", "居家休闲", "约会聚会"]
+COLORS = ["黑色", "白色", "灰色", "蓝色", "红色", "卡其色", "藏青色", "军绿色"]
+ACTIVITIES = ["满200减30", "第二件半价", "会员专享8折", "新品上市9折", "限时折扣，直降30元", "买一送一",
+              "暂无活动", "暂无活动", "暂无活动"]
+ORDER_STATUSES = ["待付款", "已付款", "已发货", "已签收", "已取消"]
+COURIERS = ["圆通快递: YT", "中通快递: ZT", "顺丰速运: SF", "韵达快递: YD"]
+
+
+def product_id(n):
+    return f"P{n:07d}"
+
+
+def order_id(n):
+    return str(10_000_000 + n)
+
+
+def user_id(n):
+    """第 n 个订单所属的用户，每个用户约有 订单数/5000 个订单。"""
+    return f"user{n % 5000:04d}"
+
+
+def generate_products(count, seed=0):
+    """生成 (id, name, description, specifications, price, activity) 元组，与 mysql_db.PRODUCT_COLUMNS 顺序一致。"""
+    rng = random.Random(seed)
+    for n in range(count):
+        category, sizes = rng.choice(CATEGORIES)
+        material, feature, scene = rng.choice(MATERIALS), rng.choice(FEATURES), rng.choice(SCENES)
+        colors = "/".join(rng.sample(COLORS, 2))
+        yield (
+            product_id(n),
+            f"{rng.choice(BRANDS)}{material}{category}",
+            f"{material}材质，{feature}，适合{scene}",
+            f"{sizes}（{colors}）",
+            f"{rng.randrange(39, 1500)}元",
+            rng.choice(ACTIVITIES),
+        )
+
+
+def generate_orders(count, product_count, seed=0):
+    """生成订单元组，列顺序与 orders 表一致；每个订单包含 1~3 个合成商品。"""
+    rng = random.Random(seed + 1)
+    for n in range(count):
+        items = [product_id(rng.randrange(product_count)) for _ in range(rng.randint(1, 3))]
+        status = rng.choice(ORDER_STATUSES)
+        day = 1 + n % 28
+        created = f"2024-03-{day:02d} {rng.randrange(24):02d}:{rng.randrange(60):02d}:00"
+        paid = created if status != "待付款" else None
+        shipped = created if status in ("已发货", "已签收") else None
+        received = created if status == "已签收" else None
+        logistics = f"{rng.choice(COURIERS)}{rng.randrange(10**9, 10**10)}" if shipped else None
+        yield (order_id(n), user_id(n), ",".join(items), status,
+               float(rng.randrange(39, 3000)), created, paid, shipped, received, logistics)
+
+
+# --- SQLite 替身 ---
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    specifications TEXT,
+    price TEXT,
+    activity TEXT,
+    price_value REAL,
+    discount_rate REAL,
+    has_activity INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_products_price_value ON products (price_value);
+CREATE INDEX IF NOT EXISTS idx_products_activity_price ON products (has_activity, price_value);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    user_id TEXT,
+    product_ids TEXT,
+    status TEXT,
+    total_amount REAL,
+    create_time TEXT,
+    pay_time TEXT,
+    ship_time TEXT,
+    receive_time TEXT,
+    logistics_info TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_orders_user_time ON orders (user_id, create_time);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, create_time);
+CREATE TABLE IF NOT EXISTS order_items (
+    order_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    product_id TEXT NOT NULL,
+    PRIMARY KEY (order_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items (product_id);
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    name TEXT PRIMARY KEY,
+    applied_at TEXT
+);
+"""
+
+
+class _SQLiteCursor:
+    """把 mysql-connector 风格的调用（%s 占位符、INSERT IGNORE、dictionary 游标、with 语句）转给 sqlite3 游标。"""
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    @staticmethod
+    def _translate(operation):
+        return operation.replace("%s", "?").replace("INSERT IGNORE", "INSERT OR IGNORE")
+
+    def execute(self, operation, params=None):
+        self._cursor.execute(self._translate(operation), tuple(params or ()))
+
+    def executemany(self, operation, seq_params):
+        self._cursor.executemany(self._translate(operation), seq_params)
+
+    def _convert(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._convert(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class _SQLiteConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+    def cursor(self, dictionary=False, **kwargs):
+        return _SQLiteCursor(self._conn.cursor(), dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLiteStandIn:
+    """
+    用 SQLite 文件代替 MySQL：每个线程一条连接（相当于不限大小的连接池），
+    install 之后 mysql_db 和 OrderAgent 的 db_connection 都从这里借连接，SQL span 照常记录。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _SQLiteConnection(self.path)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def db_connection(self):
+        yield tracing.trace_connection(self._connection())
+
+    def install(self):
+        from ecommerce_agent.agents import order_agent
+        mysql_db.db_connection = self.db_connection
+        order_agent.db_connection = self.db_connection
+
+    def create_schema(self):
+        conn = self._connection()
+        conn._conn.executescript(SQLITE_SCHEMA)
+        conn.commit()
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+
+# --- 写入数据 ---
+
+PRODUCT_INSERT = ("INSERT INTO products (id, name, description, specifications, price, activity, "
+                  "price_value, discount_rate, has_activity) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)")
+ORDER_INSERT = ("INSERT INTO orders (order_id, user_id, product_ids, status, total_amount, create_time, "
+                "pay_time, ship_time, receive_time, logistics_info) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_catalog(db_connection, products, orders, upsert=False, chunk_size=5000):
+    """
+    分批写入商品和订单，返回 (商品数, 订单数)。
+    upsert=True 时使用 MySQL 的 ON DUPLICATE KEY UPDATE / REPLACE，可以在已有合成数据的库上重复运行。
+    """
+    product_query = mysql_db._UPSERT_PRODUCTS_QUERY if upsert else PRODUCT_INSERT
+    order_query = ORDER_INSERT.replace("INSERT", "REPLACE", 1) if upsert else ORDER_INSERT
+    counts = [0, 0]
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("无法连接到数据库。")
+        with conn.cursor() as cursor:
+            for chunk in _chunks(products, chunk_size):
+                cursor.executemany(product_query,
+                                   [tuple(p) + derive_product_attributes(p[4], p[5]) for p in chunk])
+                conn.commit()
+                counts[0] += len(chunk)
+            for chunk in _chunks(orders, chunk_size):
+                cursor.executemany(order_query, chunk)
+                # 重复运行时订单的商品可能变化，重写这些订单的 order_items
+                mysql_db.sync_order_items(cursor, [(order[0], order[2]) for order in chunk])
+                conn.commit()
+                counts[1] += len(chunk)
+    return tuple(counts)
+
+
+def build_vector_index(count, dim, factory, model, seed=0, train_size=20000, chunk_size=50000):
+    """为 product_id(0..count-1) 构建合成向量索引。"""
+    # 与 benchmarks/index_benchmark.py 相同的聚类分布
+    from benchmarks.index_benchmark import synthetic_vectors
+    vectors = synthetic_vectors(count, dim, seed)
+    training = None
+    if vector_index.factory_needs_training(factory):
+        rng = np.random.default_rng(seed)
+        training = vectors[rng.choice(count, min(train_size, count), replace=False)]
+    index = vector_index.ProductVectorIndex.create(dim, model, factory, training)
+    for start in range(0, count, chunk_size):
+        stop = min(count, start + chunk_size)
+        ids = [product_id(n) for n in range(start, stop)]
+        index.upsert(ids, vectors[start:stop], [""] * len(ids))
+    return index
+
+
+def build_lexical_index(products):
+    index = LexicalIndex()
+    index.sync({"id": p[0], "name": p[1], "description": p[2], "specifications": p[3]} for p in products)
+    return index
+
+
+def prepare_catalog(size, db="sqlite", workdir=None, dim=128, factory="Flat", model="synthetic",
+                    hybrid=True, orders=None, seed=0):
+    """
+    生成目录并写入数据库，构建向量索引和关键词索引。
+    返回 (SQLite 替身或 None, 向量索引, 关键词索引或 None, 订单数, 各步骤耗时秒数)。
+    """
+    order_count = orders if orders is not None else max(1000, size // 10)
+    timings = {}
+    started = time.perf_counter()
+    if db == "sqlite":
+        path = os.path.join(workdir, f"catalog_{size}.sqlite3")
+        if os.path.exists(path):
+            os.remove(path)
+        stand_in = SQLiteStandIn(path)
+        stand_in.create_schema()
+        stand_in.install()
+        load_catalog(stand_in.db_connection, generate_products(size, seed),
+                     generate_orders(order_count, size, seed))
+    else:
+        stand_in = None
+        mysql_db.init_database()
+        load_catalog(mysql_db.db_connection, generate_products(size, seed),
+                     generate_orders(order_count, size, seed), upsert=True)
+    timings["database_seconds"] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    index = build_vector_index(size, dim, factory, model, seed)
+    timings["faiss_seconds"] = round(time.perf_counter() - started, 2)
+
+    lexical = None
+    if hybrid:
+        started = time.perf_counter()
+        lexical = build_lexical_index(generate_products(size, seed))
+        timings["bm25_seconds"] = round(time.perf_counter() - started, 2)
+    return stand_in, index, lexical, order_count, timings
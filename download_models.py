@@ -4,9 +4,11 @@ import os
 
 # --- 新增：向量化配置 ---
 from ecommerce_agent import mysql_db
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
+from ecommerce_agent import vector_index
+from ecommerce_agent.config import CONTEXT_TOKEN_ENCODING, FAISS_INDEX_FACTORY, TIKTOKEN_CACHE_DIR
+from ecommerce_agent.context_budget import save_encoding
+from ecommerce_agent.embedding_pipeline import EmbeddingPipeline, load_embeddings
+from ecommerce_agent.lexical_index import LexicalIndex
 
 # 定义模型和索引路径
 # 模型将从ModelScope下载到 'embedding' 目录
@@ -93,6 +95,15 @@ def setup_models():
         if not run_command(["modelscope", "download", "--model", model_id, "--cache_dir", download_path]):
             print(f"!!! 下载模型 {model_id} 失败。")
             all_downloads_successful = False
+
+    # 计算 Agent 提示词 token 数使用的 tiktoken 编码，保存到 TIKTOKEN_CACHE_DIR；服务运行时只读取本地文件，不访问网络
+    print(f"\n--- 准备下载 tiktoken 编码: {CONTEXT_TOKEN_ENCODING} ---")
+    try:
+        save_encoding(CONTEXT_TOKEN_ENCODING, TIKTOKEN_CACHE_DIR)
+        print(f"--- tiktoken 编码已保存到 {TIKTOKEN_CACHE_DIR} ---")
+    except Exception as e:
+        print(f"!!! 下载 tiktoken 编码失败，服务将按字符估算提示词 token 数: {e}")
+        all_downloads_successful = False
     
     print("\n" + "="*50)
     if all_downloads_successful:
@@ -119,11 +130,32 @@ def find_model_path(base_dir, owner, model_id_prefix):
             return os.path.join(owner_path, item)
     return None
 
-def create_vector_store():
+def sync_lexical_index(products):
+    """用全量商品增量更新关键词倒排索引，有变化时保存到索引目录。"""
+    try:
+        lexical = LexicalIndex.load(FAISS_INDEX_PATH)
+    except Exception as e:
+        print(f"--- 加载已有关键词索引失败，将完整重建: {e}")
+        lexical = None
+    lexical = lexical or LexicalIndex()
+    stats = lexical.sync(products)
+    summary = (f"新增 {stats['added']}，更新 {stats['updated']}，"
+               f"删除 {stats['removed']}，未变化 {stats['skipped']}")
+    if stats["added"] or stats["updated"] or stats["removed"]:
+        lexical.save(FAISS_INDEX_PATH)
+        print(f"--- 关键词索引已更新: {summary}。")
+    else:
+        print(f"--- 关键词索引已是最新 ({summary})。")
+
+
+def create_vector_store(embeddings=None):
     """
-    从数据库读取商品信息，生成向量索引并保存到本地。
+    从数据库读取商品信息，增量更新本地向量索引和关键词索引。
+    只有新增或内容变化的商品会被重新嵌入，已删除的商品会从索引中移除；
+    没有任何变化时直接跳过，不会加载嵌入模型。
+    embeddings 为已加载的嵌入模型时直接复用（例如服务启动时与 ProductAgent 共用同一份模型）。
     """
-    print("\n>>> 步骤 4/4: 创建商品向量索引...")
+    print("\n>>> 步骤 4/4: 增量更新商品向量索引...")
 
     # 1. 动态查找并检查嵌入模型是否存在
     embedding_model_path = find_model_path(EMBEDDING_DOWNLOAD_DIR, "Ceceliachenen", "bge-large-zh-v1.5")
@@ -132,42 +164,76 @@ def create_vector_store():
         print("请确保模型已通过脚本成功下载。")
         return False
     print(f"--- 找到嵌入模型路径: {embedding_model_path}")
+    model_name = os.path.basename(os.path.normpath(embedding_model_path))
 
-    # 2. 加载嵌入模型
-    print("--- 正在加载嵌入模型 (这可能需要一些时间)...")
-    try:
-        embeddings = HuggingFaceEmbeddings(model_name=embedding_model_path)
-    except Exception as e:
-        print(f"!!! 加载嵌入模型失败: {e}")
-        return False
-    print("--- 嵌入模型加载成功。")
-
-    # 3. 从数据库获取商品数据
+    # 2. 从数据库获取商品数据
     print("--- 正在从数据库获取商品数据...")
     products = mysql_db.get_all_products_for_vectorization()
     if not products:
         print("--- 数据库中没有找到商品，或无法连接数据库。跳过向量化。")
         return True # Not a fatal error, maybe the db is just empty.
 
-    # 4. 准备 LangChain 文档
-    print(f"--- 准备将 {len(products)} 件商品进行向量化...")
-    documents = []
-    for product in products:
-        content = f"商品名称: {product['name']}\n商品描述: {product['description']}"
-        # 将商品ID存储在元数据中，以便后续检索
-        metadata = {"product_id": product['id']}
-        documents.append(Document(page_content=content, metadata=metadata))
+    # 3. 多个 worker 同时启动时只有一个同步和保存索引，其他的等待后会看到已是最新的索引
+    with vector_index.index_write_lock(FAISS_INDEX_PATH):
+        return _sync_indexes(products, embeddings, embedding_model_path, model_name)
+
+
+def _sync_indexes(products, embeddings, embedding_model_path, model_name):
+    """在索引目录的写锁内同步关键词索引和向量索引，返回是否成功。"""
+    # 关键词索引不需要嵌入模型，每次都与数据库同步
+    try:
+        sync_lexical_index(products)
+    except Exception as e:
+        print(f"!!! 更新关键词索引时发生错误: {e}")
+
+    # 加载已有向量索引并计算差异
+    try:
+        # 以 mmap 方式加载：没有变化时不会把向量读入内存
+        index = vector_index.ProductVectorIndex.load(FAISS_INDEX_PATH, mmap=True)
+    except Exception as e:
+        print(f"--- 加载已有索引失败，将完整重建: {e}")
+        index = None
+    if index is not None and index.model != model_name:
+        print(f"--- 索引使用的模型 ({index.model}) 与当前模型不一致，将完整重建。")
+        index = None
+    elif index is not None and index.requested_factory != FAISS_INDEX_FACTORY:
+        print(f"--- 索引类型由 '{index.requested_factory}' 变更为 '{FAISS_INDEX_FACTORY}'，将完整重建。")
+        index = None
+    elif index is not None and index.needs_rebuild():
+        print("--- 索引中已删除的向量过多，将完整重建。")
+        index = None
+
+    to_embed, to_remove, stats = vector_index.plan_index_sync(index, products)
+    summary = (f"新增 {stats['added']}，更新 {stats['updated']}，"
+               f"删除 {stats['removed']}，未变化 {stats['skipped']}")
+    if not to_embed and not to_remove:
+        print(f"--- 向量索引已是最新 ({summary})，跳过向量化。")
+        return True
+
+    # 仅在有商品需要嵌入时才加载嵌入模型
+    if to_embed and embeddings is None:
+        print("--- 正在加载嵌入模型 (这可能需要一些时间)...")
+        try:
+            embeddings = load_embeddings(embedding_model_path)
+        except Exception as e:
+            print(f"!!! 加载嵌入模型失败: {e}")
+            return False
+        print("--- 嵌入模型加载成功。")
 
-    # 5. 创建并保存 FAISS 索引
+    # 应用增量变更并保存索引
     try:
-        print("--- 正在创建 FAISS 索引 (这可能需要几分钟)...")
-        vector_store = FAISS.from_documents(documents, embeddings)
-        os.makedirs(FAISS_INDEX_PATH, exist_ok=True)
-        vector_store.save_local(FAISS_INDEX_PATH)
-        print(f"向量索引成功创建并保存至 '{FAISS_INDEX_PATH}' 目录。")
+        print(f"--- 正在更新 FAISS 索引 ({summary})...")
+        pipeline = EmbeddingPipeline(embeddings) if to_embed else None
+        index = vector_index.apply_index_sync(index, embeddings, model_name, to_embed, to_remove, pipeline=pipeline)
+        index.save(FAISS_INDEX_PATH)
+        print(f"向量索引已更新并保存至 '{FAISS_INDEX_PATH}' 目录: {summary}。")
+        if pipeline:
+            stats = pipeline.stats
+            print(f"--- 嵌入吞吐: {stats['docs']} 个文档，{stats['batches']} 批，"
+                  f"耗时 {stats['seconds']}s ({stats['docs_per_second']} 文档/秒)。")
         return True
     except Exception as e:
-        print(f"!!! 创建或保存 FAISS 索引时发生错误: {e}")
+        print(f"!!! 更新或保存 FAISS 索引时发生错误: {e}")
         return False
 
 
@@ -1,5 +1,6 @@
 from .access_agent import AccessAgent
+from .intent_router import IntentRouter
 from .order_agent import OrderAgent
 from .product_agent import ProductAgent
 
-__all__ = ["AccessAgent", "OrderAgent", "ProductAgent"]
\ No newline at end of file
+__all__ = ["AccessAgent", "IntentRouter", "OrderAgent", "ProductAgent"]
\ No newline at end of file
@@ -1,13 +1,20 @@
 import logging
+import time
 from langchain_openai import ChatOpenAI
 from langchain.agents import create_json_chat_agent, AgentExecutor
-from langchain.memory import ConversationBufferWindowMemory
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain import hub
+from ecommerce_agent import config
+from ecommerce_agent import tracing
+from ecommerce_agent.context_budget import create_context_budget
+from ecommerce_agent.semantic_cache import create_semantic_cache, is_cacheable
+from ecommerce_agent.session_memory import create_session_store
+from ecommerce_agent.thread_pools import run_blocking
+from .intent_router import IntentRouter
+from .prompts import react_chat_json_prompt
 
 
 class AccessAgent:
-    def __init__(self, llm_config, **kwargs): # 移除了不再需要的 embedding_model_path 和 product_vector_path
+    def __init__(self, llm_config, lazy=False, **kwargs): # 移除了不再需要的 embedding_model_path 和 product_vector_path
+        """lazy=True 时商品搜索的嵌入模型和向量索引不在构造时加载，见 ProductAgent。"""
         self.logger = logging.getLogger(__name__)
         self.logger.info("正在初始化 AccessAgent...")
         # 初始化大模型
@@ -17,13 +24,23 @@ class AccessAgent:
         from .order_agent import OrderAgent
         from .product_agent import ProductAgent
 
-        self.order_agent = OrderAgent()
-        self.product_agent = ProductAgent() # ProductAgent不再需要任何参数
+        self.product_agent = ProductAgent(lazy=lazy)
+        # 订单中的商品通过商品Agent的商品行缓存批量展开
+        self.order_agent = OrderAgent(self.product_agent)
+        # 带订单号/商品ID的简单查询直接回答，不经过大模型
+        self.router = IntentRouter(self.order_agent, self.product_agent) if config.INTENT_ROUTER_ENABLED else None
+        # 语义相近的问题复用之前的回答，使用商品搜索的嵌入模型
+        self.semantic_cache = create_semantic_cache()
+
+        # 按 token 预算压缩发给大模型的会话历史和工具输出，并统计每个问题的提示词 token 数
+        self.context = create_context_budget()
 
         # 初始化工具和执行器
         self.tools = self._init_tools()
-        self.memory = self._init_memory()
-        self.executor = self._create_agent_executor()
+        self.sessions = self._init_memory()
+        self.executor = self._create_agent_executor(self.llm)
+        # 流式接口使用的执行器：LLM 以流式 API 调用，逐个 token 触发回调
+        self.streaming_executor = self._create_agent_executor(self.llm.bind(stream=True))
         self.logger.info("AccessAgent 初始化完成。")
 
     def _init_llm(self, config):
@@ -38,43 +55,167 @@ class AccessAgent:
 
     def _init_tools(self):
         """初始化工具集合"""
-        return [
-            self.order_agent.get_tool()
-        ] + self.product_agent.get_tools()
+        return self.order_agent.get_tools() + self.product_agent.get_tools()
 
     def _init_memory(self):
-        """初始化对话记忆"""
-        return ConversationBufferWindowMemory(
-            memory_key="chat_history",
-            return_messages=True,
-            output_key="output",
-            k=10  # 保留最近10轮对话
-        )
+        """初始化按会话隔离的对话记忆（有界的 LRU/TTL 存储，可配置为 Redis 持久化）"""
+        return create_session_store()
 
-    def _create_agent_executor(self):
+    def _create_agent_executor(self, llm):
         """创建Agent执行器"""
         # This agent is better at forcing the model to follow JSON output format for tool calls,
         # which is more compatible with the current model's behavior.
-        prompt = hub.pull("hwchase17/react-chat-json")
-        agent = create_json_chat_agent(self.llm, self.tools, prompt)
+        # 使用本地保存的 "hwchase17/react-chat-json" 提示词，启动时不访问 LangChain Hub
+        prompt = react_chat_json_prompt()
+        agent = self.context.wrap(create_json_chat_agent(llm, self.tools, prompt))
 
+        # 执行器不持有记忆，每次调用时传入对应会话的 chat_history，因此可以被多个会话并发调用
         return AgentExecutor(
             agent=agent,
             tools=self.tools,
-            verbose=True,
-            memory=self.memory,
+            # 逐步打印 Agent 的思考过程和工具输出，只在调试时开启
+            verbose=config.LOG_PAYLOADS,
             handle_parsing_errors=True  # Gracefully handle if the model doesn't output valid JSON
         )
 
-    def handle_question(self, question: str) -> str:
-        """处理用户问题的入口"""
-        self.logger.info(f"AccessAgent 开始处理问题: '{question}'")
+    def handle_question(self, question: str, session_id: str = None, callbacks=None, question_vector=None) -> str:
+        """
+        处理用户问题的入口。
+        session_id 标识一个对话：同一会话共享历史并按顺序处理，不同会话可以并发处理；
+        未提供 session_id 时不携带也不保存历史。callbacks 用于流式输出执行过程。
+        question_vector 为批量处理时预先算好的问题向量，用于查询语义缓存。
+        """
+        self.logger.info(f"AccessAgent 开始处理问题: '{question}' (session={session_id})")
+        with tracing.span("question", session=session_id is not None, streaming=bool(callbacks)):
+            if session_id is None:
+                output = self._invoke(question, [], callbacks, question_vector)
+            else:
+                with self.sessions.lock(session_id):
+                    output = self._invoke(question, self.sessions.get_messages(session_id), callbacks, question_vector)
+                    if output is not None:
+                        self.sessions.append(session_id, question, output)
+        return output if output is not None else "处理您的问题时发生了内部错误，请检查后端日志。"
+
+    def _invoke(self, question, chat_history, callbacks=None, question_vector=None):
+        """
+        先尝试由意图路由直接回答，否则调用 Agent Executor。
+        出错时返回 None（会话模式下不把错误信息写入历史）。
+        """
+        if self.router:
+            response = self.router.route(question)
+            if response is not None:
+                self._trace_path("router")
+                return response
+        cached, vector, version = self._semantic_lookup(question, question_vector, chat_history)
+        if cached is not None:
+            self._trace_path("semantic_cache")
+            return cached
         self.logger.info("即将调用 Agent Executor...")
+        self._trace_path("agent")
         try:
-            result = self.executor.invoke({"input": question})
-            self.logger.info(f"Agent Executor 调用完成。原始返回: {result}")
-            output = result.get("output", "未能获取到输出。")
-            return output.strip()
+            started = time.monotonic()
+            executor = self.streaming_executor if callbacks else self.executor
+            report = self.context.start_report()
+            result = executor.invoke({"input": question, "chat_history": chat_history},
+                                     config={"callbacks": self._callbacks(callbacks, report)})
+            self.context.record(report)
+            if self.router:
+                self.router.record_agent(time.monotonic() - started)
+            if config.LOG_PAYLOADS:
+                self.logger.info(f"Agent Executor 调用完成。原始返回: {result}")
+            output = result.get("output", "未能获取到输出。").strip()
+            if vector is not None:
+                self.semantic_cache.store(vector, question, output, version)
+            return output
         except Exception as e:
             self.logger.error(f"调用 Agent Executor 时发生异常: {e}", exc_info=True)
-            return "处理您的问题时发生了内部错误，请检查后端日志。"
\ No newline at end of file
+            return None
+
+    def _semantic_lookup(self, question, vector=None, chat_history=None):
+        """
+        查询语义缓存，返回 (缓存的回答, 问题向量, 目录版本)；vector 为预先算好的问题向量。
+        问题不可缓存或商品搜索尚未就绪时向量为 None，Agent 的回答也不会写入缓存
+        （避免把 "搜索正在启动中" 之类的临时回答缓存下来）。
+        会话已有历史时同样跳过：回答可能依赖上文（如 "哪个更便宜"），不能作为全局条目提供给其他会话。
+        """
+        embeddings = self.product_agent.embeddings
+        if self.semantic_cache is None or embeddings is None or self.product_agent.vector_store is None:
+            return None, None, None
+        if chat_history or not is_cacheable(question):
+            self.semantic_cache.skip()
+            return None, None, None
+        version = self.product_agent.catalog_version
+        try:
+            if vector is None:
+                with tracing.span("embedding", texts=1):
+                    vector = embeddings.embed_query(question)
+            answer, _ = self.semantic_cache.lookup(vector, version)
+        except Exception as e:
+            self.logger.warning(f"查询语义缓存失败: {e}")
+            return None, None, None
+        return answer, vector, version
+
+    @staticmethod
+    def _callbacks(callbacks, report):
+        """执行器的回调：调用方的回调、追踪回调和提示词 token 统计。"""
+        return list(tracing.with_tracing(callbacks) or []) + [report]
+
+    @staticmethod
+    def _trace_path(path):
+        """在问题 span 上记录处理路径：router、semantic_cache 或 agent。"""
+        span = tracing.current_span()
+        if span is not None:
+            span.set(path=path)
+
+    def semantic_cache_candidates(self, questions):
+        """返回需要查询语义缓存的问题（供批量处理预先整批嵌入），语义缓存不可用时返回空列表。"""
+        if self.semantic_cache is None or self.product_agent.embeddings is None \
+                or self.product_agent.vector_store is None:
+            return []
+        return [question for question in questions if is_cacheable(question)]
+
+    async def ahandle_question(self, question: str, session_id: str = None, callbacks=None) -> str:
+        """handle_question 的异步版本，供 ASGI 服务使用；工具调用在有界线程池中执行。"""
+        self.logger.info(f"AccessAgent 开始异步处理问题: '{question}' (session={session_id})")
+        with tracing.span("question", session=session_id is not None, streaming=bool(callbacks)):
+            if session_id is None:
+                output = await self._ainvoke(question, [], callbacks)
+            else:
+                async with self.sessions.async_lock(session_id):
+                    # 会话后端可能是 Redis，读写放到 db 线程池中
+                    history = await run_blocking("db", self.sessions.get_messages, session_id)
+                    output = await self._ainvoke(question, history, callbacks)
+                    if output is not None:
+                        await run_blocking("db", self.sessions.append, session_id, question, output)
+        return output if output is not None else "处理您的问题时发生了内部错误，请检查后端日志。"
+
+    async def _ainvoke(self, question, chat_history, callbacks=None):
+        if self.router:
+            response = await self.router.aroute(question)
+            if response is not None:
+                self._trace_path("router")
+                return response
+        # 问题嵌入是 CPU 密集的，在 search 线程池中执行
+        cached, vector, version = await run_blocking("search", self._semantic_lookup, question, None, chat_history)
+        if cached is not None:
+            self._trace_path("semantic_cache")
+            return cached
+        self._trace_path("agent")
+        try:
+            started = time.monotonic()
+            executor = self.streaming_executor if callbacks else self.executor
+            report = self.context.start_report()
+            result = await executor.ainvoke({"input": question, "chat_history": chat_history},
+                                            config={"callbacks": self._callbacks(callbacks, report)})
+            self.context.record(report)
+            if self.router:
+                self.router.record_agent(time.monotonic() - started)
+            if config.LOG_PAYLOADS:
+                self.logger.info(f"Agent Executor 异步调用完成。原始返回: {result}")
+            output = result.get("output", "未能获取到输出。").strip()
+            if vector is not None:
+                self.semantic_cache.store(vector, question, output, version)
+            return output
+        except Exception as e:
+            self.logger.error(f"异步调用 Agent Executor 时发生异常: {e}", exc_info=True)
+            return None
@@ -0,0 +1,233 @@
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+
+from ecommerce_agent.thread_pools import run_blocking
+
+# --- 意图路由 ---
+# "订单12345到哪了"、"商品P101多少钱" 这类问题只需要一次数据库查询，却要经过至少两次大模型调用。
+# 路由器用正则识别这类问题，直接调用订单/商品查询并按模板回答；只要问题里还有识别不了的内容
+# （多个ID、"为什么"、"推荐"、"比较" 等），就交给 Agent 处理，宁可少拦截也不答偏。
+
+Intent = namedtuple("Intent", ["kind", "entity_id", "aspect"])
+
+ORDER_ID_PATTERN = re.compile(r"订单\s*(?:号|编号|ID)?\s*[:：#]?\s*(\d{3,20})", re.IGNORECASE)
+PRODUCT_ID_PATTERN = re.compile(
+    r"(?:商品|产品)\s*(?:ID|编号|号)?\s*[:：#]?\s*([A-Za-z]{0,3}\d{2,10})(?![A-Za-z0-9])"
+    r"|(?<![A-Za-z0-9])([A-Za-z]\d{2,10})(?![A-Za-z0-9])",
+    re.IGNORECASE,
+)
+
+# 各类问题关注的方面及其关键词，按顺序匹配
+ORDER_ASPECTS = [
+    ("logistics", ("到哪", "物流", "快递", "发货", "运单", "签收", "送到", "到了")),
+    ("status", ("状态", "进度", "怎么样")),
+    ("amount", ("多少钱", "金额", "总价", "花了")),
+    ("products", ("买了什么", "哪些商品", "什么商品", "商品")),
+    ("detail", ("信息", "详情", "情况", "查询", "查", "看看")),
+]
+PRODUCT_ASPECTS = [
+    ("price", ("多少钱", "价格", "价钱", "售价", "多贵", "几块")),
+    ("activity", ("活动", "优惠", "折扣", "促销", "打折", "满减")),
+    ("specs", ("规格", "尺码", "尺寸", "颜色", "型号", "配置")),
+    ("detail", ("介绍", "详情", "信息", "怎么样", "查询", "查", "看看")),
+]
+
+# 去掉ID和方面关键词后允许剩下的语气词、客套话；还有其他内容时不走快速路径
+FILLER_PATTERN = re.compile(
+    r"帮我|帮忙|麻烦|请问|请|你好|您好|一下|我的|我|这个|这款|现在|目前|那个|"
+    r"是|有|什么|多少|了|的|里|吗|呢|啊|吧|呀|哦|"
+    r"[\s?？!！,，.。:：~～]"
+)
+
+
+class IntentRouter:
+    """
+    在 AccessAgent 之前识别可以直接回答的订单/商品查询。
+    route 返回模板化的回答，不能直接回答时返回 None，由调用方交给 Agent；
+    stats 报告直接回答的比例，以及与 Agent 平均耗时相比节省的时间。
+    """
+
+    def __init__(self, order_agent, product_agent):
+        self.logger = logging.getLogger(__name__)
+        self.order_agent = order_agent
+        self.product_agent = product_agent
+        self._lock = threading.Lock()
+        self._questions = 0
+        self._direct = 0
+        self._fallback = 0      # 识别成功但查询出错，转交 Agent
+        self._direct_seconds = 0.0
+        self._agent_calls = 0
+        self._agent_seconds = 0.0
+        self._by_intent = {}
+
+    @staticmethod
+    def _match_aspect(text, aspects):
+        found = []
+        for aspect, keywords in aspects:
+            for keyword in keywords:
+                if keyword in text:
+                    found.append(aspect)
+                    text = text.replace(keyword, "")
+        return found, text
+
+    def classify(self, question):
+        """识别可直接回答的问题，返回 Intent；不能确定时返回 None。"""
+        if not isinstance(question, str) or len(question) > 100:
+            return None
+        orders = ORDER_ID_PATTERN.findall(question)
+        products = [a or b for a, b in PRODUCT_ID_PATTERN.findall(question)]
+        # 出现多个ID（包括订单和商品同时出现）时交给 Agent
+        if len(orders) + len(products) != 1:
+            return None
+
+        if orders:
+            kind, entity_id, aspects = "order", orders[0], ORDER_ASPECTS
+            rest = ORDER_ID_PATTERN.sub("", question)
+        else:
+            kind, entity_id, aspects = "product", products[0], PRODUCT_ASPECTS
+            rest = PRODUCT_ID_PATTERN.sub("", question)
+
+        found, rest = self._match_aspect(rest, aspects)
+        if FILLER_PATTERN.sub("", rest):
+            return None
+        # 问到多个方面时给出完整信息
+        aspect = found[0] if len(set(found)) == 1 else "detail"
+        return Intent(kind, entity_id, aspect)
+
+    def answer(self, intent):
+        """按模板回答；查询出错时返回 None，由 Agent 处理。"""
+        if intent.kind == "order":
+            row, error = self.order_agent.fetch_order(intent.entity_id)
+            if error:
+                return None
+            return self._format_order(intent, row)
+        row, error = self.product_agent.fetch_product(intent.entity_id)
+        if error:
+            return None
+        return self._format_product(intent, row)
+
+    @staticmethod
+    def _format_order(intent, row):
+        order_id = intent.entity_id
+        if not row:
+            return f"未找到订单编号为 {order_id} 的信息，请确认订单号是否正确。"
+        status = row.get("status") or "未知"
+        logistics = row.get("logistics_info")
+        receive_time = row.get("receive_time")
+        if intent.aspect == "logistics":
+            text = f"订单 {order_id} 当前状态：{status}。"
+            text += f"物流信息：{logistics}。" if logistics else "暂无物流信息。"
+            if receive_time:
+                text += f"签收时间：{receive_time}。"
+            return text
+        if intent.aspect == "status":
+            return f"订单 {order_id} 当前状态：{status}。"
+        if intent.aspect == "amount":
+            return f"订单 {order_id} 的总金额为 {row.get('total_amount') or '未知'} 元。"
+        if intent.aspect == "products":
+            return f"订单 {order_id} 包含的商品ID：{row.get('product_ids') or '未知'}。"
+        lines = [
+            f"订单 {order_id} 的信息如下：",
+            f"- 状态：{status}",
+            f"- 总金额：{row.get('total_amount') or '未知'} 元",
+            f"- 创建时间：{row.get('create_time') or '未知'}",
+            f"- 签收时间：{receive_time or '未知'}",
+            f"- 商品ID：{row.get('product_ids') or '未知'}",
+        ]
+        if logistics:
+            lines.append(f"- 物流信息：{logistics}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_product(intent, row):
+        product_id = intent.entity_id
+        if not row:
+            return f"未找到商品ID为 {product_id} 的商品，请确认商品ID是否正确。"
+        name = f"{row.get('name') or '该商品'}（商品ID {row.get('id') or product_id}）"
+        activity = row.get("activity")
+        if intent.aspect == "price":
+            text = f"{name}的价格是 {row.get('price') or '未知'}。"
+            if activity:
+                text += f"当前活动：{activity}。"
+            return text
+        if intent.aspect == "activity":
+            return f"{name}当前的活动：{activity}。" if activity else f"{name}目前没有活动。"
+        if intent.aspect == "specs":
+            return f"{name}的规格：{row.get('specifications') or '未知'}。"
+        return "\n".join([
+            f"{name}的详细信息：",
+            f"- 描述：{row.get('description') or '未知'}",
+            f"- 规格：{row.get('specifications') or '未知'}",
+            f"- 价格：{row.get('price') or '未知'}",
+            f"- 活动：{activity or '暂无'}",
+        ])
+
+    def route(self, question):
+        """尝试直接回答问题，返回回答文本；需要交给 Agent 时返回 None。"""
+        intent = self.classify(question)
+        if intent is None:
+            self._record(None)
+            return None
+        return self._answer_timed(intent)
+
+    async def aroute(self, question):
+        """route 的异步版本，数据库查询在 db 线程池中执行。"""
+        intent = self.classify(question)
+        if intent is None:
+            self._record(None)
+            return None
+        return await run_blocking("db", self._answer_timed, intent)
+
+    def _answer_timed(self, intent):
+        started = time.monotonic()
+        try:
+            response = self.answer(intent)
+        except Exception as e:
+            self.logger.error(f"意图路由处理 {intent} 时出错: {e}", exc_info=True)
+            response = None
+        elapsed = time.monotonic() - started
+        self._record(intent, response is not None, elapsed)
+        if response is not None:
+            self.logger.info(f"意图路由直接回答 {intent}，耗时 {elapsed * 1000:.1f}ms。")
+        return response
+
+    def _record(self, intent, answered=False, seconds=0.0):
+        with self._lock:
+            self._questions += 1
+            if intent is None:
+                return
+            if answered:
+                self._direct += 1
+                self._direct_seconds += seconds
+                key = f"{intent.kind}.{intent.aspect}"
+                self._by_intent[key] = self._by_intent.get(key, 0) + 1
+            else:
+                self._fallback += 1
+
+    def record_agent(self, seconds):
+        """记录一次 Agent 处理的耗时，用于估算直接回答节省的时间。"""
+        with self._lock:
+            self._agent_calls += 1
+            self._agent_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            avg_direct = self._direct_seconds / self._direct if self._direct else None
+            avg_agent = self._agent_seconds / self._agent_calls if self._agent_calls else None
+            saved = None
+            if avg_agent is not None and avg_direct is not None:
+                saved = round(self._direct * (avg_agent - avg_direct), 3)
+            return {
+                "questions": self._questions,
+                "direct": self._direct,
+                "fallback_on_error": self._fallback,
+                "direct_rate": round(self._direct / self._questions, 4) if self._questions else 0.0,
+                "by_intent": dict(self._by_intent),
+                "avg_direct_ms": round(avg_direct * 1000, 1) if avg_direct is not None else None,
+                "avg_agent_ms": round(avg_agent * 1000, 1) if avg_agent is not None else None,
+                # 按 Agent 平均耗时估算：直接回答次数 × (Agent 平均耗时 - 直接回答平均耗时)
+                "estimated_seconds_saved": saved,
+            }
@@ -1,69 +1,386 @@
 import logging
-from ecommerce_agent.mysql_db import get_db_connection
+import re
+from typing import List, Optional, Union
+from ecommerce_agent import config
+from ecommerce_agent import mysql_db
+from ecommerce_agent.mysql_db import db_connection
+from ecommerce_agent.agents.product_agent import format_product_line
+from ecommerce_agent.thread_pools import run_blocking
+
+# 订单状态的常见说法 -> 数据库中的状态值
+ORDER_STATUS_ALIASES = {
+    "未发货": ["待付款", "已付款"],
+    "还没发货": ["待付款", "已付款"],
+    "待发货": ["已付款"],
+    "未付款": ["待付款"],
+    "运输中": ["已发货"],
+    "未签收": ["已发货"],
+    "已完成": ["已签收"],
+}
+STATUS_SEPARATORS = re.compile(r"[,，、/\s]+")
+
+
+def parse_statuses(status):
+    """把 "已付款,待付款"、"未发货" 这类输入转换为状态值列表（去重，保持顺序）。"""
+    statuses = []
+    for part in STATUS_SEPARATORS.split(status or ""):
+        if part:
+            statuses.extend(ORDER_STATUS_ALIASES.get(part, [part]))
+    return list(dict.fromkeys(statuses))
 
 
 class OrderAgent:
-    def __init__(self):
+    def __init__(self, product_agent=None):
+        """product_agent 用于通过其商品行缓存展开订单中的商品；未提供时直接查询数据库。"""
         self.logger = logging.getLogger(__name__)
+        self.product_agent = product_agent
         # 初始化订单查询工具
+        self.order_details_tool = self._create_order_details_tool()
         self.order_tool = self._create_order_tool()
+        self.list_orders_tool = self._create_list_orders_tool()
 
-    def _create_order_tool(self):
-        """创建订单查询工具"""
-        from langchain_core.tools import StructuredTool
-
-        def query_order_with_product(order_id: str):
-            """查询订单信息（含商品ID）"""
-            self.logger.info(f"OrderAgent 工具被调用: query_order_with_product, 参数 order_id='{order_id}'")
-            conn = get_db_connection()
+    def fetch_orders(self, order_ids):
+        """
+        一次 WHERE order_id IN (...) 查询多个订单，返回 ({订单号: 行字典}, 错误信息)，不存在的订单不出现在结果中。
+        无法连接数据库或查询出错时字典为 None、错误信息为面向用户的文本。
+        """
+        order_ids = list(dict.fromkeys(order_ids))
+        if not order_ids:
+            return {}, None
+        with db_connection() as conn:
             if not conn:
                 self.logger.error("OrderAgent 无法获取数据库连接。")
-                return "错误：无法连接到数据库。"
+                return None, "错误：无法连接到数据库。"
 
             try:
-                cursor = conn.cursor(dictionary=True)  # 使用字典游标，方便按列名获取数据
-                cursor.execute("""
-                               SELECT status, logistics_info, total_amount, create_time, product_ids, receive_time
-                               FROM orders
-                               WHERE order_id = %s
-                               """, (order_id,))
-                result = cursor.fetchone()
-                conn.close()
-
-                if not result:
-                    self.logger.warning(f"在数据库中未找到订单: '{order_id}'")
-                    return f"未找到订单编号为 {order_id} 的信息"
-                
-                self.logger.info(f"数据库查询成功，订单 '{order_id}' 的信息: {result}")
-                # 从字典中安全地获取值
-                status = result.get("status")
-                logistics = result.get("logistics_info")
-                amount = result.get("total_amount")
-                create_time = result.get("create_time")
-                product_ids = result.get("product_ids")
-                receive_time = result.get("receive_time")
-
-                response = f"订单 {order_id} 信息：\n"
-                response += f"- 状态：[{status or '未知'}]\n"
-                response += f"- 总金额：[{amount or '未知'}元]\n"
-                response += f"- 创建时间：[{create_time or '未知'}]\n"
-                response += f"- 签收时间：[{receive_time or '未知'}]\n"
-                response += f"- 商品ID：[{product_ids or '未知'}]\n"
-                if logistics:
-                    response += f"- 物流信息：[{logistics}]"
-                
-                self.logger.info(f"为订单 '{order_id}' 生成的最终回复: {response}")
-                return response
+                with conn.cursor(dictionary=True) as cursor:  # 使用字典游标，方便按列名获取数据
+                    cursor.execute(f"""
+                                   SELECT order_id, status, logistics_info, total_amount, create_time, product_ids, receive_time
+                                   FROM orders
+                                   WHERE order_id IN ({','.join(['%s'] * len(order_ids))})
+                                   """, order_ids)
+                    rows = cursor.fetchall()
+            except Exception as e:
+                self.logger.error(f"查询订单 {order_ids} 时发生数据库错误: {e}", exc_info=True)
+                return None, f"查询失败：{str(e)}"
+
+        results = {str(row["order_id"]): row for row in rows}
+        missing = [order_id for order_id in order_ids if order_id not in results]
+        if missing:
+            self.logger.warning(f"在数据库中未找到订单: {missing}")
+        if config.LOG_PAYLOADS:
+            self.logger.info(f"数据库查询成功，订单信息: {results}")
+        return results, None
+
+    def fetch_order(self, order_id):
+        """
+        查询订单行，返回 (行字典, 错误信息)。
+        订单不存在时两者均为 None；无法连接数据库或查询出错时行为 None、错误信息为面向用户的文本。
+        """
+        results, error = self.fetch_orders([order_id])
+        if error:
+            return None, error
+        return results.get(order_id), None
+
+    def _fetch_products(self, product_ids):
+        """批量取商品行（优先读商品行缓存，未命中的一次 WHERE id IN 查询），返回 ({商品ID: 行字典}, 错误信息)。"""
+        if not product_ids:
+            return {}, None
+        try:
+            if self.product_agent is not None:
+                rows = self.product_agent.product_cache.get_many(product_ids)
+            else:
+                rows = mysql_db.fetch_products_by_ids(product_ids)
+        except Exception as e:
+            self.logger.error(f"查询订单商品时发生数据库错误: {e}", exc_info=True)
+            return None, f"查询失败：{str(e)}"
+        if rows is None:
+            return None, "错误：无法连接到数据库。"
+        return rows, None
+
+    def fetch_order_details(self, order_id):
+        """
+        查询订单并展开其中的商品，返回 (订单行字典, 错误信息)。
+        订单行中 "products" 为 [(商品ID, 商品行字典或None)]，按下单顺序排列；订单不存在时两者均为 None。
+        订单和商品明细（order_items）一次连接查询，商品详情再一次批量查询，与商品数量无关。
+        """
+        with db_connection() as conn:
+            if not conn:
+                self.logger.error("OrderAgent 无法获取数据库连接。")
+                return None, "错误：无法连接到数据库。"
+            try:
+                with conn.cursor(dictionary=True) as cursor:
+                    cursor.execute("""
+                        SELECT o.order_id, o.status, o.logistics_info, o.total_amount, o.create_time,
+                               o.receive_time, o.product_ids, i.product_id
+                        FROM orders o
+                        LEFT JOIN order_items i ON i.order_id = o.order_id
+                        WHERE o.order_id = %s
+                        ORDER BY i.position
+                    """, (order_id,))
+                    rows = cursor.fetchall()
             except Exception as e:
                 self.logger.error(f"查询订单 '{order_id}' 时发生数据库错误: {e}", exc_info=True)
-                return f"查询失败：{str(e)}"
+                return None, f"查询失败：{str(e)}"
+        if not rows:
+            self.logger.warning(f"在数据库中未找到订单: '{order_id}'")
+            return None, None
+
+        order = {key: value for key, value in rows[0].items() if key != "product_id"}
+        product_ids = [row["product_id"] for row in rows if row["product_id"]]
+        if not product_ids:
+            # 尚未迁移到 order_items 的订单退回使用 product_ids 列
+            product_ids = [pid for _, _, pid in mysql_db.order_item_rows(order_id, order.get("product_ids"))]
+        products, error = self._fetch_products(product_ids)
+        if error:
+            return None, error
+        order["products"] = [(product_id, products.get(product_id)) for product_id in product_ids]
+        return order, None
+
+    def _create_order_details_tool(self):
+        """创建订单+商品详情的组合查询工具，一次调用返回订单及其全部商品的信息"""
+        from langchain_core.tools import StructuredTool
+
+        def query_order_details(order_id: str):
+            """查询订单信息，并展开订单中每个商品的名称、规格、价格和活动"""
+            self.logger.info(f"OrderAgent 工具被调用: query_order_details, 参数 order_id='{order_id}'")
+            order, error = self.fetch_order_details(order_id)
+            if error:
+                return error
+            if not order:
+                return f"未找到订单编号为 {order_id} 的信息"
+
+            lines = [
+                f"订单 {order_id} 信息：",
+                f"- 状态：[{order.get('status') or '未知'}]",
+                f"- 总金额：[{order.get('total_amount') or '未知'}元]",
+                f"- 创建时间：[{order.get('create_time') or '未知'}]",
+                f"- 签收时间：[{order.get('receive_time') or '未知'}]",
+            ]
+            if order.get("logistics_info"):
+                lines.append(f"- 物流信息：[{order['logistics_info']}]")
+            lines.append(f"- 商品（共{len(order['products'])}件）：")
+            for i, (product_id, p) in enumerate(order["products"], 1):
+                if p is None:
+                    lines.append(f"  {i}. {format_product_line(product_id, None)}")
+                    continue
+                lines.append(f"  {i}. {format_product_line(product_id, p)}")
+                if p.get("description"):
+                    lines.append(f"     描述：{p['description']}")
+            response = "\n".join(lines)
+            if config.LOG_PAYLOADS:
+                self.logger.info(f"为订单 '{order_id}' 生成的最终回复: {response}")
+            return response
+
+        async def aquery_order_details(order_id: str):
+            """异步版本：在 db 线程池中查询"""
+            return await run_blocking("db", query_order_details, order_id)
+
+        return StructuredTool.from_function(
+            func=query_order_details,
+            coroutine=aquery_order_details,
+            name="query_order_details",
+            description=("查询订单详情，并一次性展开订单中每个商品的名称、规格、价格、活动和描述，"
+                         "参数为order_id（订单编号，如12345）。用户问订单里买了什么、订单中商品的价格/活动/规格等问题时"
+                         "优先使用本工具，不需要再对订单中的商品逐个调用 query_product。")
+        )
+
+    def list_orders(self, user_id=None, statuses=None, order_id=None, limit=None):
+        """
+        按用户或订单号查询订单，可再按状态过滤（按下单时间从新到旧），返回 (订单列表, 错误信息)。
+        必须提供 user_id 或 order_id：只按状态查询会返回所有用户的订单，不对 Agent 开放。
+        每个订单为行字典，"items" 为 [{"product_id", "name", "price"}]；订单、商品明细和商品名称价格在一次连接查询中取回，
+        走 orders 表的 (user_id, create_time) / (status, create_time) 索引。
+        """
+        if not user_id and not order_id:
+            return None, "请提供用户ID或订单号；订单状态只能在此基础上过滤，不能单独查询所有用户的订单。"
+        limit = max(1, min(int(limit or config.ORDER_LIST_LIMIT), config.ORDER_LIST_MAX))
+        conditions, params = [], []
+        if order_id:
+            conditions.append("order_id = %s")
+            params.append(order_id)
+        if user_id:
+            conditions.append("user_id = %s")
+            params.append(user_id)
+        if statuses:
+            conditions.append(f"status IN ({','.join(['%s'] * len(statuses))})")
+            params.extend(statuses)
+
+        with db_connection() as conn:
+            if not conn:
+                self.logger.error("OrderAgent 无法获取数据库连接。")
+                return None, "错误：无法连接到数据库。"
+            try:
+                with conn.cursor(dictionary=True) as cursor:
+                    cursor.execute(f"""
+                        SELECT o.order_id, o.user_id, o.status, o.total_amount, o.create_time, o.logistics_info,
+                               i.product_id, p.name AS product_name, p.price AS product_price
+                        FROM (SELECT order_id, user_id, status, total_amount, create_time, logistics_info
+                              FROM orders
+                              WHERE {' AND '.join(conditions)}
+                              ORDER BY create_time DESC
+                              LIMIT %s) o
+                        LEFT JOIN order_items i ON i.order_id = o.order_id
+                        LEFT JOIN products p ON p.id = i.product_id
+                        ORDER BY o.create_time DESC, o.order_id, i.position
+                    """, params + [limit])
+                    rows = cursor.fetchall()
+            except Exception as e:
+                self.logger.error(f"查询订单列表时发生数据库错误: {e}", exc_info=True)
+                return None, f"查询失败：{str(e)}"
+
+        orders = {}
+        for row in rows:
+            order = orders.get(row["order_id"])
+            if order is None:
+                order = {key: row[key] for key in
+                         ("order_id", "user_id", "status", "total_amount", "create_time", "logistics_info")}
+                order["items"] = []
+                orders[row["order_id"]] = order
+            if row["product_id"] is not None:
+                order["items"].append({"product_id": row["product_id"], "name": row["product_name"],
+                                       "price": row["product_price"]})
+        return list(orders.values()), None
+
+    @staticmethod
+    def _format_order_list(orders, conditions):
+        lines = [f"找到 {len(orders)} 个订单（{conditions}，按下单时间从新到旧）："]
+        for i, order in enumerate(orders, 1):
+            line = (f"{i}. 订单 {order['order_id']} [{order['status'] or '未知'}] "
+                    f"下单时间 {order['create_time'] or '未知'}，总金额 {order['total_amount'] or '未知'}元")
+            if order["logistics_info"]:
+                line += f"，物流 {order['logistics_info']}"
+            lines.append(line)
+            # 商品已删除时名称和价格为空，仍然列出商品ID
+            items = "、".join(f"{item['product_id']} {item['name'] or '（商品不存在）'}"
+                             + (f"（{item['price']}）" if item["price"] else "") for item in order["items"])
+            lines.append(f"   商品：{items or '无'}")
+        return "\n".join(lines)
+
+    def _create_list_orders_tool(self):
+        """创建订单列表查询工具（按用户/状态，附带商品名称和价格）"""
+        from langchain_core.tools import StructuredTool
+
+        def list_orders(user_id: Optional[str] = None, status: Optional[str] = None,
+                        order_id: Optional[str] = None, limit: Optional[int] = None):
+            """按用户ID或订单号查询订单（可按状态过滤），附带每个订单的商品名称和价格"""
+            self.logger.info(f"OrderAgent 工具被调用: list_orders, 参数 user_id='{user_id}', status='{status}', "
+                             f"order_id='{order_id}', limit={limit}")
+            statuses = parse_statuses(status)
+            orders, error = self.list_orders(user_id, statuses, order_id, limit)
+            if error:
+                return error
+            conditions = "，".join(filter(None, [
+                f"用户 {user_id}" if user_id else "",
+                f"状态 {'/'.join(statuses)}" if statuses else "",
+                f"订单号 {order_id}" if order_id else "",
+            ]))
+            if not orders:
+                return f"没有找到符合条件（{conditions}）的订单"
+            response = self._format_order_list(orders, conditions)
+            if config.LOG_PAYLOADS:
+                self.logger.info(f"订单列表查询的最终回复: {response}")
+            return response
+
+        async def alist_orders(user_id: Optional[str] = None, status: Optional[str] = None,
+                               order_id: Optional[str] = None, limit: Optional[int] = None):
+            """异步版本：在 db 线程池中查询"""
+            return await run_blocking("db", list_orders, user_id, status, order_id, limit)
+
+        return StructuredTool.from_function(
+            func=list_orders,
+            coroutine=alist_orders,
+            name="list_orders",
+            description=("按用户ID查询订单列表（可再按订单状态过滤）（按下单时间从新到旧），每个订单附带商品ID、名称和价格，"
+                         "也可以只传 order_id 查看单个订单买了哪些商品。"
+                         "输入为 JSON 对象：{\"user_id\": \"用户ID，如 user001\", "
+                         "\"status\": \"订单状态，多个用逗号分隔：待付款/已付款/已发货/已签收/已取消，"
+                         "'未发货' 表示待付款和已付款\", \"order_id\": \"订单编号\", "
+                         f"\"limit\": 返回的订单数（默认{config.ORDER_LIST_LIMIT}，最多{config.ORDER_LIST_MAX}）}}，"
+                         "必须提供 user_id 或 order_id，不能只按 status 查询。用户问 '我最近的订单' 但没有给出用户ID时，先询问用户ID。")
+        )
+
+    def _format_order_summaries(self, order_ids):
+        """一次查询多个订单，每个订单一行，按 order_ids 的顺序排列。"""
+        queried, skipped = order_ids[:config.QUERY_MAX_IDS], order_ids[config.QUERY_MAX_IDS:]
+        results, error = self.fetch_orders(queried)
+        if error:
+            return error
+        lines = [f"共查询 {len(queried)} 个订单："]
+        for i, order_id in enumerate(queried, 1):
+            order = results.get(order_id)
+            if order is None:
+                lines.append(f"{i}. 订单 {order_id}：未找到该订单")
+                continue
+            line = (f"{i}. 订单 {order_id} [{order.get('status') or '未知'}]｜总金额 {order.get('total_amount') or '未知'}元"
+                    f"｜创建 {order.get('create_time') or '未知'}｜签收 {order.get('receive_time') or '未知'}"
+                    f"｜商品ID {order.get('product_ids') or '未知'}")
+            if order.get("logistics_info"):
+                line += f"｜物流 {order['logistics_info']}"
+            lines.append(line)
+        if skipped:
+            lines.append(f"一次最多查询 {config.QUERY_MAX_IDS} 个订单，其余 {len(skipped)} 个"
+                         f"（{'、'.join(skipped)}）请再次调用本工具查询。")
+        return "\n".join(lines)
+
+    def _create_order_tool(self):
+        """创建订单查询工具"""
+        from langchain_core.tools import StructuredTool
+
+        def query_order_with_product(order_id: Union[str, List[str]]):
+            """查询订单信息（含商品ID），传入订单号列表时一次查询多个订单"""
+            self.logger.info(f"OrderAgent 工具被调用: query_order_with_product, 参数 order_id={order_id!r}")
+            order_ids = mysql_db.split_ids(order_id)
+            if not order_ids:
+                return "请提供订单编号。"
+            if len(order_ids) > 1:
+                response = self._format_order_summaries(order_ids)
+                if config.LOG_PAYLOADS:
+                    self.logger.info(f"为订单 {order_ids} 生成的最终回复: {response}")
+                return response
+
+            order_id = order_ids[0]
+            result, error = self.fetch_order(order_id)
+            if error:
+                return error
+            if not result:
+                return f"未找到订单编号为 {order_id} 的信息"
+
+            # 从字典中安全地获取值
+            status = result.get("status")
+            logistics = result.get("logistics_info")
+            amount = result.get("total_amount")
+            create_time = result.get("create_time")
+            product_ids = result.get("product_ids")
+            receive_time = result.get("receive_time")
+
+            response = f"订单 {order_id} 信息：\n"
+            response += f"- 状态：[{status or '未知'}]\n"
+            response += f"- 总金额：[{amount or '未知'}元]\n"
+            response += f"- 创建时间：[{create_time or '未知'}]\n"
+            response += f"- 签收时间：[{receive_time or '未知'}]\n"
+            response += f"- 商品ID：[{product_ids or '未知'}]\n"
+            if logistics:
+                response += f"- 物流信息：[{logistics}]"
+
+            if config.LOG_PAYLOADS:
+                self.logger.info(f"为订单 '{order_id}' 生成的最终回复: {response}")
+            return response
+
+        async def aquery_order_with_product(order_id: Union[str, List[str]]):
+            """异步版本：在 db 线程池中查询"""
+            return await run_blocking("db", query_order_with_product, order_id)
 
         return StructuredTool.from_function(
             func=query_order_with_product,
+            coroutine=aquery_order_with_product,
             name="query_order",
-            description="查询订单详情（含商品ID），参数为order_id（订单编号，如12345）"
+            description=("查询订单的状态、金额、时间和物流信息（只含商品ID），参数为order_id（订单编号，如'12345'）。"
+                         "用户给出多个订单号时传入列表一次查询，例如 {\"order_id\": [\"12345\", \"12346\"]}，"
+                         f"一次最多{config.QUERY_MAX_IDS}个，不要逐个调用。"
+                         "如果还需要订单中商品的名称、价格、活动等信息，请改用 query_order_details。")
         )
 
-    def get_tool(self):
+    def get_tools(self):
         """提供给接入Agent的工具接口"""
-        return self.order_tool
\ No newline at end of file
+        return [self.order_details_tool, self.order_tool, self.list_orders_tool]
\ No newline at end of file
@@ -1,9 +1,20 @@
 import logging
 import os
+import threading
+import time
+from typing import List, Optional, Union
 from langchain_core.tools import StructuredTool
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from ecommerce_agent.mysql_db import get_db_connection
+from ecommerce_agent import config
+from ecommerce_agent import change_feed
+from ecommerce_agent import mysql_db
+from ecommerce_agent import tracing
+from ecommerce_agent.cache import LRUTTLCache, VersionedResultCache, create_backend
+from ecommerce_agent import vector_index
+from ecommerce_agent.embedding_pipeline import embed_queries, load_embeddings
+from ecommerce_agent.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from ecommerce_agent.product_filters import SearchFilters
+from ecommerce_agent.thread_pools import run_blocking
+from ecommerce_agent.vector_index import ProductVectorIndex
 
 # --- RAG 配置 ---
 EMBEDDING_DOWNLOAD_DIR = "embedding"
@@ -26,24 +37,124 @@ def find_model_path(base_dir, owner, model_id_prefix):
             return os.path.join(owner_path, item)
     return None
 
+def format_product_line(product_id, p, description_chars=None):
+    """
+    商品的单行摘要，例如 "商品ID 001 运动鞋｜规格：42码｜价格：299｜活动：无"，用于一次列出多个商品的工具输出。
+    description_chars 不为 None 时在末尾附带截断到该长度的描述。
+    """
+    if p is None:
+        return f"商品ID {product_id}：数据库中未找到该商品"
+    line = (f"商品ID {product_id} {p.get('name', '未知')}｜规格：{p.get('specifications', '未知')}"
+            f"｜价格：{p.get('price', '未知')}｜活动：{p.get('activity') or '无'}")
+    description = p.get("description")
+    if description_chars and description:
+        if len(description) > description_chars:
+            description = description[:description_chars] + "…"
+        line += f"｜描述：{description}"
+    return line
+
+
+def product_row_key(product_id):
+    """
+    商品行缓存的键，与 products 表 utf8mb4_unicode_ci 排序规则的比较方式一致：不区分大小写、忽略末尾空格，
+    使 "P001" 和 "p001" 命中同一条缓存，也与 WHERE id IN (...) 查到的行对应。
+    """
+    return str(product_id).rstrip(" ").casefold()
+
+
+class ProductRowCache:
+    """
+    商品行的读穿缓存。get_many 只对未命中的ID发起一次 WHERE id IN (...) 查询，
+    按条目数 LRU 淘汰；商品更新后由 invalidate 清除对应条目。
+    缓存键由 product_row_key 规范化，调用方无需自行处理ID的大小写。
+    """
+
+    def __init__(self, max_entries, ttl):
+        self._cache = LRUTTLCache(max_entries, ttl)
+        self._lock = threading.Lock()
+        # 每次失效都会递增；查询期间发生过失效时不回填缓存，避免写回旧数据
+        self._generation = 0
+
+    def get_many(self, product_ids):
+        """
+        返回 {商品ID: 行字典}，键为调用方传入的ID（与数据库中的大小写可能不同），不存在的商品不出现在结果中。
+        无法连接数据库时返回 None，查询出错时抛出异常。返回的行字典为共享对象，调用方不应修改。
+        """
+        rows = {}
+        missing = {}
+        for product_id in dict.fromkeys(product_ids):
+            key = product_row_key(product_id)
+            row = self._cache.get(key)
+            if row is None:
+                missing.setdefault(key, []).append(product_id)
+            else:
+                rows[product_id] = row
+        if not missing:
+            return rows
+
+        generation = self._generation
+        fetched = mysql_db.fetch_products_by_ids([ids[0] for ids in missing.values()])
+        if fetched is None:
+            return None
+        fetched = {product_row_key(product_id): row for product_id, row in fetched.items()}
+        with self._lock:
+            if generation == self._generation:
+                for key, row in fetched.items():
+                    self._cache.set(key, row)
+        for key, ids in missing.items():
+            row = fetched.get(key)
+            if row is not None:
+                rows.update(dict.fromkeys(ids, row))
+        return rows
+
+    def invalidate(self, product_ids):
+        with self._lock:
+            self._generation += 1
+            for product_id in product_ids:
+                self._cache.delete(product_row_key(product_id))
+
+    def stats(self):
+        return self._cache.stats()
+
+
 class ProductAgent:
-    def __init__(self, **kwargs):
+    def __init__(self, lazy=False, **kwargs):
         """
         初始化商品Agent。
         这个Agent现在使用RAG（FAISS向量库 + MySQL）进行商品搜索。
+        lazy=True 时只创建缓存和工具，嵌入模型和向量索引由调用方稍后通过
+        load_embeddings / load_vector_store 加载（例如在后台线程中），加载完成前语义搜索不可用。
         """
         self.logger = logging.getLogger(__name__)
-        self.vector_store = self._init_vector_store()
+        self.embeddings = None
+        self.embedding_model_name = None
+        self.vector_store = None
+        # BM25 关键词索引，与向量索引一起加载；缺失时只使用向量检索
+        self.lexical_index = None
+        self.search_loading = True
+        # 串行化索引更新；检索只读取 self.vector_store 引用，不需要加锁
+        self._update_lock = threading.Lock()
+
+        # 目录版本：每次应用商品变更后更新，用于让搜索结果缓存失效
+        self.catalog_version = change_feed.latest_version() or "0"
+        self.search_cache = VersionedResultCache(
+            "search", create_backend(config.SEARCH_CACHE_MAX_ENTRIES, config.SEARCH_CACHE_TTL)
+        )
+        # 商品行缓存，供商品详情查询和搜索结果补全共用
+        self.product_cache = ProductRowCache(config.PRODUCT_CACHE_MAX_ENTRIES, config.PRODUCT_CACHE_TTL)
         
         # 初始化工具
         self.search_tool = self._create_search_tool()
         self.product_tool = self._create_product_tool()
 
-    def _init_vector_store(self):
-        """加载嵌入模型和FAISS索引，初始化向量数据库。"""
-        self.logger.info("正在初始化 ProductAgent 的 RAG 组件...")
-        
-        # 1. 动态查找并加载嵌入模型
+        if not lazy:
+            self.logger.info("正在初始化 ProductAgent 的 RAG 组件...")
+            if self.load_embeddings() is not None:
+                self.load_vector_store()
+            self.search_loading = False
+
+    def load_embeddings(self):
+        """查找并加载嵌入模型，成功时返回嵌入模型，失败时返回 None。"""
         embedding_model_path = find_model_path(EMBEDDING_DOWNLOAD_DIR, "Ceceliachenen", "bge-large-zh-v1.5")
         if not embedding_model_path or not os.path.exists(embedding_model_path):
             self.logger.error(f"错误: 无法在 '{os.path.join(EMBEDDING_DOWNLOAD_DIR, 'Ceceliachenen')}' 目录下找到 bge-large-zh-v1.5 模型。")
@@ -51,145 +162,462 @@ class ProductAgent:
         
         self.logger.info(f"找到嵌入模型路径: {embedding_model_path}")
         try:
-            embeddings = HuggingFaceEmbeddings(model_name=embedding_model_path)
+            embeddings = load_embeddings(embedding_model_path)
         except Exception as e:
             self.logger.error(f"加载嵌入模型失败: {e}", exc_info=True)
             return None
         self.logger.info("嵌入模型加载成功。")
+        self.embedding_model_name = os.path.basename(os.path.normpath(embedding_model_path))
+        self.embeddings = embeddings
+        return embeddings
 
-        # 2. 检查并加载FAISS索引
-        if not os.path.exists(FAISS_INDEX_PATH):
-            self.logger.error(f"错误: FAISS 索引目录 '{FAISS_INDEX_PATH}' 不存在。")
-            self.logger.error("请先运行 'python download_models.py' 来创建索引。")
-            return None
-            
+    def load_vector_store(self):
+        """加载FAISS索引，成功时返回索引，失败时返回 None。"""
         try:
-            vector_store = FAISS.load_local(FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-            self.logger.info("FAISS 索引加载成功。")
+            vector_store = ProductVectorIndex.load(FAISS_INDEX_PATH, mmap=config.FAISS_MMAP)
+            if vector_store is None:
+                self.logger.error(f"错误: 在 '{FAISS_INDEX_PATH}' 目录下未找到 FAISS 索引。")
+                self.logger.error("请先运行 'python download_models.py' 来创建索引。")
+                return None
+            self.logger.info(f"FAISS 索引加载成功，共 {len(vector_store)} 件商品"
+                             f"{'（mmap 共享）' if vector_store.mapped else ''}。")
+            self.load_lexical_index()
+            self.vector_store = vector_store
             return vector_store
         except Exception as e:
             self.logger.error(f"加载 FAISS 索引失败: {e}", exc_info=True)
             return None
 
-    def _create_search_tool(self):
-        """创建基于RAG的商品语义搜索工具"""
+    def load_lexical_index(self):
+        """加载关键词索引，失败时只记录日志，商品搜索退化为纯向量检索。"""
+        if not config.HYBRID_SEARCH_ENABLED:
+            return None
+        try:
+            lexical_index = LexicalIndex.load(FAISS_INDEX_PATH)
+        except Exception as e:
+            self.logger.error(f"加载关键词索引失败，商品搜索只使用向量检索: {e}", exc_info=True)
+            return None
+        if lexical_index is None:
+            self.logger.warning(f"在 '{FAISS_INDEX_PATH}' 目录下未找到关键词索引，商品搜索只使用向量检索。")
+            return None
+        self.logger.info(f"关键词索引加载成功，共 {len(lexical_index)} 件商品。")
+        self.lexical_index = lexical_index
+        return lexical_index
 
-        def search_products_by_semantic_query(query: str):
-            """通过自然语言描述进行语义搜索，查找相关商品。"""
-            self.logger.info(f"ProductAgent RAG工具被调用, 查询: '{query}'")
-            
-            if not self.vector_store:
-                return "错误: 向量数据库未成功初始化，无法执行语义搜索。"
+    def apply_product_changes(self, product_ids, version=None):
+        """
+        把变更的商品应用到内存中的向量索引，无需重新加载整个索引。
+        在索引副本上完成嵌入和删除后保存到磁盘，再原子地替换 self.vector_store。
+        同时清除这些商品的行缓存，并把目录版本更新为 version（默认为当前时间），使搜索结果缓存失效。
+        返回统计字典，无法更新时返回 None。
+        """
+        product_ids = list(dict.fromkeys(product_ids))
+        if not product_ids:
+            return {"added": 0, "updated": 0, "removed": 0, "skipped": 0}
+        self.product_cache.invalidate(product_ids)
+        try:
+            return self._update_vector_store(product_ids)
+        finally:
+            # 价格、活动等不参与向量化的字段变化同样会改变搜索结果，
+            # 因此无论索引是否更新成功都要更新版本；放在索引替换之后，避免旧索引的结果被缓存到新版本下
+            self.catalog_version = version or str(time.time_ns())
 
-            # 1. 使用FAISS进行语义检索，获取包含商品ID和分数的文档
-            try:
-                # 使用 similarity_search_with_score 来获取分数
-                docs_and_scores = self.vector_store.similarity_search_with_score(query, k=5)
-                if not docs_and_scores:
-                    self.logger.warning(f"向量数据库中未找到与 '{query}' 相关的商品。")
-                    return f"未找到与 '{query}' 相关的商品。"
-            except Exception as e:
-                self.logger.error(f"执行向量检索时出错: {e}", exc_info=True)
-                return f"语义搜索失败: {str(e)}"
-
-            # 2. 记录详细的检索结果（包含分数）
-            self.logger.info("向量数据库检索结果 (分数越低越相关):")
-            product_ids = []
-            for doc, score in docs_and_scores:
-                product_id = doc.metadata.get("product_id")
-                self.logger.info(f"  - Product ID: {product_id}, Score: {score:.4f}")
-                if product_id:
-                    product_ids.append(product_id)
+    def _update_vector_store(self, product_ids):
+        if self.embeddings is None:
+            self.logger.error("嵌入模型未加载，无法应用商品变更。")
+            return None
 
-            if not product_ids:
-                return "找到了相似的描述，但无法关联到具体的商品ID。"
-            
-            self.logger.info(f"语义搜索找到商品ID: {product_ids}")
-
-            # 3. 使用商品ID从MySQL获取最新、最全的商品信息
-            conn = get_db_connection()
-            if not conn:
-                return "错误：成功进行了语义搜索，但无法连接到数据库以获取商品详情。"
-            
+        with self._update_lock:
+            products = mysql_db.get_products_for_vectorization(product_ids)
+            if products is None:
+                self.logger.error("无法从数据库读取变更的商品，本次变更未应用。")
+                return None
+
+            current = self.vector_store
+            to_embed, to_remove, stats = vector_index.plan_index_sync(current, products, scope=product_ids)
+            if to_embed or to_remove:
+                # 只在确有变化时才复制索引
+                updated = current.copy() if current is not None else None
+                updated = vector_index.apply_index_sync(
+                    updated, self.embeddings, self.embedding_model_name, to_embed, to_remove
+                )
+                # 每个 worker 都会应用同一个变更，保存时串行化
+                with vector_index.index_write_lock(FAISS_INDEX_PATH):
+                    updated.save(FAISS_INDEX_PATH)
+                self.vector_store = updated
+            self.logger.info(f"已应用 {len(product_ids)} 个商品变更到向量索引: {stats}")
+
+            if self.lexical_index is not None:
+                lexical_index = self.lexical_index.copy()
+                lexical_stats = lexical_index.sync(products, scope=product_ids)
+                if lexical_stats["added"] or lexical_stats["updated"] or lexical_stats["removed"]:
+                    with vector_index.index_write_lock(FAISS_INDEX_PATH):
+                        lexical_index.save(FAISS_INDEX_PATH)
+                    self.lexical_index = lexical_index
+                self.logger.info(f"已应用商品变更到关键词索引: {lexical_stats}")
+            return stats
+
+    def _begin_search(self, query, filters):
+        """
+        检索前的准备：读取目录版本并检查搜索结果缓存和向量索引。
+        返回 (目录版本, 可直接返回的结果或None, 向量索引)。
+        """
+        self.logger.info(f"ProductAgent RAG工具被调用, 查询: '{query}'"
+                         f"{f'，过滤条件: {filters.describe()}' if filters else ''}")
+
+        catalog_version = self.catalog_version
+        cached = self.search_cache.get(catalog_version, query + filters.cache_key())
+        if cached is not None:
+            self.logger.info(f"查询 '{query}' 命中搜索结果缓存。")
+            return catalog_version, cached, None
+
+        # 取一次引用，检索过程中索引被替换也不影响本次请求
+        vector_store = self.vector_store
+        if vector_store is None or self.embeddings is None:
+            if self.search_loading:
+                return catalog_version, "商品语义搜索功能正在启动中，请稍后再试；如已知商品ID，可以直接查询商品详情。", None
+            return catalog_version, "错误: 向量数据库未成功初始化，无法执行语义搜索。", None
+        return catalog_version, None, vector_store
+
+    def _prefilter(self, filters):
+        """
+        结构化过滤的预筛选：满足条件的商品不超过 SEARCH_PREFILTER_MAX_IDS 个时返回其ID集合，检索只在其中进行；
+        超过时返回 None，改为多取候选后再过滤。返回 (ID集合或None, 错误信息)。
+        """
+        allowed = mysql_db.select_product_ids(filters, config.SEARCH_PREFILTER_MAX_IDS + 1)
+        if allowed is None:
+            return None, "错误：无法连接到数据库，无法按条件筛选商品。"
+        if not allowed:
+            return None, f"没有符合条件（{filters.describe()}）的商品。"
+        if len(allowed) > config.SEARCH_PREFILTER_MAX_IDS:
+            return None, None
+        return set(allowed), None
+
+    def _search_vector_store(self, query, vector_store, filters=None):
+        """
+        嵌入查询并在向量索引中检索；关键词索引可用时同时做 BM25 检索并按倒数排名融合。
+        有过滤条件时，条件选择性高（满足的商品少）则先在数据库中筛出商品ID再检索，
+        否则按 SEARCH_FILTER_OVERSAMPLE 倍多取候选，融合后再用数据库过滤。
+        返回 ([(商品ID, 分数信息)], 错误信息)，分数信息见 reciprocal_rank_fusion。
+        """
+        return self._search_many([(query, filters)], vector_store)[0]
+
+    def _candidate_counts(self, post_filter):
+        """返回 (向量检索候选数, 关键词检索候选数)。"""
+        k = config.SEARCH_CANDIDATES if self.lexical_index is not None else config.SEARCH_TOP_K
+        lexical_k = config.SEARCH_CANDIDATES
+        if post_filter:
+            k *= config.SEARCH_FILTER_OVERSAMPLE
+            lexical_k *= config.SEARCH_FILTER_OVERSAMPLE
+        return k, lexical_k
+
+    def _search_many(self, requests, vector_store, timings=None):
+        """
+        _search_vector_store 的批量版本，requests 为 [(查询, 过滤条件或None)]。
+        所有查询一次批量嵌入；不需要预筛选的查询合并为一次 FAISS 矩阵检索，预筛选的查询各自带 IDSelector 检索。
+        返回与 requests 对应的 [(排序结果, 错误信息)]；timings 不为 None 时写入 embed_ms / search_ms。
+        """
+        outcomes = [None] * len(requests)
+        plans = []  # (请求序号, 查询, 过滤条件, 预筛选的ID集合, 是否检索后过滤)
+        for i, (query, filters) in enumerate(requests):
+            filters = filters or SearchFilters()
+            allowed = None
+            if filters:
+                allowed, error = self._prefilter(filters)
+                if error:
+                    outcomes[i] = (None, error)
+                    continue
+            plans.append((i, query, filters, allowed, bool(filters) and allowed is None))
+        if not plans:
+            return outcomes
+
+        # 1. 使用FAISS进行语义检索，获取商品ID和分数
+        try:
+            started = time.monotonic()
+            with tracing.span("embedding", texts=len(plans)):
+                query_vectors = embed_queries(self.embeddings, [plan[1] for plan in plans])
+            embedded = time.monotonic()
+            vector_results = [None] * len(plans)
+            shared = [j for j, plan in enumerate(plans) if plan[3] is None]
+            if shared:
+                k = max(self._candidate_counts(plans[j][4])[0] for j in shared)
+                batch = vector_store.search_batch([query_vectors[j] for j in shared], k)
+                for j, results in zip(shared, batch):
+                    vector_results[j] = results[:self._candidate_counts(plans[j][4])[0]]
+            lexical_results = [[] for _ in plans]
+            for j, (_, query, _, allowed, post_filter) in enumerate(plans):
+                k, lexical_k = self._candidate_counts(post_filter)
+                if allowed is not None:
+                    vector_results[j] = vector_store.search(query_vectors[j], k=k, product_ids=allowed)
+                if self.lexical_index is not None:
+                    with tracing.span("bm25.search", k=lexical_k, filtered=allowed is not None):
+                        lexical_results[j] = self.lexical_index.search(query, lexical_k, allowed=allowed)
+            if timings is not None:
+                timings["embed_ms"] = round((embedded - started) * 1000, 1)
+                timings["search_ms"] = round((time.monotonic() - embedded) * 1000, 1)
+        except Exception as e:
+            self.logger.error(f"执行商品检索时出错: {e}", exc_info=True)
+            for plan in plans:
+                outcomes[plan[0]] = (None, f"语义搜索失败: {str(e)}")
+            return outcomes
+
+        for j, plan in enumerate(plans):
+            outcomes[plan[0]] = self._fuse(plan, [(pid, score) for pid, score in vector_results[j] if pid],
+                                           lexical_results[j])
+        return outcomes
+
+    def _fuse(self, plan, vector_results, lexical_results):
+        """融合一个查询的两路结果，需要时再用数据库过滤，返回 (排序结果, 错误信息)。"""
+        _, query, filters, allowed, post_filter = plan
+        # 2. 融合两路结果并记录详细的检索分数（向量为L2距离，越低越相关；BM25 越高越相关）
+        rankings = {"vector": vector_results}
+        if lexical_results:
+            rankings["bm25"] = lexical_results
+        ranked = reciprocal_rank_fusion(rankings, k=config.RRF_K, limit=None if post_filter else config.SEARCH_TOP_K)
+        if post_filter and ranked:
+            matched = mysql_db.filter_product_ids([product_id for product_id, _ in ranked], filters)
+            if matched is None:
+                return None, "错误：无法连接到数据库，无法按条件筛选商品。"
+            infos = dict(ranked)
+            ranked = [(product_id, infos[product_id]) for product_id in matched[:config.SEARCH_TOP_K]]
+        if not ranked:
+            self.logger.warning(f"未找到与 '{query}' 相关的商品。")
+            if filters:
+                return None, f"未找到与 '{query}' 相关且符合条件（{filters.describe()}）的商品。"
+            return None, f"未找到与 '{query}' 相关的商品。"
+
+        mode = f"（预筛选 {len(allowed)} 件）" if allowed is not None else ("（后过滤）" if post_filter else "")
+        self.logger.info(f"商品检索结果{mode}（向量 {len(vector_results)} 条，关键词 {len(lexical_results)} 条）:")
+        if config.LOG_PAYLOADS:
+            for product_id, info in ranked:
+                self.logger.info(f"  - Product ID: {product_id}, {info}")
+        return ranked, None
+
+    def _fetch_search_rows(self, product_ids, rows=None):
+        """
+        使用商品ID获取最新、最全的商品信息，返回 (按检索顺序排列的商品行, 错误信息)。
+        rows 为已经批量取回的 {商品ID: 行字典} 时不再查询。
+        """
+        # 3. 优先读取商品行缓存，未命中的一次性查询MySQL
+        if rows is None:
             try:
-                cursor = conn.cursor(dictionary=True)
-                # 使用 IN 子句一次性获取所有商品信息，并用 FIELD 函数保持向量搜索的顺序
-                format_strings = ','.join(['%s'] * len(product_ids))
-                sql_query = f"""
-                    SELECT id, name, specifications, price, activity
-                    FROM products
-                    WHERE id IN ({format_strings})
-                    ORDER BY FIELD(id, {format_strings})
-                """
-                cursor.execute(sql_query, product_ids * 2) # product_ids 需要重复两次
-                results = cursor.fetchall()
-                conn.close()
-
-                if not results:
-                    return "数据库中未找到向量索引返回的商品ID，数据可能不同步。"
-
-                # 4. 格式化最终结果
-                response = f"根据您的描述 '{query}'，为您找到以下最相关的商品：\n"
-                for i, product_info in enumerate(results, 1):
-                    response += f"{i}. 商品ID: {product_info.get('id', '未知')}\n"
-                    response += f"   名称: {product_info.get('name', '未知')}\n"
-                    response += f"   规格: {product_info.get('specifications', '未知')}\n"
-                    response += f"   价格: {product_info.get('price', '未知')}\n"
-                    response += f"   活动: {product_info.get('activity', '无')}\n\n"
-                
-                self.logger.info(f"为查询 '{query}' 生成的最终RAG回复: {response.strip()}")
-                return response.strip()
+                rows = self.product_cache.get_many(product_ids)
             except Exception as e:
                 self.logger.error(f"从MySQL获取商品详情时出错: {e}", exc_info=True)
-                if conn and conn.is_connected():
-                    conn.close()
-                return f"数据库查询失败: {str(e)}"
+                return None, f"数据库查询失败: {str(e)}"
+            if rows is None:
+                return None, "错误：成功进行了语义搜索，但无法连接到数据库以获取商品详情。"
+
+        # 保持向量搜索的顺序
+        results = [rows[product_id] for product_id in product_ids if product_id in rows]
+        if not results:
+            return None, "数据库中未找到向量索引返回的商品ID，数据可能不同步。"
+        return results, None
+
+    @staticmethod
+    def _format_scores(info):
+        """把融合分数格式化为一行说明，例如 "0.0325（语义第1名 距离0.4123，关键词第3名 BM25 5.2100）"。"""
+        if not info:
+            return "未知"
+        parts = []
+        if "vector" in info:
+            parts.append(f"语义第{info['vector']['rank']}名 距离{info['vector']['score']}")
+        if "bm25" in info:
+            parts.append(f"关键词第{info['bm25']['rank']}名 BM25 {info['bm25']['score']}")
+        return f"{info['rrf']}（{'，'.join(parts)}）"
+
+    def _finish_search(self, query, catalog_version, results, scores=None, filters=None):
+        """格式化最终结果并写入搜索结果缓存；scores 为 {商品ID: 分数信息}。"""
+        scores = scores or {}
+        filters = filters or SearchFilters()
+        # 4. 格式化最终结果
+        condition = f"（条件：{filters.describe()}）" if filters else ""
+        response = f"根据您的描述 '{query}'{condition}，为您找到以下最相关的商品：\n"
+        for i, product_info in enumerate(results, 1):
+            response += f"{i}. 商品ID: {product_info.get('id', '未知')}\n"
+            response += f"   名称: {product_info.get('name', '未知')}\n"
+            response += f"   规格: {product_info.get('specifications', '未知')}\n"
+            response += f"   价格: {product_info.get('price', '未知')}\n"
+            response += f"   活动: {product_info.get('activity', '无')}\n"
+            response += f"   相关度: {self._format_scores(scores.get(product_info.get('id')))}\n\n"
+
+        response = response.strip()
+        if config.LOG_PAYLOADS:
+            self.logger.info(f"为查询 '{query}' 生成的最终RAG回复: {response}")
+        self.search_cache.set(catalog_version, query + filters.cache_key(), response)
+        return response
+
+    def search_batch(self, requests):
+        """
+        批量商品搜索，用于离线评估和缓存预热，不经过大模型。
+        requests 为 [(查询, SearchFilters或None)]，返回 (与之对应的回复文本列表, 各阶段耗时)：
+        未命中搜索结果缓存的查询一次批量嵌入、一次矩阵检索，全部结果的商品行通过商品行缓存一次查询补全。
+        """
+        responses = [None] * len(requests)
+        timings = {"embed_ms": 0.0, "search_ms": 0.0, "hydrate_ms": 0.0}
+        pending = []  # (请求序号, 查询, 过滤条件, 目录版本)
+        vector_store = None
+        for i, (query, filters) in enumerate(requests):
+            filters = filters or SearchFilters()
+            catalog_version, early, store = self._begin_search(query, filters)
+            if early is not None:
+                responses[i] = early
+            else:
+                vector_store = store
+                pending.append((i, query, filters, catalog_version))
+        if not pending:
+            return responses, timings
+
+        outcomes = self._search_many([(query, filters) for _, query, filters, _ in pending], vector_store, timings)
+        started = time.monotonic()
+        all_ids = [product_id for ranked, _ in outcomes if ranked for product_id, _ in ranked]
+        try:
+            rows = self.product_cache.get_many(all_ids)
+            error = None if rows is not None else "错误：成功进行了语义搜索，但无法连接到数据库以获取商品详情。"
+        except Exception as e:
+            self.logger.error(f"从MySQL获取商品详情时出错: {e}", exc_info=True)
+            rows, error = None, f"数据库查询失败: {str(e)}"
+        timings["hydrate_ms"] = round((time.monotonic() - started) * 1000, 1)
+
+        for (i, query, filters, catalog_version), (ranked, search_error) in zip(pending, outcomes):
+            if search_error or error:
+                responses[i] = search_error or error
+                continue
+            results, row_error = self._fetch_search_rows([product_id for product_id, _ in ranked], rows)
+            responses[i] = row_error or self._finish_search(query, catalog_version, results, dict(ranked), filters)
+        return responses, timings
+
+    def _create_search_tool(self):
+        """创建基于RAG的商品语义搜索工具（同时提供同步和异步实现）"""
+
+        def search_products_by_semantic_query(query: str, min_price: Optional[float] = None,
+                                              max_price: Optional[float] = None,
+                                              has_activity: Optional[bool] = None,
+                                              spec_keyword: Optional[str] = None):
+            """通过自然语言描述进行语义搜索，查找相关商品，可按价格区间、是否有活动和规格过滤。"""
+            filters = SearchFilters(min_price, max_price, has_activity, spec_keyword)
+            catalog_version, early, vector_store = self._begin_search(query, filters)
+            if early is not None:
+                return early
+            ranked, error = self._search_vector_store(query, vector_store, filters)
+            if error:
+                return error
+            results, error = self._fetch_search_rows([product_id for product_id, _ in ranked])
+            if error:
+                return error
+            return self._finish_search(query, catalog_version, results, dict(ranked), filters)
+
+        async def asearch_products_by_semantic_query(query: str, min_price: Optional[float] = None,
+                                                     max_price: Optional[float] = None,
+                                                     has_activity: Optional[bool] = None,
+                                                     spec_keyword: Optional[str] = None):
+            """异步版本：过滤、嵌入、FAISS 和关键词检索在 search 线程池中执行，商品详情查询在 db 线程池中执行。"""
+            filters = SearchFilters(min_price, max_price, has_activity, spec_keyword)
+            catalog_version, early, vector_store = self._begin_search(query, filters)
+            if early is not None:
+                return early
+            ranked, error = await run_blocking("search", self._search_vector_store, query, vector_store, filters)
+            if error:
+                return error
+            product_ids = [product_id for product_id, _ in ranked]
+            results, error = await run_blocking("db", self._fetch_search_rows, product_ids)
+            if error:
+                return error
+            return self._finish_search(query, catalog_version, results, dict(ranked), filters)
 
         return StructuredTool.from_function(
             func=search_products_by_semantic_query,
+            coroutine=asearch_products_by_semantic_query,
             name="search_products",
-            description="通过自然语言描述进行语义搜索，查找相关商品。例如：'适合户外徒步的鞋'、'送给女朋友的生日礼物'"
+            description=("通过自然语言描述进行语义搜索，查找相关商品。例如：'适合户外徒步的鞋'、'送给女朋友的生日礼物'。"
+                         "用户提到价格、优惠或规格要求时，把条件作为参数传入而不是写进 query，"
+                         "输入为 JSON 对象：{\"query\": \"描述\", \"min_price\": 最低价(元), \"max_price\": 最高价(元), "
+                         "\"has_activity\": true 表示只要有优惠活动的商品, \"spec_keyword\": \"规格关键词，如 XL\"}，"
+                         "除 query 外都是可选的。")
         )
 
+    def fetch_products(self, product_ids):
+        """
+        通过商品行缓存查询多个商品（未命中的一次 WHERE id IN 查询），返回 ([(商品ID, 行字典或None)], 错误信息)，
+        按 product_ids 的顺序排列，不存在的商品行为 None；无法连接数据库或查询出错时列表为 None、错误信息为面向用户的文本。
+        """
+        try:
+            rows = self.product_cache.get_many(product_ids)
+        except Exception as e:
+            self.logger.error(f"查询商品ID {product_ids} 时发生数据库错误: {e}", exc_info=True)
+            return None, f"数据库查询失败：{str(e)}"
+        if rows is None:
+            self.logger.error("ProductAgent 无法获取数据库连接。")
+            return None, "错误：无法连接到数据库。"
+        return [(product_id, rows.get(product_id)) for product_id in product_ids], None
+
+    def fetch_product(self, product_id):
+        """
+        查询单个商品，返回 (行字典, 错误信息)。
+        商品不存在时两者均为 None；无法连接数据库或查询出错时行为 None、错误信息为面向用户的文本。
+        """
+        products, error = self.fetch_products([product_id])
+        if error:
+            return None, error
+        return products[0][1], None
+
+    def _format_product_list(self, product_ids):
+        """一次查询多个商品，每个商品一行，描述截断到 QUERY_DESCRIPTION_CHARS 个字符。"""
+        queried, skipped = product_ids[:config.QUERY_MAX_IDS], product_ids[config.QUERY_MAX_IDS:]
+        products, error = self.fetch_products(queried)
+        if error:
+            return error
+        lines = [f"共查询 {len(queried)} 个商品："]
+        for i, (product_id, p) in enumerate(products, 1):
+            lines.append(f"{i}. {format_product_line(product_id, p, config.QUERY_DESCRIPTION_CHARS)}")
+        if skipped:
+            lines.append(f"一次最多查询 {config.QUERY_MAX_IDS} 个商品，其余 {len(skipped)} 个"
+                         f"（{'、'.join(skipped)}）请再次调用本工具查询。")
+        found = sum(1 for _, p in products if p is not None)
+        self.logger.info(f"批量查询商品完成：{found}/{len(queried)} 个存在。")
+        return "\n".join(lines)
+
     def _create_product_tool(self):
-        """创建商品查询工具（基于MySQL数据库）"""
-
-        def query_product_info(product_id: str):
-            """通过商品ID查询商品详情"""
-            self.logger.info(f"ProductAgent 工具被调用: query_product_info, 参数 product_id='{product_id}'")
-            conn = get_db_connection()
-            if not conn:
-                self.logger.error("ProductAgent 无法获取数据库连接。")
-                return "错误：无法连接到数据库。"
-            
-            try:
-                cursor = conn.cursor(dictionary=True)
-                cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-                p = cursor.fetchone()
-                conn.close()
-
-                if p:
-                    response = (f"商品ID {product_id} 的详细信息：\n"
-                                f"- 名称：{p.get('name', '未知')}\n"
-                                f"- 规格：{p.get('specifications', '未知')}\n"
-                                f"- 描述：{p.get('description', '未知')}\n"
-                                f"- 价格：{p.get('price', '未知')}\n"
-                                f"- 活动：{p.get('activity', '未知')}")
-                    self.logger.info(f"为商品ID '{product_id}' 查询成功。")
-                    return response
-                
-                self.logger.warning(f"在数据库中未找到商品ID: '{product_id}'")
-                return f"数据库中未找到商品ID为 {product_id} 的信息"
-            except Exception as e:
-                self.logger.error(f"查询商品ID '{product_id}' 时发生数据库错误: {e}", exc_info=True)
-                if conn.is_connected():
-                    conn.close()
-                return f"数据库查询失败：{str(e)}"
+        """创建商品查询工具（基于商品行缓存和MySQL数据库）"""
+
+        def query_product_info(product_id: Union[str, List[str]]):
+            """通过商品ID查询商品详情，传入ID列表时一次查询多个商品"""
+            self.logger.info(f"ProductAgent 工具被调用: query_product_info, 参数 product_id={product_id!r}")
+            product_ids = mysql_db.split_ids(product_id)
+            if not product_ids:
+                return "请提供商品ID。"
+            if len(product_ids) > 1:
+                return self._format_product_list(product_ids)
+
+            product_id = product_ids[0]
+            p, error = self.fetch_product(product_id)
+            if error:
+                return error
+            if p:
+                response = (f"商品ID {product_id} 的详细信息：\n"
+                            f"- 名称：{p.get('name', '未知')}\n"
+                            f"- 规格：{p.get('specifications', '未知')}\n"
+                            f"- 描述：{p.get('description', '未知')}\n"
+                            f"- 价格：{p.get('price', '未知')}\n"
+                            f"- 活动：{p.get('activity', '未知')}")
+                self.logger.info(f"为商品ID '{product_id}' 查询成功。")
+                return response
+
+            self.logger.warning(f"在数据库中未找到商品ID: '{product_id}'")
+            return f"数据库中未找到商品ID为 {product_id} 的信息"
+
+        async def aquery_product_info(product_id: Union[str, List[str]]):
+            """异步版本：在 db 线程池中查询"""
+            return await run_blocking("db", query_product_info, product_id)
 
         return StructuredTool.from_function(
             func=query_product_info,
+            coroutine=aquery_product_info,
             name="query_product",
-            description="查询商品详情（含规格），参数为product_id（商品ID，例如'001'）"
+            description=("查询商品详情（含规格），参数为product_id（商品ID，例如'001'）。"
+                         "比较或查询多个商品时传入ID列表一次查询，例如 {\"product_id\": [\"001\", \"002\"]}，"
+                         f"一次最多{config.QUERY_MAX_IDS}个，不要逐个调用。"
+                         "订单中的商品请用 query_order_details 随订单一次查询，不必逐个调用本工具。")
         )
 
     def get_tools(self):
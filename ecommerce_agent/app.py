@@ -1,11 +1,21 @@
+import json
 import logging
-from flask import Flask, request, jsonify
+import queue
+import threading
+import uuid
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from .config import (
-    OPENAI_API_KEY, BASE_URL, FLASK_HOST, FLASK_PORT, FLASK_DEBUG
+    OPENAI_API_KEY, BASE_URL, FLASK_HOST, FLASK_PORT, FLASK_DEBUG, ADMIN_TOKEN, STARTUP_BACKGROUND,
+    BATCH_MAX_ITEMS, LOG_PAYLOADS
 )
 from .agents import AccessAgent
 from . import mysql_db # 导入新的MySQL模块
+from .batch import BatchRunner, iter_batch_items
+from .change_feed import ChangeFeedWatcher
+from .startup import StartupTracker
+from .streaming import StreamingCallbackHandler, format_sse
+from . import tracing
 import download_models # 导入模型下载和向量创建脚本
 
 # --- 日志配置 ---
@@ -21,20 +31,10 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# 在启动时初始化数据库
-with app.app_context():
-    logger.info("Flask 应用启动，正在检查并初始化数据库...")
-    mysql_db.init_database()
-    logger.info("数据库初始化完成。")
-
-    # 新增：检查并创建向量索引
-    # 这确保了应用启动时，向量存储总是最新的
-    logger.info("正在检查并创建商品向量索引...")
-    if download_models.create_vector_store():
-        logger.info("向量索引成功创建或已是最新。")
-    else:
-        # 这是一个非致命错误，应用可以继续运行，但搜索功能可能受限
-        logger.warning("创建向量索引失败。应用将继续运行，但语义搜索功能可能不可用。")
+# --- 分阶段启动 ---
+# Agent 和工具在导入时创建（很快）；数据库、嵌入模型和向量索引在后台线程中依次加载。
+# 数据库就绪后即可处理订单查询，语义搜索在嵌入模型和索引加载完成后上线。
+startup = StartupTracker(["agent", "database", "embeddings", "vector_index_sync", "vector_index"])
 
 # 初始化接入Agent
 llm_config = {
@@ -45,28 +45,98 @@ llm_config = {
     "max_tokens": 4096
 }
 
-access_agent = AccessAgent(
-    llm_config=llm_config
-)
+access_agent = startup.run("agent", lambda: AccessAgent(llm_config=llm_config, lazy=True))
+
+
+def _apply_feed_changes(product_ids, version):
+    """变更流回调：把导入脚本发布的商品变更应用到内存索引。"""
+    logger.info(f"收到商品变更 (version={version})，共 {len(product_ids)} 个商品。")
+    access_agent.product_agent.apply_product_changes(product_ids, version=version)
+
+
+# 监听导入脚本写入的变更流，导入后无需重启即可检索到新商品。
+# 在此处创建以记录当前文件位置，加载期间发布的变更会在索引就绪、开始监听后补上
+change_feed_watcher = ChangeFeedWatcher(_apply_feed_changes)
+
+
+def _init_database():
+    """初始化数据库表结构，并确认可以取得连接。"""
+    mysql_db.init_database()
+    with mysql_db.db_connection() as conn:
+        return conn is not None
+
+
+def _load_components():
+    """按依赖顺序加载各组件：数据库 -> 嵌入模型 -> 向量索引同步 -> 向量索引。"""
+    startup.run("database", _init_database)
+
+    product_agent = access_agent.product_agent
+    try:
+        # 提前从本地缓存加载 tiktoken 编码，避免第一个请求承担加载时间
+        access_agent.context.counter.load()
+        # 嵌入模型只加载一次，索引同步和在线检索共用
+        embeddings = startup.run("embeddings", product_agent.load_embeddings)
+        if embeddings is not None:
+            # 确保向量存储是最新的；失败时仍尝试加载已有索引，语义搜索可能不是最新
+            startup.run("vector_index_sync", lambda: download_models.create_vector_store(embeddings=embeddings))
+            if startup.run("vector_index", product_agent.load_vector_store) is not None:
+                change_feed_watcher.start()
+    finally:
+        product_agent.search_loading = False
+    if not startup.is_ready("vector_index"):
+        logger.warning("向量索引加载失败。应用将继续运行，但语义搜索功能不可用。")
+
+
+if access_agent is not None:
+    if STARTUP_BACKGROUND:
+        threading.Thread(target=_load_components, name="startup-loader", daemon=True).start()
+    else:
+        _load_components()
+
+
+def _is_admin_request():
+    """管理接口鉴权：配置了 ADMIN_TOKEN 时校验请求头，否则只允许本机访问。"""
+    if ADMIN_TOKEN:
+        return request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+def parse_query_request(data):
+    """
+    校验 /api/query 的请求体，Flask 和 ASGI 两种服务模式共用。
+    返回 (问题, 会话ID, 错误响应体, HTTP状态码)，校验通过时后两项为 None。
+    """
+    if not isinstance(data, dict) or "question" not in data:
+        logger.warning("API 调用缺少 'question' 参数")
+        return None, None, {"error": "缺少参数: question"}, 400
+
+    if not startup.is_settled("database"):
+        return None, None, {"success": False, "error": "服务正在启动，请稍后再试。"}, 503
+
+    session_id = data.get("session_id")
+    if session_id is not None and (not isinstance(session_id, str) or not 0 < len(session_id) <= 128):
+        return None, None, {"error": "参数 session_id 应为不超过128个字符的字符串"}, 400
+    # 未提供会话ID时创建新会话，客户端在后续请求中带上返回的 session_id 即可继续对话
+    return data["question"], session_id or uuid.uuid4().hex, None, None
 
 
 # API接口
 @app.route('/api/query', methods=['POST'])
 def query():
     """处理用户查询的API接口"""
-    data = request.json
-    if not data or "question" not in data:
-        logger.warning("API 调用缺少 'question' 参数")
-        return jsonify({"error": "缺少参数: question"}), 400
+    question, session_id, error, status = parse_query_request(request.json)
+    if error:
+        return jsonify(error), status
 
     try:
-        question = data["question"]
-        logger.info(f"接收到问题: '{question}'")
-        response = access_agent.handle_question(question)
-        logger.info(f"返回给用户的最终答案: '{response}'")
+        logger.info(f"接收到问题: '{question}' (session={session_id})")
+        response = access_agent.handle_question(question, session_id=session_id)
+        if LOG_PAYLOADS:
+            logger.info(f"返回给用户的最终答案: '{response}'")
         return jsonify({
             "success": True,
-            "response": response
+            "response": response,
+            "session_id": session_id
         })
     except Exception as e:
         logger.error(f"处理请求时发生严重错误: {e}", exc_info=True)
@@ -76,10 +146,182 @@ def query():
         }), 500
 
 
+# 连续多久没有事件时发送一次 SSE 注释，防止代理因空闲断开连接
+SSE_KEEPALIVE_SECONDS = 15
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@app.route('/api/query/stream', methods=['POST'])
+def query_stream():
+    """
+    /api/query 的流式版本（Server-Sent Events）：先推送工具调用进度和最终答案的增量文本，
+    最后以 final 事件返回与 /api/query 相同的响应体。
+    """
+    question, session_id, error, status = parse_query_request(request.json)
+    if error:
+        return jsonify(error), status
+
+    events = queue.Queue()
+    handler = StreamingCallbackHandler(lambda event, data: events.put((event, data)))
+
+    def run():
+        try:
+            logger.info(f"接收到流式问题: '{question}' (session={session_id})")
+            response = access_agent.handle_question(question, session_id=session_id, callbacks=[handler])
+            if LOG_PAYLOADS:
+                logger.info(f"返回给用户的最终答案: '{response}'")
+            events.put(("final", {"success": True, "response": response, "session_id": session_id}))
+        except Exception as e:
+            logger.error(f"处理流式请求时发生严重错误: {e}", exc_info=True)
+            events.put(("error", {"success": False, "error": str(e)}))
+
+    def generate():
+        yield format_sse("start", {"session_id": session_id})
+        worker = threading.Thread(target=run, name="query-stream", daemon=True)
+        worker.start()
+        while True:
+            try:
+                event, data = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event, data)
+            if event in ("final", "error"):
+                return
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.route('/api/query/batch', methods=['POST'])
+def query_batch():
+    """
+    批量查询接口（离线评估、缓存预热）：请求体为 JSON Lines（每行一个问题，格式见 batch.py），
+    或 {"items": [...]}；结果以 JSON Lines 流式返回，每条完成即输出。
+    批量查询会占用大量资源，与管理接口使用相同的鉴权。
+    """
+    if not _is_admin_request():
+        return jsonify({"error": "无权访问批量查询接口"}), 403
+    if not startup.is_settled("database"):
+        return jsonify({"success": False, "error": "服务正在启动，请稍后再试。"}), 503
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get("items"), list):
+        lines = [json.dumps(item, ensure_ascii=False) for item in data["items"]]
+    else:
+        lines = request.get_data(as_text=True).splitlines()
+    entries = list(iter_batch_items(lines))
+    if not entries:
+        return jsonify({"error": "缺少参数: 至少需要一个问题"}), 400
+    if len(entries) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"单次最多 {BATCH_MAX_ITEMS} 个问题"}), 413
+
+    logger.info(f"接收到批量查询，共 {len(entries)} 个问题。")
+    runner = BatchRunner(access_agent)
+
+    def generate():
+        for result in runner.run(entries):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no"})
+
+
+def _agent_unavailable():
+    """Agent 初始化失败时，依赖 Agent 的统计和管理接口返回 503。"""
+    return jsonify({"success": False, "error": "Agent 未初始化，请检查服务日志。"}), 503
+
+
+@app.route('/admin/reindex', methods=['POST'])
+def reindex_products():
+    """管理接口：把指定商品的变更应用到当前进程的向量索引"""
+    if not _is_admin_request():
+        return jsonify({"error": "无权访问管理接口"}), 403
+    if access_agent is None:
+        return _agent_unavailable()
+
+    data = request.json
+    if not data or not isinstance(data.get("product_ids"), list):
+        return jsonify({"error": "缺少参数: product_ids (列表)"}), 400
+
+    stats = access_agent.product_agent.apply_product_changes(data["product_ids"])
+    if stats is None:
+        return jsonify({"success": False, "error": "向量索引更新失败，请检查后端日志。"}), 500
+    return jsonify({"success": True, "stats": stats})
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """缓存命中率统计接口"""
+    if access_agent is None:
+        return _agent_unavailable()
+    product_agent = access_agent.product_agent
+    return jsonify({
+        "catalog_version": product_agent.catalog_version,
+        "search_results": product_agent.search_cache.stats(),
+        "product_rows": product_agent.product_cache.stats(),
+        "sessions": access_agent.sessions.stats(),
+        "semantic_answers": access_agent.semantic_cache.stats() if access_agent.semantic_cache else None
+    })
+
+
+@app.route('/api/router/stats', methods=['GET'])
+def router_stats():
+    """意图路由统计接口：直接回答的比例和节省的时间"""
+    if access_agent is None:
+        return _agent_unavailable()
+    if not access_agent.router:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **access_agent.router.stats()})
+
+
+@app.route('/api/context/stats', methods=['GET'])
+def context_stats():
+    """Agent 上下文预算统计接口：每个问题的提示词 token 数和压缩情况"""
+    if access_agent is None:
+        return _agent_unavailable()
+    return jsonify(access_agent.context.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 指标接口：问题、LLM 调用、工具、嵌入、向量检索和 SQL 的耗时直方图"""
+    return Response(tracing.render_metrics(), content_type=tracing.PROMETHEUS_CONTENT_TYPE)
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    """健康检查接口"""
-    return jsonify({"status": "healthy"}), 200
+    """
+    健康检查接口：进程存活即返回200，并报告就绪状态、各组件的加载耗时，以及数据库连接池和嵌入缓存指标。
+    ready 表示可以处理查询（数据库已就绪），search_ready 表示语义搜索已上线。
+    """
+    product_agent = access_agent.product_agent if access_agent else None
+    embedding_cache = getattr(product_agent.embeddings, "cache", None) if product_agent else None
+    return jsonify({
+        "status": "healthy",
+        "live": True,
+        "ready": startup.is_ready("agent", "database"),
+        "search_ready": startup.is_ready("vector_index"),
+        "startup": startup.snapshot(),
+        "db_pool": mysql_db.get_pool_stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None
+    }), 200
+
+
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """存活探针：进程能够响应请求即可。"""
+    return jsonify({"live": True}), 200
+
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """就绪探针：Agent 和数据库就绪后返回200，否则返回503。"""
+    ready = startup.is_ready("agent", "database")
+    return jsonify({
+        "ready": ready,
+        "search_ready": startup.is_ready("vector_index"),
+        "startup": startup.snapshot()
+    }), 200 if ready else 503
 
 
 if __name__ == '__main__':
@@ -0,0 +1,349 @@
+import asyncio
+import io
+import json
+import logging
+import sys
+import threading
+
+from . import config
+from . import thread_pools
+from .app import app as flask_app, access_agent, parse_query_request, SSE_KEEPALIVE_SECONDS
+from .streaming import StreamingCallbackHandler, format_sse
+
+logger = logging.getLogger(__name__)
+
+# --- 异步服务模式 (ASGI) ---
+# /api/query 由事件循环直接处理：Agent 通过 executor.ainvoke 调用，LLM 请求期间不占用线程，
+# 数据库和向量检索在有界线程池中执行；/api/query/stream 以 SSE 流式返回。
+# 其余接口（健康检查、管理接口、批量查询等）转交给原有的 Flask 应用，响应体逐块转发，流式响应不会被缓冲。
+# 启动方式: uvicorn ecommerce_agent.asgi:app --host 0.0.0.0 --port 5000
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class Overloaded(Exception):
+    """并发已满且排队请求过多或等待超时。"""
+
+
+class ConcurrencyLimiter:
+    """
+    限制同时处理的请求数：最多 max_concurrency 个请求并发执行，最多 max_queue 个请求排队等待，
+    排队已满或等待超过 queue_timeout 秒时拒绝请求（返回503），把压力反馈给负载均衡和客户端。
+    """
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def __aenter__(self):
+        if not self._semaphore.locked():
+            # 有空闲名额时立即取得，不经过排队
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("请求队列已满")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout or None)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Overloaded("排队等待超时")
+            finally:
+                self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.active -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+limiter = ConcurrencyLimiter(config.ASYNC_MAX_CONCURRENCY, config.ASYNC_MAX_QUEUE, config.ASYNC_QUEUE_TIMEOUT)
+
+
+async def _read_query(receive, send):
+    """读取并校验查询请求体，校验失败时直接发送错误响应并返回 None。"""
+    body = await _read_body(receive)
+    if body is None:
+        await _send_json(send, 413, {"error": "请求体过大"})
+        return None
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    question, session_id, error, status = parse_query_request(data)
+    if error:
+        await _send_json(send, status, error)
+        return None
+    return question, session_id
+
+
+async def _read_body(receive):
+    """读取完整请求体，超过 MAX_BODY_BYTES 时返回 None。"""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return b""
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send_json(send, status, payload, extra_headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = [
+        (b"content-type", b"application/json; charset=utf-8"),
+        (b"content-length", str(len(body)).encode()),
+        (b"access-control-allow-origin", b"*"),
+    ]
+    headers.extend(extra_headers)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _handle_query(receive, send):
+    """异步版本的 /api/query，请求和响应格式与 Flask 版本一致。"""
+    parsed = await _read_query(receive, send)
+    if parsed is None:
+        return
+    question, session_id = parsed
+
+    try:
+        async with limiter:
+            logger.info(f"接收到问题: '{question}' (session={session_id})")
+            response = await access_agent.ahandle_question(question, session_id=session_id)
+            if config.LOG_PAYLOADS:
+                logger.info(f"返回给用户的最终答案: '{response}'")
+    except Overloaded as e:
+        logger.warning(f"拒绝请求: {e} ({limiter.stats()})")
+        await _send_json(send, 503, {"success": False, "error": "服务繁忙，请稍后再试。"},
+                         extra_headers=[(b"retry-after", b"1")])
+        return
+    except Exception as e:
+        logger.error(f"处理请求时发生严重错误: {e}", exc_info=True)
+        await _send_json(send, 500, {"success": False, "error": str(e)})
+        return
+    await _send_json(send, 200, {"success": True, "response": response, "session_id": session_id})
+
+
+async def _handle_query_stream(receive, send):
+    """异步版本的 /api/query/stream，事件格式与 Flask 版本一致。"""
+    parsed = await _read_query(receive, send)
+    if parsed is None:
+        return
+    question, session_id = parsed
+
+    try:
+        async with limiter:
+            loop = asyncio.get_running_loop()
+            events = asyncio.Queue()
+            # 工具可能在线程池中执行，回调通过 call_soon_threadsafe 把事件交回事件循环
+            handler = StreamingCallbackHandler(
+                lambda event, data: loop.call_soon_threadsafe(events.put_nowait, (event, data)))
+            logger.info(f"接收到流式问题: '{question}' (session={session_id})")
+            task = asyncio.create_task(
+                access_agent.ahandle_question(question, session_id=session_id, callbacks=[handler]))
+
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+                (b"access-control-allow-origin", b"*"),
+            ]})
+
+            async def push(chunk):
+                await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+
+            await push(format_sse("start", {"session_id": session_id}))
+            while not (task.done() and events.empty()):
+                get = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({get, task}, timeout=SSE_KEEPALIVE_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if get in done:
+                    await push(format_sse(*get.result()))
+                else:
+                    get.cancel()
+                    if not done:
+                        await push(": keep-alive\n\n")
+            # 任务完成后，call_soon_threadsafe 排入的事件可能还未入队，让出一次事件循环后取完
+            await asyncio.sleep(0)
+            while not events.empty():
+                await push(format_sse(*events.get_nowait()))
+            try:
+                response = task.result()
+                if config.LOG_PAYLOADS:
+                    logger.info(f"返回给用户的最终答案: '{response}'")
+                final = ("final", {"success": True, "response": response, "session_id": session_id})
+            except Exception as e:
+                logger.error(f"处理流式请求时发生严重错误: {e}", exc_info=True)
+                final = ("error", {"success": False, "error": str(e)})
+            await send({"type": "http.response.body", "body": format_sse(*final).encode("utf-8")})
+    except Overloaded as e:
+        logger.warning(f"拒绝请求: {e} ({limiter.stats()})")
+        await _send_json(send, 503, {"success": False, "error": "服务繁忙，请稍后再试。"},
+                         extra_headers=[(b"retry-after", b"1")])
+
+
+def _wsgi_environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _call_flask(scope, receive, send, dedicated_thread=False):
+    """
+    把请求转交给 Flask 应用。WSGI 响应体的每一块产生后立即作为一个 http.response.body 发送（more_body=True），
+    流式响应（如批量查询的 JSON Lines）不会在全部完成后才一次返回。
+    默认在默认线程池中执行；dedicated_thread=True 时使用独立线程，长时间的响应不占用默认线程池。
+    """
+    body = await _read_body(receive)
+    if body is None:
+        await _send_json(send, 413, {"error": "请求体过大"})
+        return
+    environ = _wsgi_environ(scope, body)
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def emit(*item):
+        loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+    def run():
+        try:
+            def start_response(status, headers, exc_info=None):
+                emit("start", int(status.split(" ", 1)[0]), headers)
+
+            result = flask_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        emit("body", chunk)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            emit("end")
+        except Exception as e:
+            emit("error", e)
+
+    if dedicated_thread:
+        threading.Thread(target=run, name="flask-call", daemon=True).start()
+    else:
+        loop.run_in_executor(None, run)
+
+    started = False
+    while True:
+        item = await chunks.get()
+        if item[0] == "start":
+            headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in item[2]]
+            await send({"type": "http.response.start", "status": item[1], "headers": headers})
+            started = True
+        elif item[0] == "body":
+            await send({"type": "http.response.body", "body": item[1], "more_body": True})
+        else:
+            if item[0] == "error":
+                logger.error(f"转交 Flask 处理请求时发生错误: {item[1]}", exc_info=item[1])
+                if not started:
+                    await _send_json(send, 500, {"success": False, "error": str(item[1])})
+                    return
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+
+async def _handle_query_batch(scope, receive, send):
+    """
+    /api/query/batch：鉴权、解析和执行仍由 Flask 路由完成（BatchRunner.run 在独立线程中迭代），
+    每条结果产生后立即作为一行发送；整个批量请求占用一个并发名额，并发已满时与其他请求一样返回 503。
+    """
+    try:
+        async with limiter:
+            await _call_flask(scope, receive, send, dedicated_thread=True)
+    except Overloaded as e:
+        logger.warning(f"拒绝批量请求: {e} ({limiter.stats()})")
+        await _send_json(send, 503, {"success": False, "error": "服务繁忙，请稍后再试。"},
+                         extra_headers=[(b"retry-after", b"1")])
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            thread_pools.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI 入口。"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/api/query" and scope["method"] == "POST":
+        await _handle_query(receive, send)
+    elif scope["path"] == "/api/query/stream" and scope["method"] == "POST":
+        await _handle_query_stream(receive, send)
+    elif scope["path"] == "/api/query/batch" and scope["method"] == "POST":
+        await _handle_query_batch(scope, receive, send)
+    elif scope["path"] == "/api/serving/stats" and scope["method"] == "GET":
+        await _send_json(send, 200, {"concurrency": limiter.stats()})
+    else:
+        await _call_flask(scope, receive, send)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print("错误：异步服务模式需要安装 uvicorn: pip install uvicorn")
+        sys.exit(1)
+    uvicorn.run(app, host=config.FLASK_HOST, port=config.FLASK_PORT)
@@ -0,0 +1,201 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ecommerce_agent import config
+from ecommerce_agent import tracing
+from ecommerce_agent.embedding_pipeline import embed_queries
+from ecommerce_agent.product_filters import SearchFilters
+
+logger = logging.getLogger(__name__)
+
+# --- 批量查询 ---
+# 离线评估或预热缓存时一次回放成千上万条问题。输入为 JSON Lines，每行一个问题：
+#   {"id": "q1", "question": "订单12345到哪了", "session_id": "s1"}
+#   {"id": "q2", "question": "适合冬天的外套", "mode": "search", "max_price": 500, "has_activity": true}
+# mode 为 agent（默认，完整的 AccessAgent 流程）或 search（直接调用商品搜索，不经过大模型，
+# 可带 min_price / max_price / has_activity / spec_keyword 过滤条件）。
+# 输入按 BATCH_SIZE 分批处理：
+#   - 同一批的搜索查询一次批量嵌入、一次 FAISS 矩阵检索，全部结果的商品行一次 SQL 查询补全；
+#   - Agent 问题的语义缓存向量同样整批计算，之后以 BATCH_AGENT_CONCURRENCY 的并发调用 Agent，
+#     同一会话的问题在同一个任务中按输入顺序处理；
+#   - 每条结果完成即输出一行 JSON（index 对应输入中的行号），并附带耗时。
+
+BATCH_MODES = ("agent", "search")
+FILTER_FIELDS = ("min_price", "max_price", "has_activity", "spec_keyword")
+
+
+def parse_batch_item(data, index):
+    """校验一个输入条目，返回 (条目字典, 错误信息)。"""
+    if not isinstance(data, dict):
+        return None, "每行应为 JSON 对象"
+    question = data.get("question")
+    if not isinstance(question, str) or not question.strip():
+        return None, "缺少参数: question"
+    mode = data.get("mode") or "agent"
+    if mode not in BATCH_MODES:
+        return None, f"未知的 mode: {mode}（可选 {', '.join(BATCH_MODES)}）"
+    session_id = data.get("session_id")
+    if session_id is not None and (not isinstance(session_id, str) or not 0 < len(session_id) <= 128):
+        return None, "参数 session_id 应为不超过128个字符的字符串"
+    filters = SearchFilters(**{field: data.get(field) for field in FILTER_FIELDS})
+    if filters.ignored:
+        return None, f"过滤条件格式错误: {', '.join(filters.ignored)}"
+    return {"index": index, "id": data.get("id"), "question": question, "mode": mode,
+            "session_id": session_id, "filters": filters}, None
+
+
+def iter_batch_items(lines):
+    """逐行解析 JSON Lines 输入，跳过空行，返回 (行号, 条目字典, 错误信息) 的迭代器，行号从0开始。"""
+    index = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield index, None, f"JSON 解析失败: {e}"
+        else:
+            item, error = parse_batch_item(data, index)
+            yield index, item, error
+        index += 1
+
+
+def _elapsed_ms(started):
+    return round((time.monotonic() - started) * 1000, 1)
+
+
+class BatchRunner:
+    """
+    批量处理问题并逐条产出结果字典。
+    run 是生成器，调用方边迭代边写出结果即可流式输出；stats 汇总处理数量和吞吐量。
+    """
+
+    def __init__(self, access_agent, batch_size=None, concurrency=None):
+        self.access_agent = access_agent
+        self.batch_size = max(1, batch_size or config.BATCH_SIZE)
+        self.concurrency = max(1, concurrency or config.BATCH_AGENT_CONCURRENCY)
+        self._started = None
+        self._counts = {"items": 0, "succeeded": 0, "failed": 0}
+
+    def run(self, entries):
+        """entries 为 iter_batch_items 产出的 (行号, 条目字典, 错误信息)。"""
+        self._started = time.monotonic()
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-agent") as pool:
+            for index, item, error in entries:
+                if error:
+                    yield self._record({"index": index, "success": False, "error": error})
+                    continue
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    yield from self._run_batch(batch, pool)
+                    batch = []
+            if batch:
+                yield from self._run_batch(batch, pool)
+        logger.info(f"批量查询完成: {self.stats()}")
+
+    def _run_batch(self, batch, pool):
+        agent_items = [item for item in batch if item["mode"] == "agent"]
+        search_items = [item for item in batch if item["mode"] == "search"]
+
+        # 1. Agent 问题：整批计算语义缓存向量，然后提交到线程池，与下面的批量搜索并行执行
+        futures = []
+        if agent_items:
+            vectors, embed_ms = self._embed_agent_questions(agent_items)
+            submitted = time.monotonic()
+            for group in self._group_by_session(agent_items):
+                futures.append(pool.submit(self._run_agent_group, group, vectors, embed_ms, submitted))
+
+        # 2. 商品搜索：一次嵌入、一次矩阵检索、一次补全商品行
+        if search_items:
+            yield from self._run_search_items(search_items)
+
+        for future in as_completed(futures):
+            for result in future.result():
+                yield self._record(result)
+
+    def _embed_agent_questions(self, items):
+        """返回 ({问题: 向量}, 耗时毫秒)；语义缓存不可用或嵌入失败时为空字典，由 Agent 逐条处理。"""
+        questions = list(dict.fromkeys(self.access_agent.semantic_cache_candidates(
+            [item["question"] for item in items])))
+        if not questions:
+            return {}, 0.0
+        started = time.monotonic()
+        try:
+            with tracing.span("embedding", texts=len(questions)):
+                vectors = embed_queries(self.access_agent.product_agent.embeddings, questions)
+        except Exception as e:
+            logger.warning(f"批量嵌入问题失败，改为逐条处理: {e}")
+            return {}, 0.0
+        return dict(zip(questions, vectors)), _elapsed_ms(started)
+
+    @staticmethod
+    def _group_by_session(items):
+        """同一会话的问题放在同一组中按顺序处理，没有会话的问题各自成组。"""
+        groups, by_session = [], {}
+        for item in items:
+            session_id = item["session_id"]
+            if session_id is None:
+                groups.append([item])
+            elif session_id in by_session:
+                by_session[session_id].append(item)
+            else:
+                by_session[session_id] = [item]
+                groups.append(by_session[session_id])
+        return groups
+
+    def _run_agent_group(self, group, vectors, embed_ms, submitted):
+        results = []
+        for item in group:
+            started = time.monotonic()
+            result = {"index": item["index"], "id": item["id"], "mode": "agent", "session_id": item["session_id"]}
+            try:
+                result["response"] = self.access_agent.handle_question(
+                    item["question"], session_id=item["session_id"], question_vector=vectors.get(item["question"]))
+                result["success"] = True
+            except Exception as e:
+                logger.error(f"批量查询第 {item['index']} 条出错: {e}", exc_info=True)
+                result.update(success=False, error=str(e))
+            result["timings"] = {
+                "queue_ms": round((started - submitted) * 1000, 1),
+                "agent_ms": _elapsed_ms(started),
+                # 整批问题嵌入的耗时，由同一批的问题共同分摊
+                "batch_embed_ms": embed_ms,
+            }
+            results.append(result)
+        return results
+
+    def _run_search_items(self, items):
+        started = time.monotonic()
+        product_agent = self.access_agent.product_agent
+        try:
+            responses, timings = product_agent.search_batch(
+                [(item["question"], item["filters"]) for item in items])
+            error = None
+        except Exception as e:
+            logger.error(f"批量商品搜索出错: {e}", exc_info=True)
+            responses, timings, error = [None] * len(items), {}, str(e)
+        # 嵌入、检索和补全在整批搜索之间共享，各条结果报告的是整批的耗时
+        timings = dict(timings, batch_ms=_elapsed_ms(started), batch_items=len(items))
+        for item, response in zip(items, responses):
+            result = {"index": item["index"], "id": item["id"], "mode": "search"}
+            if error:
+                result.update(success=False, error=error)
+            else:
+                result.update(success=True, response=response)
+            result["timings"] = timings
+            yield self._record(result)
+
+    def _record(self, result):
+        self._counts["items"] += 1
+        self._counts["succeeded" if result.get("success") else "failed"] += 1
+        return result
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        return dict(self._counts, elapsed_seconds=round(elapsed, 3),
+                    items_per_second=round(self._counts["items"] / elapsed, 2) if elapsed else 0.0)
@@ -0,0 +1,196 @@
+import json
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from ecommerce_agent import config
+
+logger = logging.getLogger(__name__)
+
+
+class LRUTTLCache:
+    """线程安全的进程内缓存：按最近使用淘汰，条目超过 ttl 秒后过期（ttl<=0 表示不过期）。"""
+
+    def __init__(self, max_entries, ttl=0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, 过期时间)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl and ttl > 0 else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# --- 可插拔的缓存后端 ---
+# 后端只需实现 get(key) / set(key, value, ttl) / delete(key)，值必须可 JSON 序列化。
+
+class InMemoryBackend:
+    """默认后端：进程内 LRU/TTL 缓存，每个 worker 各自一份。"""
+
+    shared = False
+
+    def __init__(self, max_entries, ttl):
+        self._cache = LRUTTLCache(max_entries, ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(key, value, ttl)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class RedisBackend:
+    """共享后端：多个 worker 共用一个 Redis，需要额外安装 redis 包。"""
+
+    shared = True
+
+    def __init__(self, url, ttl, prefix="ecommerce_agent:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("使用 Redis 缓存后端需要先安装 redis 包: pip install redis")
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        raw = json.dumps(value, ensure_ascii=False)
+        if ttl and ttl > 0:
+            self._client.setex(self.prefix + key, int(ttl), raw)
+        else:
+            self._client.set(self.prefix + key, raw)
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+def create_backend(max_entries, ttl, url=None):
+    """根据 CACHE_BACKEND 配置创建缓存后端：'memory'（默认）或 'redis://...'。"""
+    url = url or config.CACHE_BACKEND
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            return RedisBackend(url, ttl)
+        except Exception as e:
+            logger.error(f"创建 Redis 缓存后端失败，回退到进程内缓存: {e}")
+    return InMemoryBackend(max_entries, ttl)
+
+
+def normalize_query(query):
+    """查询规范化：全角/半角统一、忽略大小写和多余空白，以及末尾的标点。"""
+    text = " ".join(unicodedata.normalize("NFKC", query).lower().split())
+    return text.rstrip("?？!！。.,，~ ")
+
+
+class VersionedResultCache:
+    """
+    按 (目录版本, 规范化查询) 缓存最终结果。
+    目录版本变化后旧条目不再被命中，随 TTL 自然过期，因此共享后端也无需主动清理。
+    """
+
+    def __init__(self, name, backend):
+        self.name = name
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, version, query):
+        return f"{self.name}:{version}:{normalize_query(query)}"
+
+    def get(self, version, query):
+        try:
+            value = self.backend.get(self._key(version, query))
+        except Exception as e:
+            logger.warning(f"读取缓存 '{self.name}' 失败: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, version, query, value):
+        try:
+            self.backend.set(self._key(version, query), value)
+        except Exception as e:
+            logger.warning(f"写入缓存 '{self.name}' 失败: {e}")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "shared_backend": self.backend.shared,
+            }
+        stats["backend"] = self.backend.stats()
+        return stats
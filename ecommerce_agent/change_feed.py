@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from ecommerce_agent import config
+
+logger = logging.getLogger(__name__)
+
+# --- 商品变更流 ---
+# 导入脚本把变更的商品ID以 JSON Lines 的形式追加到变更文件中，
+# 运行中的服务通过 ChangeFeedWatcher 轮询该文件，把变更应用到内存中的向量索引。
+
+
+def publish(product_ids, source="csv_import", path=None):
+    """
+    追加一条变更记录，返回该记录的版本号。
+    每条记录独占一行且一次写入，多个进程同时追加时不会交错。
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return None
+    path = path or config.CHANGE_FEED_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    version = str(time.time_ns())
+    record = {
+        "version": version,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "source": source,
+        "product_ids": product_ids,
+    }
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+    logger.info(f"已向变更流 '{path}' 发布 {len(product_ids)} 个商品变更 (version={version})。")
+    return version
+
+
+def latest_version(path=None):
+    """返回变更文件中最后一条记录的版本号，文件不存在或为空时返回 None。"""
+    path = path or config.CHANGE_FEED_PATH
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 65536))
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    for raw in reversed(lines):
+        try:
+            return json.loads(raw.decode("utf-8")).get("version")
+        except ValueError:
+            continue
+    return None
+
+
+class ChangeFeedWatcher:
+    """
+    在后台线程中轮询变更文件，对每条新记录调用 callback(product_ids, version)。
+    启动时从文件末尾开始读取，之前的变更应已由启动时的索引同步覆盖。
+    """
+
+    def __init__(self, callback, path=None, poll_interval=None):
+        self.callback = callback
+        self.path = path or config.CHANGE_FEED_PATH
+        self.poll_interval = poll_interval if poll_interval is not None else config.CHANGE_FEED_POLL_INTERVAL
+        self._offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.poll_interval <= 0:
+            logger.info("变更流轮询已禁用 (CHANGE_FEED_POLL_INTERVAL<=0)。")
+            return
+        self._thread = threading.Thread(target=self._run, name="change-feed-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"开始监听商品变更流 '{self.path}'，轮询间隔 {self.poll_interval}s。")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"处理商品变更流时出错: {e}", exc_info=True)
+
+    def poll(self):
+        """读取自上次以来新增的完整记录并逐条回调，返回处理的记录数。"""
+        if not os.path.exists(self.path):
+            return 0
+        size = os.path.getsize(self.path)
+        if size < self._offset:
+            # 文件被截断或轮转，从头开始读
+            self._offset = 0
+        if size == self._offset:
+            return 0
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # 只处理以换行结尾的完整行，写了一半的行留到下次
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+        self._offset += end
+
+        count = 0
+        for raw in data[:end].splitlines():
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw.decode("utf-8"))
+            except ValueError:
+                logger.warning(f"跳过无法解析的变更记录: {raw[:200]!r}")
+                continue
+            self.callback(record.get("product_ids", []), record.get("version"))
+            count += 1
+        return count
@@ -23,7 +23,101 @@ MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
 MYSQL_DB = os.getenv("MYSQL_DB")
 
+# MySQL 连接池配置
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", 5)) # 池中最多保持的连接数
+MYSQL_POOL_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", 5)) # 连接全部被占用时，借出连接的最长等待秒数
+MYSQL_POOL_PING_INTERVAL = float(os.getenv("MYSQL_POOL_PING_INTERVAL", 30)) # 空闲超过该秒数的连接在借出前先 ping 检查，0 表示每次都检查
+
+# 嵌入流水线配置
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64)) # 每批嵌入的文本数
+EMBED_NUM_THREADS = int(os.getenv("EMBED_NUM_THREADS", 0)) # torch intra-op 线程数，0 表示使用 torch 默认值
+EMBED_NUM_PROCESSES = int(os.getenv("EMBED_NUM_PROCESSES", 1)) # 构建索引时的嵌入进程数，大于1时启用多进程池
+EMBED_SORT_BY_LENGTH = os.getenv("EMBED_SORT_BY_LENGTH", "True").lower() in ('true', '1', 't') # 按文本长度排序后分批，减少 padding
+
+# 向量索引配置
+FAISS_INDEX_FACTORY = os.getenv("FAISS_INDEX_FACTORY", "Flat") # FAISS index_factory 字符串，如 Flat / IVF256,Flat / HNSW32 / IVF256,PQ64
+FAISS_TRAIN_SAMPLE_SIZE = int(os.getenv("FAISS_TRAIN_SAMPLE_SIZE", 20000)) # IVF/PQ 索引的训练样本数
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", 16)) # IVF 索引查询时探查的聚类数
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", 64)) # HNSW 索引查询时的候选队列长度
+FAISS_MMAP = os.getenv("FAISS_MMAP", "True").lower() in ('true', '1', 't') # 服务进程以 mmap 方式加载索引，多个 worker 共享内存
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "True").lower() in ('true', '1', 't') # 向量检索结果与 BM25 关键词检索结果融合排序
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", 5)) # 商品搜索返回的商品数
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 20)) # 融合前向量检索和关键词检索各取的候选数
+RRF_K = int(os.getenv("RRF_K", 60)) # 倒数排名融合的平滑常数，越大越看重排名靠后的结果
+SEARCH_PREFILTER_MAX_IDS = int(os.getenv("SEARCH_PREFILTER_MAX_IDS", 2000)) # 满足过滤条件的商品不超过该数量时先筛选再检索，否则检索后过滤
+SEARCH_FILTER_OVERSAMPLE = int(os.getenv("SEARCH_FILTER_OVERSAMPLE", 10)) # 检索后过滤时候选数的放大倍数
+
+# 嵌入缓存配置
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "True").lower() in ('true', '1', 't') # 是否启用磁盘嵌入缓存
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "embedding_cache") # 缓存目录，每个模型一个子目录
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", 512)) # 每个模型的缓存大小上限（MB），超出后按 LRU 淘汰
+
+# 结果缓存配置
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory") # 'memory' 为进程内缓存；多 worker 部署可设为 'redis://host:6379/0' 共享缓存（需安装 redis）
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 300)) # 商品搜索结果的缓存秒数，0 表示不过期
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 1000)) # 进程内缓存的最大条目数
+PRODUCT_CACHE_MAX_ENTRIES = int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", 10000)) # 商品行缓存的最大商品数
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 600)) # 商品行缓存的秒数（导入变更会主动失效），0 表示不过期
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "True").lower() in ('true', '1', 't') # 语义相近的问题复用 Agent 的回答
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92)) # 命中所需的最低余弦相似度
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", 3600)) # 语义缓存条目的秒数，0 表示不过期（目录版本变化时清空）
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 5000)) # 语义缓存的最大条目数
+
+# CSV 导入配置
+CSV_IMPORT_BATCH_SIZE = int(os.getenv("CSV_IMPORT_BATCH_SIZE", 1000)) # 每批提交的行数
+
+# 商品变更流配置
+CHANGE_FEED_PATH = os.getenv("CHANGE_FEED_PATH", os.path.join("faiss_index", "changes.jsonl")) # 导入脚本写入、服务端监听的变更文件
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", 5)) # 服务端轮询变更文件的间隔秒数，0 表示不监听
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") # 管理接口的访问令牌；未设置时管理接口只接受本机请求
+
+# 会话记忆配置
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "") # 会话历史的存储后端：memory 或 redis://...，留空时与 CACHE_BACKEND 相同
+SESSION_TTL = int(os.getenv("SESSION_TTL", 1800)) # 会话闲置多少秒后过期
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 10000)) # 进程内最多保留的会话数，超出时按 LRU 淘汰
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", 10)) # 每个会话保留的最近对话轮数
+SESSION_MAX_CHARS = int(os.getenv("SESSION_MAX_CHARS", 8000)) # 每个会话历史的最大字符数
+
+# Agent 上下文预算配置（token 数按 tiktoken 计算）
+CONTEXT_BUDGET_ENABLED = os.getenv("CONTEXT_BUDGET_ENABLED", "True").lower() in ('true', '1', 't') # 是否压缩发给大模型的会话历史和工具输出
+CONTEXT_TOKEN_ENCODING = os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base") # 计算 token 数使用的 tiktoken 编码
+TIKTOKEN_CACHE_DIR = os.getenv("TIKTOKEN_CACHE_DIR", os.path.join("embedding", "tiktoken")) # tiktoken 编码文件的缓存目录（由 download_models.py 预先下载）
+CONTEXT_HISTORY_TOKENS = int(os.getenv("CONTEXT_HISTORY_TOKENS", 1200)) # 原样保留的最近会话历史的 token 预算
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", 3)) # 最多原样保留的最近轮数，更早的轮次压缩为摘要
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 300)) # 较早轮次摘要的 token 预算
+CONTEXT_OBSERVATION_TOKENS = int(os.getenv("CONTEXT_OBSERVATION_TOKENS", 800)) # 单个工具输出的 token 预算
+CONTEXT_SCRATCHPAD_TOKENS = int(os.getenv("CONTEXT_SCRATCHPAD_TOKENS", 1600)) # 一个问题中全部工具输出的 token 预算
+
+# 订单查询配置
+ORDER_LIST_LIMIT = int(os.getenv("ORDER_LIST_LIMIT", 5)) # 订单列表查询默认返回的订单数
+ORDER_LIST_MAX = int(os.getenv("ORDER_LIST_MAX", 20)) # 订单列表查询最多返回的订单数
+
+# 多ID查询配置
+QUERY_MAX_IDS = int(os.getenv("QUERY_MAX_IDS", 10)) # query_order / query_product 一次最多查询的ID数
+QUERY_DESCRIPTION_CHARS = int(os.getenv("QUERY_DESCRIPTION_CHARS", 60)) # 一次查询多个商品时每个商品描述保留的字符数
+
+# 意图路由配置
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "True").lower() in ('true', '1', 't') # 直接回答带订单号/商品ID的简单查询，不调用大模型
+
+# 异步服务模式 (ASGI) 配置
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", 32)) # 同时处理的最大请求数
+ASYNC_MAX_QUEUE = int(os.getenv("ASYNC_MAX_QUEUE", 100)) # 并发已满时最多排队的请求数，超出后直接返回503
+ASYNC_QUEUE_TIMEOUT = float(os.getenv("ASYNC_QUEUE_TIMEOUT", 30)) # 请求排队的最长等待秒数，超时返回503
+DB_THREADS = int(os.getenv("DB_THREADS", 0)) # 数据库查询线程池大小，0 表示与 MYSQL_POOL_SIZE 相同
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", 4)) # 嵌入和向量检索线程池大小
+
+# 链路追踪与日志配置
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "True").lower() in ('true', '1', 't') # 记录问题、LLM、工具、嵌入、向量检索和SQL的耗时，用于 /metrics 和链路导出
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "") # span 的导出目标：文件路径（JSON Lines）或收集器地址（如 http://localhost:9411/api/v2/spans），留空不导出
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "False").lower() in ('true', '1', 't') # 是否在日志中输出完整的查询结果、工具输出和 Agent 执行过程（调试用）
+
+# 批量查询配置
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 64)) # 批量查询每批处理的问题数（一次嵌入、一次向量检索、一次商品行查询）
+BATCH_AGENT_CONCURRENCY = int(os.getenv("BATCH_AGENT_CONCURRENCY", 4)) # 批量查询中同时调用 Agent 的问题数
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 10000)) # /api/query/batch 单次请求的最大问题数
+
 # Flask 配置
+STARTUP_BACKGROUND = os.getenv("STARTUP_BACKGROUND", "True").lower() in ('true', '1', 't') # 在后台线程中加载数据库、嵌入模型和向量索引，端口立即开始服务
 FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
 FLASK_PORT = int(os.getenv("FLASK_PORT", 5000)) # 端口号应为整数
 FLASK_DEBUG = os.getenv("FLASK_DEBUG", "False").lower() in ('true', '1', 't')
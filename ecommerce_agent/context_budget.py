@@ -0,0 +1,331 @@
+import base64
+import json
+import logging
+import os
+import re
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnablePassthrough
+
+from ecommerce_agent import config
+from ecommerce_agent import tracing
+
+logger = logging.getLogger(__name__)
+
+# --- Agent 上下文预算 ---
+# Agent 每一步都把完整的提示词重新发给大模型：系统提示、工具说明、会话历史，以及本次问题中所有工具的输出。
+# 这里按 tiktoken 计算的 token 数给后两者设定预算：
+#   - 工具输出：去掉空行和缩进，把每个商品的多行字段合并为一行，去掉 "相关度" 这类只用于排序诊断的字段；
+#     单条输出超过 CONTEXT_OBSERVATION_TOKENS 时按行截断；本次问题的全部输出超过 CONTEXT_SCRATCHPAD_TOKENS 时，
+#     较早的输出只保留第一行（最新的一条始终完整保留）；
+#   - 会话历史：最近 CONTEXT_RECENT_TURNS 轮在 CONTEXT_HISTORY_TOKENS 以内原样保留，
+#     更早的轮次压缩为一段不超过 CONTEXT_SUMMARY_TOKENS 的摘要（每轮一行 "问：… 答：…"，不额外调用大模型）。
+# 会话存储中的历史和工具的原始输出都不修改，只影响发给大模型的提示词。
+# 每个问题实际发送的提示词 token 数（Agent 各步骤之和）记录在 question span 的 prompt_tokens 属性、
+# /metrics 的 ecommerce_prompt_tokens 直方图和 /api/context/stats 中。
+
+# 工具输出中只用于诊断、对回答没有帮助的字段
+DROPPED_FIELDS = ("相关度",)
+# 缩进的 "字段: 值" 行合并到上一行（编号的列表项除外）
+CONTINUATION_LINE = re.compile(r"^\s+(?!\d+\.)[^:：]{1,12}[:：]")
+FIELD_NAME = re.compile(r"^[-\s]*([^:：]{1,12})[:：]")
+CJK_CHARS = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+# 每条消息的格式开销（角色标记等），与 OpenAI 的计数方式一致
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _encoding_paths(name, cache_dir):
+    """本地编码文件：<名称>.tiktoken 保存 BPE 词表（与 tiktoken 发布的格式相同），<名称>.json 保存分词正则和特殊 token。"""
+    base = os.path.join(cache_dir or config.TIKTOKEN_CACHE_DIR, name)
+    return base + ".tiktoken", base + ".json"
+
+
+def save_encoding(name=None, cache_dir=None):
+    """
+    通过 tiktoken 下载编码并写入 cache_dir（默认 TIKTOKEN_CACHE_DIR），由 download_models.py 调用。
+    返回编码对象，失败时抛出异常。
+    """
+    import tiktoken
+    name = name or config.CONTEXT_TOKEN_ENCODING
+    encoding = tiktoken.get_encoding(name)
+    ranks_path, meta_path = _encoding_paths(name, cache_dir)
+    os.makedirs(os.path.dirname(os.path.abspath(ranks_path)), exist_ok=True)
+    # tiktoken 没有公开构造参数，这里读取 Encoding 保存的构造参数
+    with open(ranks_path + ".tmp", "wb") as f:
+        for token, rank in sorted(encoding._mergeable_ranks.items(), key=lambda item: item[1]):
+            f.write(base64.b64encode(token) + b" " + str(rank).encode() + b"\n")
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"pat_str": encoding._pat_str, "special_tokens": encoding._special_tokens}, f, ensure_ascii=False)
+    os.replace(ranks_path + ".tmp", ranks_path)
+    os.replace(meta_path + ".tmp", meta_path)
+    return encoding
+
+
+def load_encoding(name=None, cache_dir=None):
+    """
+    从本地缓存目录加载 tiktoken 编码，不访问网络（编码文件由 download_models.py 预先下载）。
+    文件不存在或无法加载时返回 None，由调用方改用按字符估算。
+    """
+    name = name or config.CONTEXT_TOKEN_ENCODING
+    ranks_path, meta_path = _encoding_paths(name, cache_dir)
+    if not (os.path.exists(ranks_path) and os.path.exists(meta_path)):
+        logger.info(f"本地没有 tiktoken 编码 '{name}'（{ranks_path}），按字符估算 token 数；运行 download_models.py 可下载。")
+        return None
+    try:
+        import tiktoken
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(ranks_path, "rb") as f:
+            ranks = {base64.b64decode(token): int(rank) for token, rank in (line.split() for line in f if line.strip())}
+        return tiktoken.Encoding(name=name, pat_str=meta["pat_str"], mergeable_ranks=ranks,
+                                 special_tokens=meta["special_tokens"])
+    except Exception as e:
+        logger.warning(f"无法加载 tiktoken 编码 '{name}'，改为按字符估算 token 数: {e}")
+        return None
+
+
+class TokenCounter:
+    """
+    计算文本和消息列表的 token 数。
+    目标模型不是 OpenAI 模型时 tiktoken 的结果是近似值，但足以比较不同提示词的大小；
+    编码不可用时按 "每个中日韩字符 1 个 token、其他字符每 4 个 1 个 token" 估算。
+    传入 loader 时编码在第一次计数（或调用 load()）时才加载，不阻塞 Agent 的创建。
+    """
+
+    def __init__(self, encoding=None, loader=None):
+        self._encoding = encoding
+        self._loader = loader if encoding is None else None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """加载编码（只加载一次），返回编码对象或 None。"""
+        if self._loader is not None:
+            with self._lock:
+                if self._loader is not None:
+                    self._encoding = self._loader()
+                    self._loader = None
+        return self._encoding
+
+    @property
+    def encoding(self):
+        return self.load()
+
+    def count(self, text):
+        text = str(text or "")
+        if not text:
+            return 0
+        encoding = self.load()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        cjk = len(CJK_CHARS.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def count_messages(self, messages):
+        return sum(self.count(message.content) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def truncate(self, text, max_tokens, suffix="…"):
+        """截断到不超过 max_tokens 个 token（按字符截断，不会切开多字节字符）。"""
+        total = self.count(text)
+        if total <= max_tokens:
+            return text
+        chars = int(len(text) * max_tokens / total)
+        while chars > 0 and self.count(text[:chars]) > max_tokens:
+            chars = int(chars * 0.9)
+        return text[:chars] + suffix
+
+
+def compact_observation(text):
+    """把工具输出整理为紧凑的结构化文本：去掉空行和多余空白，缩进的字段行合并到所属条目的行中。"""
+    lines = []
+    for raw in str(text).splitlines():
+        line = " ".join(raw.split())
+        if not line:
+            continue
+        field = FIELD_NAME.match(line)
+        if field and field.group(1).strip() in DROPPED_FIELDS:
+            continue
+        if lines and CONTINUATION_LINE.match(raw):
+            lines[-1] += "｜" + line.lstrip("- ")
+        else:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+class PromptTokenReport(BaseCallbackHandler):
+    """统计一个问题中每次大模型调用发送的提示词 token 数。"""
+
+    run_inline = True
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        tokens = sum(self.counter.count_messages(batch) for batch in messages)
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, tokens)
+
+
+class ContextBudget:
+    """按 token 预算压缩 Agent 提示词中的会话历史和工具输出，并汇总每个问题的提示词 token 数。"""
+
+    def __init__(self, enabled=True, counter=None):
+        self.enabled = enabled
+        self.counter = counter or TokenCounter(loader=load_encoding)
+        self.history_tokens = config.CONTEXT_HISTORY_TOKENS
+        self.recent_turns = config.CONTEXT_RECENT_TURNS
+        self.summary_tokens = config.CONTEXT_SUMMARY_TOKENS
+        self.observation_tokens = config.CONTEXT_OBSERVATION_TOKENS
+        self.scratchpad_tokens = config.CONTEXT_SCRATCHPAD_TOKENS
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._llm_calls = 0
+        self._prompt_tokens = 0
+        self._max_prompt_tokens = 0
+
+    # --- 工具输出 ---
+
+    def _fit_lines(self, text, max_tokens):
+        """按行截断到 max_tokens 以内，注明省略的行数；第一行本身超出时截断第一行。"""
+        lines = text.splitlines()
+        kept, used = [], 0
+        for line in lines:
+            tokens = self.counter.count(line) + 1
+            if used + tokens > max_tokens:
+                break
+            kept.append(line)
+            used += tokens
+        if not kept:
+            return self.counter.truncate(lines[0], max_tokens) if lines else ""
+        if len(kept) < len(lines):
+            kept.append(f"…（其余 {len(lines) - len(kept)} 行已省略）")
+        return "\n".join(kept)
+
+    def compact_steps(self, intermediate_steps):
+        """返回观察结果经过压缩的 intermediate_steps，AgentAction 保持不变。"""
+        if not intermediate_steps:
+            return intermediate_steps
+        observations = [self._fit_lines(compact_observation(observation), self.observation_tokens)
+                        for _, observation in intermediate_steps]
+        total = sum(self.counter.count(observation) for observation in observations)
+        # 超出预算时从最早的输出开始只保留第一行，最新的输出保持完整
+        for i in range(len(observations) - 1):
+            if total <= self.scratchpad_tokens:
+                break
+            first_line = observations[i].split("\n", 1)[0]
+            shortened = self.counter.truncate(first_line, self.observation_tokens // 4) + "（详细内容已省略）"
+            total -= self.counter.count(observations[i]) - self.counter.count(shortened)
+            observations[i] = shortened
+        return [(action, observation) for (action, _), observation in zip(intermediate_steps, observations)]
+
+    # --- 会话历史 ---
+
+    @staticmethod
+    def _pair_turns(messages):
+        """把 [问题, 回答, ...] 消息列表还原为 [(问题, 回答)]。"""
+        turns, question = [], None
+        for message in messages:
+            if isinstance(message, HumanMessage):
+                question = message.content
+            elif isinstance(message, AIMessage):
+                turns.append((question or "", message.content))
+                question = None
+        return turns
+
+    def _summarize(self, turns):
+        """较早的轮次压缩为每轮一行的摘要，超出预算时丢弃最早的行。"""
+        lines = []
+        for question, answer in turns:
+            # 回答的开头往往是客套话，合并各行后再截断，保留后面的商品、订单等要点
+            answer = " ".join(answer.split())
+            lines.append(f"- 问：{self.counter.truncate(question, 40)} 答：{self.counter.truncate(answer, 80)}")
+        while len(lines) > 1 and self.counter.count("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "此前对话摘要（较早的轮次，仅供参考）：\n" + "\n".join(lines)
+
+    def fit_history(self, chat_history):
+        """按预算返回发送给大模型的会话历史：最近的轮次原样保留，更早的轮次合并为一条摘要消息。"""
+        turns = self._pair_turns(chat_history or [])
+        if not turns:
+            return chat_history
+        kept, used = [], 0
+        for question, answer in reversed(turns):
+            tokens = self.counter.count(question) + self.counter.count(answer) + 2 * MESSAGE_OVERHEAD_TOKENS
+            if len(kept) >= self.recent_turns or (kept and used + tokens > self.history_tokens):
+                break
+            if not kept and tokens > self.history_tokens:
+                # 最近一轮本身超出预算时截断回答
+                answer = self.counter.truncate(answer, max(1, self.history_tokens - self.counter.count(question)))
+            kept.append((question, answer))
+            used += tokens
+        kept.reverse()
+        older = turns[:len(turns) - len(kept)]
+
+        messages = []
+        if older:
+            messages.append(SystemMessage(content=self._summarize(older)))
+        for question, answer in kept:
+            messages.extend([HumanMessage(content=question), AIMessage(content=answer)])
+        return messages
+
+    # --- 接入 Agent ---
+
+    def wrap(self, agent):
+        """在 create_json_chat_agent 返回的 Runnable 之前压缩会话历史和工具输出；未开启时原样返回。"""
+        if not self.enabled:
+            return agent
+        return RunnablePassthrough.assign(
+            intermediate_steps=lambda x: self.compact_steps(x["intermediate_steps"]),
+            chat_history=lambda x: self.fit_history(x.get("chat_history")),
+        ) | agent
+
+    def start_report(self):
+        return PromptTokenReport(self.counter)
+
+    def record(self, report):
+        """汇总一个问题的提示词 token 数，写入当前 question span、/metrics 和统计。"""
+        if not report.llm_calls:
+            return
+        with self._lock:
+            self._requests += 1
+            self._llm_calls += report.llm_calls
+            self._prompt_tokens += report.prompt_tokens
+            self._max_prompt_tokens = max(self._max_prompt_tokens, report.prompt_tokens)
+        tracing.PROMPT_TOKENS.observe(report.prompt_tokens)
+        span = tracing.current_span()
+        if span is not None:
+            span.set(prompt_tokens=report.prompt_tokens, llm_calls=report.llm_calls)
+        logger.info(f"本次问题调用大模型 {report.llm_calls} 次，提示词共 {report.prompt_tokens} tokens"
+                    f"（单次最多 {report.max_prompt_tokens}）。")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "tokenizer": self.counter.encoding.name if self.counter.encoding is not None else "estimate",
+                "requests": self._requests,
+                "llm_calls": self._llm_calls,
+                "prompt_tokens": self._prompt_tokens,
+                "avg_prompt_tokens_per_request": round(self._prompt_tokens / self._requests, 1) if self._requests else None,
+                "avg_prompt_tokens_per_call": round(self._prompt_tokens / self._llm_calls, 1) if self._llm_calls else None,
+                "max_prompt_tokens_per_request": self._max_prompt_tokens,
+                "budgets": {
+                    "history_tokens": self.history_tokens,
+                    "recent_turns": self.recent_turns,
+                    "summary_tokens": self.summary_tokens,
+                    "observation_tokens": self.observation_tokens,
+                    "scratchpad_tokens": self.scratchpad_tokens,
+                },
+            }
+
+
+def create_context_budget():
+    """按 CONTEXT_* 配置创建上下文预算；CONTEXT_BUDGET_ENABLED=False 时只统计提示词 token 数，不做压缩。"""
+    return ContextBudget(enabled=config.CONTEXT_BUDGET_ENABLED)
@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ecommerce_agent import config
+
+logger = logging.getLogger(__name__)
+
+# 缓存目录中的文件
+VECTORS_FILE_NAME = "vectors.f32"  # 定长 float32 槽位数组，可直接 mmap
+INDEX_FILE_NAME = "index.sqlite"   # 文本哈希 -> 槽位 的映射以及最近使用时间
+
+
+def normalize_text(text):
+    """缓存键使用的文本规范化：全角/半角统一，合并连续空白。"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingCache:
+    """
+    按内容寻址的磁盘嵌入缓存。
+    键为 (嵌入类型, 规范化文本) 的 SHA-256，向量以定长槽位存放在一个 float32 文件中并通过 mmap 读取，
+    槽位映射和最近使用时间保存在 SQLite 中；超过容量时按 LRU 淘汰。
+    不同模型使用各自独立的子目录，模型变化后旧缓存不会被误用。
+    """
+
+    def __init__(self, directory, model, max_bytes):
+        self.model = model
+        self.max_bytes = max_bytes
+        self.path = os.path.join(directory, hashlib.sha256(model.encode("utf-8")).hexdigest()[:16])
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.path, INDEX_FILE_NAME), check_same_thread=False,
+                                   isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used)")
+        self._db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('model', ?)", (model,))
+        self._vectors = None
+        self.dim = None
+        self.capacity = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        if row:
+            self._open_vectors(int(row[0]))
+
+    @staticmethod
+    def make_key(text, kind):
+        return hashlib.sha256(f"{kind}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _open_vectors(self, dim):
+        """打开（必要时创建或调整大小）向量文件，容量由 max_bytes 和维度决定。"""
+        self.dim = dim
+        self.capacity = max(1, self.max_bytes // (dim * 4))
+        self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (str(dim),))
+        # 缩小容量时先丢弃超出范围的槽位
+        removed = self._db.execute("DELETE FROM entries WHERE slot >= ?", (self.capacity,)).rowcount
+        if removed:
+            logger.info(f"嵌入缓存容量缩小，丢弃了 {removed} 条缓存。")
+        vectors_file = os.path.join(self.path, VECTORS_FILE_NAME)
+        size = self.capacity * dim * 4
+        with open(vectors_file, "ab") as f:
+            if f.tell() != size:
+                f.truncate(size)
+        self._vectors = np.memmap(vectors_file, dtype=np.float32, mode="r+", shape=(self.capacity, dim))
+
+    def get_many(self, keys):
+        """返回与 keys 对应的向量列表，未命中的位置为 None。"""
+        results = [None] * len(keys)
+        if self._vectors is None and keys:
+            # 其他进程可能已经创建了向量文件
+            with self._lock:
+                row = self._db.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+                if row and self._vectors is None:
+                    self._open_vectors(int(row[0]))
+        if self._vectors is None or not keys:
+            with self._lock:
+                self.misses += len(keys)
+            return results
+        with self._lock:
+            slots = {}
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, slot in self._db.execute(
+                        f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", chunk):
+                    slots[key] = slot
+            if slots:
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                     [(now, key) for key in slots])
+            for i, key in enumerate(keys):
+                slot = slots.get(key)
+                if slot is not None:
+                    results[i] = np.array(self._vectors[slot])
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return results
+
+    def put_many(self, keys, vectors):
+        """写入一批向量，容量不足时淘汰最久未使用的条目。"""
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._vectors is None:
+                self._open_vectors(vectors.shape[1])
+            pairs = list(dict(zip(keys, vectors)).items())[:self.capacity]
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                existing = {}
+                for key, _ in pairs:
+                    row = self._db.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                    if row:
+                        existing[key] = row[0]
+                new_count = len(pairs) - len(existing)
+                used = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                free_slots = self._free_slots(min(new_count, self.capacity - used))
+                evict = new_count - len(free_slots)
+                if evict > 0:
+                    victims = self._db.execute(
+                        "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (evict,)
+                    ).fetchall()
+                    victims = [(k, s) for k, s in victims if k not in existing]
+                    self._db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in victims])
+                    free_slots.extend(s for _, s in victims)
+                    self.evictions += len(victims)
+
+                now = time.time()
+                rows = []
+                for key, vector in pairs:
+                    slot = existing.get(key)
+                    if slot is None:
+                        if not free_slots:
+                            break
+                        slot = free_slots.pop()
+                    self._vectors[slot] = vector
+                    rows.append((key, slot, now))
+                self._vectors.flush()
+                self._db.executemany("INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)", rows)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _free_slots(self, count):
+        """返回 count 个未被占用的槽位。"""
+        if count <= 0:
+            return []
+        used_count, max_slot = self._db.execute("SELECT COUNT(*), COALESCE(MAX(slot), -1) FROM entries").fetchone()
+        if max_slot + 1 == used_count:
+            # 淘汰出的槽位总是立即复用，已用槽位通常是连续的，无需扫描
+            return list(range(used_count, min(self.capacity, used_count + count)))
+        used = {row[0] for row in self._db.execute("SELECT slot FROM entries")}
+        free = []
+        for slot in range(self.capacity):
+            if slot not in used:
+                free.append(slot)
+                if len(free) == count:
+                    break
+        return free
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {
+                "model": self.model,
+                "entries": entries,
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    为任意 LangChain 嵌入模型加上磁盘缓存，索引构建和查询检索共用。
+    文档嵌入和查询嵌入分别缓存，以兼容对查询添加指令前缀的模型。
+    """
+
+    def __init__(self, base, cache):
+        self.base = base
+        self.cache = cache
+
+    def embed_documents(self, texts, compute=None):
+        """compute 可替换未命中文本的计算方式（例如多进程编码），默认使用 base.embed_documents。"""
+        texts = list(texts)
+        keys = [EmbeddingCache.make_key(text, "doc") for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            compute = compute or self.base.embed_documents
+            computed = np.asarray(compute([texts[i] for i in missing]), dtype=np.float32)
+            self.cache.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return [v.tolist() for v in vectors]
+
+    def embed_queries(self, texts):
+        """批量嵌入查询，缓存未命中的部分一次计算（见 embedding_pipeline.embed_queries）。"""
+        from ecommerce_agent.embedding_pipeline import embed_queries
+
+        texts = list(texts)
+        keys = [EmbeddingCache.make_key(text, "query") for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            computed = np.asarray(embed_queries(self.base, [texts[i] for i in missing]), dtype=np.float32)
+            self.cache.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return [v.tolist() for v in vectors]
+
+    def embed_query(self, text):
+        key = EmbeddingCache.make_key(text, "query")
+        vector = self.cache.get_many([key])[0]
+        if vector is None:
+            vector = np.asarray(self.base.embed_query(text), dtype=np.float32)
+            self.cache.put_many([key], vector.reshape(1, -1))
+        return vector.tolist()
+
+
+def wrap_with_cache(embeddings, model):
+    """按配置为嵌入模型包装磁盘缓存；未启用缓存时原样返回。"""
+    if not config.EMBED_CACHE_ENABLED:
+        return embeddings
+    cache = EmbeddingCache(config.EMBED_CACHE_DIR, model, config.EMBED_CACHE_MAX_MB * 1024 * 1024)
+    logger.info(f"嵌入缓存已启用: {cache.path}，容量上限 {config.EMBED_CACHE_MAX_MB}MB。")
+    return CachedEmbeddings(embeddings, cache)
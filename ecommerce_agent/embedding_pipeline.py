@@ -0,0 +1,148 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from ecommerce_agent import config
+
+logger = logging.getLogger(__name__)
+
+
+def configure_torch_threads(num_threads=None):
+    """设置 torch 的 intra-op 线程数，0 或 None 表示保持 torch 的默认值。"""
+    num_threads = config.EMBED_NUM_THREADS if num_threads is None else num_threads
+    if not num_threads:
+        return
+    try:
+        import torch
+    except ImportError:
+        logger.warning("未安装 torch，忽略 EMBED_NUM_THREADS 设置。")
+        return
+    torch.set_num_threads(num_threads)
+    logger.info(f"torch intra-op 线程数已设置为 {num_threads}。")
+
+
+def load_embeddings(model_path, batch_size=None):
+    """
+    加载 HuggingFace 嵌入模型，编码批大小与嵌入流水线保持一致。
+    启用嵌入缓存时返回带磁盘缓存的包装，索引构建和查询检索共用同一份缓存。
+    """
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from ecommerce_agent.embedding_cache import wrap_with_cache
+
+    configure_torch_threads()
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model_path,
+        encode_kwargs={"batch_size": batch_size or config.EMBED_BATCH_SIZE}
+    )
+    return wrap_with_cache(embeddings, os.path.basename(os.path.normpath(model_path)))
+
+
+def embed_queries(embeddings, texts):
+    """
+    批量嵌入多条查询文本，返回与输入顺序对应的向量列表。
+    HuggingFaceEmbeddings 的查询嵌入与文档嵌入相同，整批一次前向计算；带缓存的包装只计算未命中的查询；
+    其他嵌入模型可能对查询加指令前缀，逐条调用 embed_query。
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    batch = getattr(embeddings, "embed_queries", None)
+    if batch is not None:
+        return batch(texts)
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    if type(embeddings) is HuggingFaceEmbeddings:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class EmbeddingPipeline:
+    """
+    分批嵌入流水线，用于构建和更新索引。
+    - 按文本长度排序后分批，同一批内长度相近，减少 padding 浪费；
+    - 逐批产出向量，调用方可以直接写入索引，不需要把全部向量保存在内存中；
+    - num_processes > 1 且待嵌入文本足够多时，使用 sentence-transformers 的多进程池；
+    - 记录吞吐量（文档/秒），用于评估构建机器的规格。
+    """
+
+    def __init__(self, embeddings, batch_size=None, num_processes=None, sort_by_length=None,
+                 log_interval=10.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size or config.EMBED_BATCH_SIZE
+        self.num_processes = num_processes or config.EMBED_NUM_PROCESSES
+        self.sort_by_length = config.EMBED_SORT_BY_LENGTH if sort_by_length is None else sort_by_length
+        self.log_interval = log_interval
+        self.stats = {"docs": 0, "batches": 0, "seconds": 0.0, "docs_per_second": 0.0}
+
+    @property
+    def _base(self):
+        """去掉缓存包装后的底层嵌入模型。"""
+        return getattr(self.embeddings, "base", self.embeddings)
+
+    def _use_process_pool(self, total):
+        return (
+            self.num_processes > 1
+            and total >= self.batch_size * self.num_processes
+            and hasattr(self._base, "client")
+        )
+
+    def iter_batches(self, items, text_of=lambda item: item[1]):
+        """
+        对 items 分批嵌入，逐批产出 (该批的items, float32向量矩阵)。
+        排序后产出顺序与输入顺序不同，调用方应通过 items 自身携带的ID写入索引。
+        """
+        items = list(items)
+        if self.sort_by_length:
+            items.sort(key=lambda item: len(text_of(item)))
+
+        started = time.monotonic()
+        last_log = started
+        pool = None
+        if self._use_process_pool(len(items)):
+            logger.info(f"启动 {self.num_processes} 个嵌入进程...")
+            pool = self._base.client.start_multi_process_pool(
+                target_devices=["cpu"] * self.num_processes
+            )
+        # 多进程时每次分发给进程池 batch_size * num_processes 条，每个进程内仍按 batch_size 编码
+        chunk_size = self.batch_size * self.num_processes if pool is not None else self.batch_size
+        try:
+            for start in range(0, len(items), chunk_size):
+                batch = items[start:start + chunk_size]
+                texts = [text_of(item) for item in batch]
+                if pool is not None:
+                    def encode(texts):
+                        return self._base.client.encode_multi_process(
+                            texts, pool, batch_size=self.batch_size, **self._encode_kwargs()
+                        )
+                    if self._base is not self.embeddings:
+                        # 经过缓存：只有未命中的文本交给进程池
+                        vectors = self.embeddings.embed_documents(texts, compute=encode)
+                    else:
+                        vectors = encode(texts)
+                else:
+                    vectors = self.embeddings.embed_documents(texts)
+                vectors = np.asarray(vectors, dtype=np.float32)
+
+                self.stats["docs"] += len(batch)
+                self.stats["batches"] += 1
+                now = time.monotonic()
+                if now - last_log >= self.log_interval:
+                    logger.info(f"嵌入进度: {self.stats['docs']}/{len(items)}，"
+                                f"{self.stats['docs'] / (now - started):.1f} 文档/秒")
+                    last_log = now
+                yield batch, vectors
+        finally:
+            if pool is not None:
+                self._base.client.stop_multi_process_pool(pool)
+            self.stats["seconds"] = round(self.stats["seconds"] + time.monotonic() - started, 3)
+            if self.stats["seconds"]:
+                self.stats["docs_per_second"] = round(self.stats["docs"] / self.stats["seconds"], 1)
+
+    def _encode_kwargs(self):
+        """多进程编码时沿用 HuggingFaceEmbeddings 上的归一化设置。"""
+        encode_kwargs = getattr(self._base, "encode_kwargs", {}) or {}
+        kwargs = {}
+        if "normalize_embeddings" in encode_kwargs:
+            kwargs["normalize_embeddings"] = encode_kwargs["normalize_embeddings"]
+        return kwargs
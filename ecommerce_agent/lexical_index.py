@@ -0,0 +1,200 @@
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# 与 FAISS 索引保存在同一目录
+LEXICAL_FILE_NAME = "lexical_index.json"
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 商品名称在文档中重复计入的次数，使名称命中比描述命中更重要
+NAME_WEIGHT = 2
+
+ASCII_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-+][a-z0-9]+)*")
+CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+
+
+def tokenize(text):
+    """
+    中文按字二元组切分（单字词保留单字），字母数字按连续串切分并统一小写，
+    "Gore-Tex"、"16GB"、"2.8K" 这类型号和规格整体作为一个词，同时保留其中的组成部分。
+    不依赖分词词典，索引和查询使用同一规则。
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    tokens = []
+    for match in ASCII_TOKEN.finditer(text):
+        token = match.group()
+        tokens.append(token)
+        parts = re.split(r"[.\-+]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    for match in CJK_RUN.finditer(text):
+        run = match.group()
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def build_lexical_text(product):
+    """生成用于关键词检索的商品文本：名称、描述和规格。"""
+    name = product.get("name") or ""
+    return "\n".join([name] * NAME_WEIGHT + [product.get("description") or "", product.get("specifications") or ""])
+
+
+class LexicalIndex:
+    """
+    商品名称/描述/规格上的 BM25 倒排索引，补充向量检索对品牌、型号、规格等精确词的不足。
+    倒排表常驻内存：词 -> {商品ID: 词频}。每个商品记录文本哈希，增量同步时跳过未变化的商品。
+    """
+
+    def __init__(self):
+        self._docs = {}      # 商品ID -> (文本哈希, {词: 词频}, 文档长度)
+        self._postings = {}  # 词 -> {商品ID: 词频}
+        self._total_length = 0
+        self._norms = None   # 商品ID -> BM25 长度归一化项，索引变化后按需重算
+
+    def __len__(self):
+        return len(self._docs)
+
+    def product_ids(self):
+        return list(self._docs)
+
+    def _add(self, product_id, text_hash, term_freqs):
+        length = sum(term_freqs.values())
+        self._norms = None
+        self._docs[product_id] = (text_hash, term_freqs, length)
+        self._total_length += length
+        for term, tf in term_freqs.items():
+            self._postings.setdefault(term, {})[product_id] = tf
+
+    def _remove(self, product_id):
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return False
+        _, term_freqs, length = doc
+        self._norms = None
+        self._total_length -= length
+        for term in term_freqs:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(product_id, None)
+                if not posting:
+                    del self._postings[term]
+        return True
+
+    def sync(self, products, scope=None):
+        """
+        用数据库中的商品更新索引，返回统计字典。
+        scope 为 None 时 products 视为全量商品，索引中多出的商品会被删除；
+        否则只在 scope 这些商品ID范围内计算删除。
+        """
+        stats = {"added": 0, "updated": 0, "removed": 0, "skipped": 0}
+        seen = set()
+        for product in products:
+            product_id = product["id"]
+            seen.add(product_id)
+            text = build_lexical_text(product)
+            text_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            old = self._docs.get(product_id)
+            if old is not None and old[0] == text_hash:
+                stats["skipped"] += 1
+                continue
+            term_freqs = {}
+            for token in tokenize(text):
+                term_freqs[token] = term_freqs.get(token, 0) + 1
+            self._remove(product_id)
+            self._add(product_id, text_hash, term_freqs)
+            stats["added" if old is None else "updated"] += 1
+
+        candidates = list(self._docs) if scope is None else scope
+        for product_id in candidates:
+            if product_id not in seen and self._remove(product_id):
+                stats["removed"] += 1
+        return stats
+
+    def _length_norms(self):
+        norms = self._norms
+        if norms is None:
+            avg_length = self._total_length / len(self._docs) or 1.0
+            norms = {pid: BM25_K1 * (1 - BM25_B + BM25_B * doc[2] / avg_length) for pid, doc in self._docs.items()}
+            self._norms = norms
+        return norms
+
+    def search(self, query, k, allowed=None):
+        """返回 [(商品ID, BM25分数)]，分数越高越相关；allowed 为商品ID集合时只返回其中的商品。"""
+        n = len(self._docs)
+        if not n:
+            return []
+        norms = self._length_norms()
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            weight = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5)) * (BM25_K1 + 1)
+            for product_id, tf in posting.items():
+                if allowed is not None and product_id not in allowed:
+                    continue
+                scores[product_id] = scores.get(product_id, 0.0) + weight * tf / (tf + norms[product_id])
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def copy(self):
+        """复制索引；在副本上更新后再替换引用，正在进行的检索不受影响。"""
+        clone = LexicalIndex()
+        clone._docs = dict(self._docs)
+        clone._postings = {term: dict(posting) for term, posting in self._postings.items()}
+        clone._total_length = self._total_length
+        clone._norms = self._norms
+        return clone
+
+    @classmethod
+    def load(cls, path):
+        """从索引目录加载，文件不存在时返回 None。"""
+        file = os.path.join(path, LEXICAL_FILE_NAME)
+        if not os.path.exists(file):
+            return None
+        with open(file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls()
+        for product_id, (text_hash, term_freqs) in data["docs"].items():
+            index._add(product_id, text_hash, term_freqs)
+        return index
+
+    def save(self, path):
+        """先写临时文件再原子替换。"""
+        os.makedirs(path, exist_ok=True)
+        file = os.path.join(path, LEXICAL_FILE_NAME)
+        data = {"docs": {pid: [doc[0], doc[1]] for pid, doc in self._docs.items()}}
+        with open(file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(file + ".tmp", file)
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    """
+    倒数排名融合：每个结果的得分为各路排名 1/(k+rank) 之和，不需要对向量距离和 BM25 分数做归一化。
+    rankings 为 {来源名: [(商品ID, 原始分数), ...]}（已按相关度排序）。
+    返回 [(商品ID, {"rrf": 融合分数, 来源名: {"rank": 名次, "score": 原始分数}, ...})]。
+    """
+    fused = {}
+    for source, ranking in rankings.items():
+        for rank, (product_id, score) in enumerate(ranking, 1):
+            info = fused.setdefault(product_id, {"rrf": 0.0})
+            info["rrf"] += 1.0 / (k + rank)
+            info[source] = {"rank": rank, "score": round(float(score), 4)}
+    ordered = sorted(fused.items(), key=lambda item: item[1]["rrf"], reverse=True)
+    for _, info in ordered:
+        info["rrf"] = round(info["rrf"], 5)
+    return ordered[:limit] if limit else ordered
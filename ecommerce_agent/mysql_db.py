@@ -1,26 +1,39 @@
 import mysql.connector
 from mysql.connector import Error
 import csv
+import json
 import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
 from ecommerce_agent import config
+from ecommerce_agent import tracing
+from ecommerce_agent.product_filters import derive_product_attributes
 
 logger = logging.getLogger(__name__)
 
 # --- 数据库连接 ---
 
-def get_db_connection():
-    """建立到MySQL数据库的连接。"""
-    logger.info(f"正在尝试连接到MySQL数据库: host={config.MYSQL_HOST}, db={config.MYSQL_DB}")
+def get_db_connection(**kwargs):
+    """
+    建立一条新的到MySQL数据库的物理连接（由连接池调用，业务代码请使用 db_connection()）。
+    kwargs 会透传给 mysql.connector.connect，例如 allow_local_infile=True。
+    """
+    logger.debug(f"正在尝试连接到MySQL数据库: host={config.MYSQL_HOST}, db={config.MYSQL_DB}")
     try:
         connection = mysql.connector.connect(
             host=config.MYSQL_HOST,
             port=config.MYSQL_PORT,
             user=config.MYSQL_USER,
             password=config.MYSQL_PASSWORD,
-            database=config.MYSQL_DB
+            database=config.MYSQL_DB,
+            **kwargs
         )
         if connection.is_connected():
-            logger.info("数据库连接成功。")
+            logger.debug("数据库连接成功。")
             return connection
     except Error as e:
         logger.error(f"连接MySQL时出错: {e}", exc_info=True)
@@ -29,164 +42,823 @@ def get_db_connection():
             logger.warning("数据库访问被拒绝。提醒: 请检查 .env 文件中的数据库凭据是否正确。")
         return None
 
+
+class ConnectionPool:
+    """
+    线程安全的MySQL连接池。
+    连接按需创建，最多保持 size 条；借出前对空闲较久的连接做 ping 健康检查，
+    归还时回滚未结束的事务，避免下一个使用者读到旧的一致性快照。
+    """
+
+    def __init__(self, size, timeout, ping_interval):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle = queue.LifoQueue()  # 元素为 (connection, 归还时间)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        # 连接池指标
+        self._checkouts = 0
+        self._checkout_failures = 0
+        self._health_check_failures = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def _reserve_slot(self):
+        """在未达到上限时占用一个新建连接的名额。"""
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return True
+            return False
+
+    def _release_slot(self):
+        with self._lock:
+            self._created -= 1
+
+    def _is_healthy(self, conn, idle_since):
+        """借出前的健康检查，必要时尝试重连一次。"""
+        if time.monotonic() - idle_since < self.ping_interval:
+            return True
+        try:
+            conn.ping(reconnect=True, attempts=1, delay=0)
+            return True
+        except Error as e:
+            logger.warning(f"连接池中的连接健康检查失败，将丢弃该连接: {e}")
+            with self._lock:
+                self._health_check_failures += 1
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._release_slot()
+
+    def acquire(self):
+        """借出一条可用连接，超时或无法建立连接时返回 None。"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        while conn is None:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve_slot():
+                    conn = get_db_connection()
+                    if conn is None:
+                        self._release_slot()
+                        break
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    conn, idle_since = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if not self._is_healthy(conn, idle_since):
+                self._discard(conn)
+                conn = None
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+            if conn is None:
+                self._checkout_failures += 1
+            else:
+                self._checkouts += 1
+                self._in_use += 1
+        if conn is None:
+            logger.error(f"从连接池获取数据库连接失败 (等待 {waited:.3f}s)。")
+        return conn
+
+    def release(self, conn):
+        """归还连接；连接已损坏时直接丢弃。"""
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Error as e:
+            logger.warning(f"归还连接时回滚失败，将丢弃该连接: {e}")
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def stats(self):
+        """返回连接池指标的快照。"""
+        with self._lock:
+            attempts = self._checkouts + self._checkout_failures
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "checkout_failures": self._checkout_failures,
+                "health_check_failures": self._health_check_failures,
+                "wait_time_avg_ms": round(self._wait_time_total / attempts * 1000, 3) if attempts else 0.0,
+                "wait_time_max_ms": round(self._wait_time_max * 1000, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """获取进程内共享的连接池（首次调用时创建）。"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    size=config.MYSQL_POOL_SIZE,
+                    timeout=config.MYSQL_POOL_TIMEOUT,
+                    ping_interval=config.MYSQL_POOL_PING_INTERVAL
+                )
+    return _pool
+
+@contextmanager
+def db_connection():
+    """
+    从连接池借出一条连接，离开 with 代码块时无论是否发生异常都会归还。
+    无法获取连接时产出 None，调用方需自行检查。
+
+    用法:
+        with db_connection() as conn:
+            if not conn:
+                ...
+    """
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        # 追踪开启时每条 SQL 语句记录为一个 span
+        yield tracing.trace_connection(conn)
+    finally:
+        if conn is not None:
+            pool.release(conn)
+
+def get_pool_stats():
+    """返回连接池指标，用于健康检查和监控。"""
+    return get_pool().stats()
+
 # --- 表初始化 ---
 
 def init_database():
     """
     初始化数据库，如果表不存在，则创建 'products' 和 'orders' 表。
     """
-    conn = get_db_connection()
-    if not conn:
-        print("无法连接到数据库。正在中止初始化。")
-        return
+    with db_connection() as conn:
+        if not conn:
+            print("无法连接到数据库。正在中止初始化。")
+            return
 
-    cursor = conn.cursor()
-    try:
-        # 创建 products 表
-        print("正在创建 'products' 表...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id VARCHAR(255) PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                description TEXT,
-                specifications VARCHAR(255),
-                price VARCHAR(255),
-                activity TEXT
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
-        """)
-        print("表 'products' 已创建或已存在。")
+        cursor = conn.cursor()
+        try:
+            # 创建 products 表
+            print("正在创建 'products' 表...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS products (
+                    id VARCHAR(255) PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    description TEXT,
+                    specifications VARCHAR(255),
+                    price VARCHAR(255),
+                    activity TEXT,
+                    price_value DECIMAL(12, 2) NULL,
+                    discount_rate DECIMAL(4, 3) NULL,
+                    has_activity TINYINT(1) NULL,
+                    INDEX idx_products_price_value (price_value),
+                    INDEX idx_products_activity_price (has_activity, price_value)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+            print("表 'products' 已创建或已存在。")
+            _migrate_product_attribute_columns(cursor)
 
-        # 创建 orders 表
-        print("正在创建 'orders' 表...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                order_id VARCHAR(255) PRIMARY KEY,
-                user_id VARCHAR(255),
-                product_ids TEXT,
-                status VARCHAR(255),
-                total_amount DECIMAL(10, 2),
-                create_time DATETIME,
-                pay_time DATETIME,
-                ship_time DATETIME,
-                receive_time DATETIME,
-                logistics_info TEXT
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
-        """)
-        print("表 'orders' 已创建或已存在。")
+            # 创建 orders 表
+            print("正在创建 'orders' 表...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS orders (
+                    order_id VARCHAR(255) PRIMARY KEY,
+                    user_id VARCHAR(255),
+                    product_ids TEXT,
+                    status VARCHAR(255),
+                    total_amount DECIMAL(10, 2),
+                    create_time DATETIME,
+                    pay_time DATETIME,
+                    ship_time DATETIME,
+                    receive_time DATETIME,
+                    logistics_info TEXT,
+                    INDEX idx_orders_user_time (user_id, create_time),
+                    INDEX idx_orders_status (status, create_time)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+            print("表 'orders' 已创建或已存在。")
+            _ensure_indexes(cursor, "orders", ORDER_INDEXES)
 
-    except Error as e:
-        print(f"创建表时出错: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+            # 创建 order_items 表：订单商品的权威数据，一行一个商品，用于与 products 表连接查询；
+            # orders.product_ids 只为兼容旧流程保留，写订单时用 sync_order_items 在同一事务中同步
+            print("正在创建 'order_items' 表...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS order_items (
+                    order_id VARCHAR(255) NOT NULL,
+                    position INT NOT NULL,
+                    product_id VARCHAR(255) NOT NULL,
+                    PRIMARY KEY (order_id, position),
+                    INDEX idx_order_items_product (product_id)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+            print("表 'order_items' 已创建或已存在。")
+
+            # 记录已完成的一次性数据迁移，避免每次启动都重新扫描
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name VARCHAR(255) PRIMARY KEY,
+                    applied_at DATETIME
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+            """)
+
+        except Error as e:
+            print(f"创建表时出错: {e}")
+        finally:
+            cursor.close()
+
+    # 为旧数据（或 LOAD DATA 导入的数据）补齐价格/活动的数值列
+    backfill_product_attributes()
+    # 把旧订单的 product_ids 拆分写入 order_items（完成后记录在 schema_migrations 中，之后不再执行）
+    migrate_order_items()
+
+# 商品的结构化数值列：由 price / activity 文本解析而来，用于搜索过滤
+PRODUCT_ATTRIBUTE_COLUMNS = {
+    "price_value": "DECIMAL(12, 2) NULL",
+    "discount_rate": "DECIMAL(4, 3) NULL",
+    "has_activity": "TINYINT(1) NULL",
+}
+PRODUCT_ATTRIBUTE_INDEXES = {
+    "idx_products_price_value": "(price_value)",
+    "idx_products_activity_price": "(has_activity, price_value)",
+}
+# orders 表的二级索引："我最近的订单" 按用户取最新订单，"还没发货的订单" 按状态筛选
+ORDER_INDEXES = {
+    "idx_orders_user_time": "(user_id, create_time)",
+    "idx_orders_status": "(status, create_time)",
+}
+
+def _ensure_indexes(cursor, table, indexes):
+    """为已存在的表创建缺少的索引（MySQL 不支持 CREATE INDEX IF NOT EXISTS，先查询元数据）。"""
+    cursor.execute("""
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    existing_indexes = {row[0] for row in cursor.fetchall()}
+    for index, columns in indexes.items():
+        if index not in existing_indexes:
+            print(f"正在为 '{table}' 表创建索引 '{index}'...")
+            cursor.execute(f"CREATE INDEX {index} ON {table} {columns}")
+
+def _migrate_product_attribute_columns(cursor):
+    """为已存在的 products 表添加数值列和索引（MySQL 不支持 ADD COLUMN IF NOT EXISTS，先查询元数据）。"""
+    cursor.execute("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products'
+    """)
+    existing_columns = {row[0] for row in cursor.fetchall()}
+    for column, definition in PRODUCT_ATTRIBUTE_COLUMNS.items():
+        if column not in existing_columns:
+            print(f"正在为 'products' 表添加列 '{column}'...")
+            cursor.execute(f"ALTER TABLE products ADD COLUMN {column} {definition}")
+    _ensure_indexes(cursor, "products", PRODUCT_ATTRIBUTE_INDEXES)
+
+def backfill_product_attributes(chunk_size=1000):
+    """
+    为 has_activity 为空的商品（迁移前的旧数据、测试数据和 LOAD DATA 导入的数据）解析并写入数值列。
+    按主键分块处理，返回更新的行数；无法连接数据库时返回 None。
+    """
+    updated = 0
+    with db_connection() as conn:
+        if not conn:
+            print("无法连接到数据库，无法补齐商品数值列。")
+            return None
+        cursor = conn.cursor()
+        try:
+            last_id = ""
+            while True:
+                cursor.execute(
+                    "SELECT id, price, activity FROM products WHERE has_activity IS NULL AND id > %s ORDER BY id LIMIT %s",
+                    (last_id, chunk_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                cursor.executemany(
+                    "UPDATE products SET price_value = %s, discount_rate = %s, has_activity = %s WHERE id = %s",
+                    [derive_product_attributes(price, activity) + (product_id,) for product_id, price, activity in rows]
+                )
+                conn.commit()
+                updated += len(rows)
+                last_id = rows[-1][0]
+        except Error as e:
+            print(f"补齐商品数值列时出错: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+    if updated:
+        print(f"已为 {updated} 件商品补齐价格/活动数值列。")
+    return updated
+
+def order_item_rows(order_id, product_ids):
+    """把逗号分隔的商品ID拆成 order_items 的行 (order_id, position, product_id)，position 从0开始。"""
+    items = [product_id.strip() for product_id in str(product_ids or "").split(",")]
+    return [(order_id, position, product_id) for position, product_id in enumerate(p for p in items if p)]
+
+_ID_SEPARATORS = re.compile(r"[,，、;；\s]+")
+
+def split_ids(value):
+    """
+    把工具收到的ID参数转换为ID列表（去重，保持顺序）。
+    value 可以是单个ID、"12345,12346" 这类分隔的字符串，或ID列表；大模型有时会把列表写成字符串，去掉方括号和引号。
+    """
+    parts = value if isinstance(value, (list, tuple)) else [value]
+    ids = []
+    for part in parts:
+        if part is None:
+            continue
+        for item in _ID_SEPARATORS.split(str(part)):
+            item = item.strip("[]()\"'")
+            if item:
+                ids.append(item)
+    return list(dict.fromkeys(ids))
+
+_INSERT_ORDER_ITEMS_QUERY = "INSERT IGNORE INTO order_items (order_id, position, product_id) VALUES (%s, %s, %s)"
+ORDER_ITEMS_MIGRATION = "order_items_from_product_ids"
+
+def sync_order_items(cursor, orders):
+    """
+    按 [(order_id, product_ids)] 重写这些订单的 order_items（先删除再插入），由调用方与 orders 的写入一起提交。
+    新增或修改订单商品的流程都应调用本函数，order_items 是订单商品的权威数据。
+    """
+    orders = list(orders)
+    if not orders:
+        return
+    format_strings = ','.join(['%s'] * len(orders))
+    cursor.execute(f"DELETE FROM order_items WHERE order_id IN ({format_strings})", [order_id for order_id, _ in orders])
+    items = [item for order_id, product_ids in orders for item in order_item_rows(order_id, product_ids)]
+    if items:
+        cursor.executemany(_INSERT_ORDER_ITEMS_QUERY, items)
+
+def migrate_order_items(chunk_size=1000, force=False):
+    """
+    一次性迁移：为还没有 order_items 行、product_ids 不为空的订单拆分 product_ids 并写入 order_items。
+    按主键分块处理，完整执行后在 schema_migrations 中记录，之后的调用直接返回 0；
+    force=True 时忽略记录重新扫描（用于绕过 sync_order_items 直接写入 orders 表的旧数据）。
+    返回迁移的订单数，无法连接数据库时返回 None。
+    """
+    migrated = 0
+    with db_connection() as conn:
+        if not conn:
+            print("无法连接到数据库，无法迁移订单商品。")
+            return None
+        cursor = conn.cursor()
+        try:
+            if not force:
+                cursor.execute("SELECT 1 FROM schema_migrations WHERE name = %s", (ORDER_ITEMS_MIGRATION,))
+                if cursor.fetchone():
+                    return 0
+            last_id = ""
+            while True:
+                cursor.execute("""
+                    SELECT o.order_id, o.product_ids FROM orders o
+                    WHERE o.order_id > %s
+                      AND o.product_ids IS NOT NULL AND o.product_ids <> ''
+                      AND NOT EXISTS (SELECT 1 FROM order_items i WHERE i.order_id = o.order_id)
+                    ORDER BY o.order_id LIMIT %s
+                """, (last_id, chunk_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                items = [item for order_id, product_ids in rows for item in order_item_rows(order_id, product_ids)]
+                if items:
+                    cursor.executemany(_INSERT_ORDER_ITEMS_QUERY, items)
+                conn.commit()
+                migrated += len(rows)
+                last_id = rows[-1][0]
+            cursor.execute("INSERT IGNORE INTO schema_migrations (name, applied_at) VALUES (%s, %s)",
+                           (ORDER_ITEMS_MIGRATION, time.strftime("%Y-%m-%d %H:%M:%S")))
+            conn.commit()
+        except Error as e:
+            print(f"迁移订单商品时出错: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+    if migrated:
+        print(f"已为 {migrated} 个订单写入 order_items。")
+    return migrated
 
 # --- 数据导入 ---
 
 def insert_test_data():
     """将初始测试数据插入数据库，用于产品和订单。"""
-    conn = get_db_connection()
-    if not conn:
-        print("无法连接到数据库。正在中止测试数据插入。")
-        return
-    
-    cursor = conn.cursor()
-    try:
-        # 15条测试商品数据
-        products = [
-            ("001", "纯棉T恤", "100%纯棉材质，透气舒适，适合夏季穿着", "S/M/L/XL", "99元", "满200减30，可叠加使用"),
-            ("002", "牛仔裤", "修身版型，弹力面料，经典款式", "28/29/30/31/32（腰围）", "159元", "第二件半价"),
-            ("003", "运动鞋", "轻便透气，缓震鞋底，适合跑步健身", "39/40/41/42/43/44", "299元", "会员专享8折"),
-            ("004", "连衣裙", "雪纺材质，碎花图案，优雅大方", "S/M/L", "179元", "满300减50"),
-            ("005", "夹克外套", "防风防水面料，春秋季适用", "M/L/XL/XXL", "259元", "新品上市，暂无活动"),
-            ("006", "羊毛衫", "含羊毛成分，保暖舒适", "S/M/L/XL", "199元", "满2件减100"),
-            ("007", "休闲裤", "棉质混纺，宽松版型，日常穿着舒适", "M/L/XL", "129元", "满150减20"),
-            ("008", "卫衣", "加绒加厚，连帽设计，时尚休闲", "S/M/L/XL", "149元", "限时折扣，直降30元"),
-            ("009", "衬衫", "免烫处理，商务休闲两用", "38/39/40/41/42", "169元", "满300减60"),
-            ("010", "羽绒服", "90%白鸭绒填充，轻便保暖", "M/L/XL/XXL", "499元", "预售优惠，定金50抵100"),
-            ("011", "帆布鞋", "经典款式，舒适百搭，适合日常穿着", "35/36/37/38/39/40", "79元", "买一送一"),
-            ("012", "背包", "大容量设计，防水面料，适合通勤旅行", "均码（黑色/灰色/蓝色）", "199元", "满200减40"),
-            ("013", "帽子", "棉质材质，防晒透气，时尚简约", "均码（可调节）", "59元", "3件起9折"),
-            ("014", "围巾", "羊毛混纺，柔软保暖，多种颜色可选", "均码（红色/蓝色/灰色/黑色）", "89元", "满100减20"),
-            ("015", "手套", "加绒加厚，触屏设计，冬季必备", "M/L（黑色/棕色）", "69元", "买二送一")
-        ]
+    with db_connection() as conn:
+        if not conn:
+            print("无法连接到数据库。正在中止测试数据插入。")
+            return
+
+        cursor = conn.cursor()
+        try:
+            # 15条测试商品数据
+            products = [
+                ("001", "纯棉T恤", "100%纯棉材质，透气舒适，适合夏季穿着", "S/M/L/XL", "99元", "满200减30，可叠加使用"),
+                ("002", "牛仔裤", "修身版型，弹力面料，经典款式", "28/29/30/31/32（腰围）", "159元", "第二件半价"),
+                ("003", "运动鞋", "轻便透气，缓震鞋底，适合跑步健身", "39/40/41/42/43/44", "299元", "会员专享8折"),
+                ("004", "连衣裙", "雪纺材质，碎花图案，优雅大方", "S/M/L", "179元", "满300减50"),
+                ("005", "夹克外套", "防风防水面料，春秋季适用", "M/L/XL/XXL", "259元", "新品上市，暂无活动"),
+                ("006", "羊毛衫", "含羊毛成分，保暖舒适", "S/M/L/XL", "199元", "满2件减100"),
+                ("007", "休闲裤", "棉质混纺，宽松版型，日常穿着舒适", "M/L/XL", "129元", "满150减20"),
+                ("008", "卫衣", "加绒加厚，连帽设计，时尚休闲", "S/M/L/XL", "149元", "限时折扣，直降30元"),
+                ("009", "衬衫", "免烫处理，商务休闲两用", "38/39/40/41/42", "169元", "满300减60"),
+                ("010", "羽绒服", "90%白鸭绒填充，轻便保暖", "M/L/XL/XXL", "499元", "预售优惠，定金50抵100"),
+                ("011", "帆布鞋", "经典款式，舒适百搭，适合日常穿着", "35/36/37/38/39/40", "79元", "买一送一"),
+                ("012", "背包", "大容量设计，防水面料，适合通勤旅行", "均码（黑色/灰色/蓝色）", "199元", "满200减40"),
+                ("013", "帽子", "棉质材质，防晒透气，时尚简约", "均码（可调节）", "59元", "3件起9折"),
+                ("014", "围巾", "羊毛混纺，柔软保暖，多种颜色可选", "均码（红色/蓝色/灰色/黑色）", "89元", "满100减20"),
+                ("015", "手套", "加绒加厚，触屏设计，冬季必备", "M/L（黑色/棕色）", "69元", "买二送一")
+            ]
         
-        product_query = "INSERT IGNORE INTO products (id, name, description, specifications, price, activity) VALUES (%s, %s, %s, %s, %s, %s)"
-        cursor.executemany(product_query, products)
-        print(f"插入了 {cursor.rowcount} 条测试商品数据。")
-
-        # 10条测试订单数据
-        test_orders = [
-            ("12345", "user001", "001,003", "已签收", 398.0, "2023-10-01 09:30:00", "2023-10-01 10:15:00", "2023-10-02 14:20:00", "2023-10-04 16:45:00", "圆通快递: YT1234567890"),
-            ("12346", "user002", "002", "已发货", 159.0, "2023-10-02 11:20:00", "2023-10-02 11:30:00", "2023-10-03 08:10:00", None, "中通快递: ZT0987654321"),
-            ("12347", "user003", "004,006", "已付款", 378.0, "2023-10-02 15:40:00", "2023-10-02 16:05:00", None, None, None),
-            ("12348", "user004", "005", "待付款", 259.0, "2023-10-03 09:10:00", None, None, None, None),
-            ("12349", "user005", "007,008,009", "已签收", 447.0, "2023-10-03 14:30:00", "2023-10-03 15:00:00", "2023-10-04 09:20:00", "2023-10-06 11:30:00", "顺丰速运: SF1122334455"),
-            ("12350", "user006", "010", "已取消", 499.0, "2023-10-04 10:20:00", None, None, None, None),
-            ("12351", "user007", "001,008", "已发货", 248.0, "2023-10-04 16:50:00", "2023-10-04 17:10:00", "2023-10-05 10:30:00", None, "韵达快递: YD5566778899"),
-            ("12352", "user008", "003,005", "已付款", 558.0, "2023-10-05 08:40:00", "2023-10-05 09:05:00", None, None, None),
-            ("12353", "user009", "006,007", "已签收", 328.0, "2023-10-05 13:20:00", "2023-10-05 14:00:00", "2023-10-06 09:15:00", "2023-10-08 15:20:00", "圆通快递: YT9876543210"),
-            ("12354", "user010", "002,009", "待付款", 328.0, "2023-10-06 11:10:00", None, None, None, None)
-        ]
+            product_query = ("INSERT IGNORE INTO products (id, name, description, specifications, price, activity, "
+                             "price_value, discount_rate, has_activity) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)")
+            cursor.executemany(product_query, [_upsert_params(p) for p in products])
+            print(f"插入了 {cursor.rowcount} 条测试商品数据。")
+
+            # 10条测试订单数据
+            test_orders = [
+                ("12345", "user001", "001,003", "已签收", 398.0, "2023-10-01 09:30:00", "2023-10-01 10:15:00", "2023-10-02 14:20:00", "2023-10-04 16:45:00", "圆通快递: YT1234567890"),
+                ("12346", "user002", "002", "已发货", 159.0, "2023-10-02 11:20:00", "2023-10-02 11:30:00", "2023-10-03 08:10:00", None, "中通快递: ZT0987654321"),
+                ("12347", "user003", "004,006", "已付款", 378.0, "2023-10-02 15:40:00", "2023-10-02 16:05:00", None, None, None),
+                ("12348", "user004", "005", "待付款", 259.0, "2023-10-03 09:10:00", None, None, None, None),
+                ("12349", "user005", "007,008,009", "已签收", 447.0, "2023-10-03 14:30:00", "2023-10-03 15:00:00", "2023-10-04 09:20:00", "2023-10-06 11:30:00", "顺丰速运: SF1122334455"),
+                ("12350", "user006", "010", "已取消", 499.0, "2023-10-04 10:20:00", None, None, None, None),
+                ("12351", "user007", "001,008", "已发货", 248.0, "2023-10-04 16:50:00", "2023-10-04 17:10:00", "2023-10-05 10:30:00", None, "韵达快递: YD5566778899"),
+                ("12352", "user008", "003,005", "已付款", 558.0, "2023-10-05 08:40:00", "2023-10-05 09:05:00", None, None, None),
+                ("12353", "user009", "006,007", "已签收", 328.0, "2023-10-05 13:20:00", "2023-10-05 14:00:00", "2023-10-06 09:15:00", "2023-10-08 15:20:00", "圆通快递: YT9876543210"),
+                ("12354", "user010", "002,009", "待付款", 328.0, "2023-10-06 11:10:00", None, None, None, None)
+            ]
         
-        order_query = "INSERT IGNORE INTO orders (order_id, user_id, product_ids, status, total_amount, create_time, pay_time, ship_time, receive_time, logistics_info) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        cursor.executemany(order_query, test_orders)
-        print(f"插入了 {cursor.rowcount} 条测试订单数据。")
+            order_query = "INSERT IGNORE INTO orders (order_id, user_id, product_ids, status, total_amount, create_time, pay_time, ship_time, receive_time, logistics_info) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+            cursor.executemany(order_query, test_orders)
+            print(f"插入了 {cursor.rowcount} 条测试订单数据。")
+            cursor.executemany(_INSERT_ORDER_ITEMS_QUERY,
+                               [item for order in test_orders for item in order_item_rows(order[0], order[2])])
         
-        conn.commit()
+            conn.commit()
+
+        except Error as e:
+            print(f"插入测试数据时出错: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+
+PRODUCT_COLUMNS = ['id', 'name', 'description', 'specifications', 'price', 'activity']
+
+def _find_changed_products(cursor, products, chunk_size=1000):
+    """与数据库中的现有数据比较，返回新增或内容有变化的商品ID（保持输入顺序）。"""
+    existing = {}
+    ids = [p[0] for p in products]
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        format_strings = ','.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM products WHERE id IN ({format_strings})", chunk)
+        for row in cursor.fetchall():
+            existing[row[0]] = tuple('' if v is None else str(v) for v in row)
+
+    changed = []
+    for product in products:
+        normalized = tuple('' if v is None else str(v) for v in product)
+        if existing.get(product[0]) != normalized:
+            changed.append(product[0])
+    return changed
+
+# 各列在数据库中的最大长度，超长的行会被拒绝而不是让整批失败
+_PRODUCT_COLUMN_LIMITS = {'id': 255, 'name': 255, 'specifications': 255, 'price': 255}
+
+_UPSERT_PRODUCTS_QUERY = """
+    INSERT INTO products (id, name, description, specifications, price, activity, price_value, discount_rate, has_activity) 
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) 
+    ON DUPLICATE KEY UPDATE 
+        name=VALUES(name), 
+        description=VALUES(description), 
+        specifications=VALUES(specifications), 
+        price=VALUES(price), 
+        activity=VALUES(activity),
+        price_value=VALUES(price_value),
+        discount_rate=VALUES(discount_rate),
+        has_activity=VALUES(has_activity)
+"""
 
+def _upsert_params(values):
+    """PRODUCT_COLUMNS 顺序的商品行，加上由价格和活动文本解析出的数值列。"""
+    return tuple(values) + derive_product_attributes(values[4], values[5])
+
+def iter_csv_products(file_path, start_row=0):
+    """
+    逐行读取商品CSV，产出 (行号, 行字典)。行号从1开始计数（不含标题行）。
+    start_row 之前（含）的行会被跳过，用于断点续传。
+    """
+    with open(file_path, mode='r', encoding='utf-8', newline='') as csv_file:
+        csv_reader = csv.DictReader(csv_file)
+        for row_number, row in enumerate(csv_reader, 1):
+            if row_number <= start_row:
+                continue
+            yield row_number, row
+
+def validate_product_row(row):
+    """校验一行商品数据，返回 (插入用元组, None) 或 (None, 拒绝原因)。"""
+    values = []
+    for col in PRODUCT_COLUMNS:
+        value = row.get(col)
+        if value is not None:
+            value = value.strip()
+        if col in ('id', 'name') and not value:
+            return None, f"缺少必填列 '{col}'"
+        limit = _PRODUCT_COLUMN_LIMITS.get(col)
+        if limit and value and len(value) > limit:
+            return None, f"列 '{col}' 超过 {limit} 个字符"
+        values.append(value)
+    if None in row:
+        return None, "列数多于标题行"
+    return tuple(values), None
+
+
+class _RejectWriter:
+    """把被拒绝的行写入旁路CSV文件（首次写入时才创建文件）。"""
+
+    def __init__(self, path, append):
+        self.path = path
+        self.append = append
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, row_number, row, reason):
+        if self._writer is None:
+            exists = self.append and os.path.exists(self.path)
+            self._file = open(self.path, mode='a' if exists else 'w', encoding='utf-8', newline='')
+            self._writer = csv.writer(self._file)
+            if not exists:
+                self._writer.writerow(['row_number', 'reason'] + PRODUCT_COLUMNS)
+        self._writer.writerow([row_number, reason] + [row.get(col) for col in PRODUCT_COLUMNS])
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _checkpoint_path(file_path):
+    return file_path + '.checkpoint'
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def _load_checkpoint(file_path):
+    """读取断点文件，源文件已变化时忽略断点，返回已提交的行号。"""
+    path = _checkpoint_path(file_path)
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("file") != _file_signature(file_path):
+        print(f"警告: {file_path} 在上次导入后已被修改，忽略断点并从头导入。")
+        return 0
+    return checkpoint.get("rows_committed", 0)
+
+def _save_checkpoint(file_path, rows_committed):
+    path = _checkpoint_path(file_path)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({"file": _file_signature(file_path), "rows_committed": rows_committed}, f)
+    os.replace(path + '.tmp', path)
+
+def _write_product_batch(conn, cursor, batch, rejects):
+    """
+    写入并提交一批商品，返回新增或有变化的商品ID。
+    整批写入失败时逐行重试，把出错的行连同数据库错误写入拒绝文件，其余行照常提交。
+    """
+    rows = [values for _, _, values in batch]
+    try:
+        changed_ids = _find_changed_products(cursor, rows)
+        cursor.executemany(_UPSERT_PRODUCTS_QUERY, [_upsert_params(values) for values in rows])
+        conn.commit()
+        return changed_ids
     except Error as e:
-        print(f"插入测试数据时出错: {e}")
         conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+        print(f"批量写入失败 ({e})，正在逐行重试以定位出错的行...")
 
-def batch_insert_products_from_csv(file_path):
+    changed_ids = []
+    for row_number, row, values in batch:
+        try:
+            changed = _find_changed_products(cursor, [values])
+            cursor.execute(_UPSERT_PRODUCTS_QUERY, _upsert_params(values))
+            changed_ids.extend(changed)
+        except Error as e:
+            rejects.write(row_number, row, f"数据库错误: {e}")
+    conn.commit()
+    return changed_ids
+
+def batch_insert_products_from_csv(file_path, batch_size=None, resume=False, rejects_path=None,
+                                   on_batch_committed=None):
     """
-    从CSV文件读取商品数据并将其插入到 'products' 表中。
+    以流式、分批提交的方式从CSV文件导入商品到 'products' 表中。
     CSV文件应包含与表列匹配的标题行:
     id,name,description,specifications,price,activity
+
+    - 每 batch_size 行提交一次，内存占用与文件大小无关；
+    - 校验失败或写入出错的行写入 rejects_path（默认 <文件名>.rejects.csv），不影响其他行；
+    - 每次提交后记录断点（<文件名>.checkpoint），resume=True 时从上次提交的位置继续；
+    - 每批提交后以该批新增或有变化的商品ID调用 on_batch_committed(changed_ids)。
+
+    返回导入统计字典；无法连接数据库或文件不存在时返回 None。
+    """
+    batch_size = batch_size or config.CSV_IMPORT_BATCH_SIZE
+    rejects_path = rejects_path or file_path + '.rejects.csv'
+    if not os.path.exists(file_path):
+        print(f"错误: 未找到文件 {file_path}。")
+        return None
+    start_row = _load_checkpoint(file_path) if resume else 0
+    if start_row:
+        print(f"从断点继续导入: 跳过已提交的前 {start_row} 行。")
+
+    stats = {"rows": 0, "written": 0, "rejected": 0, "changed": 0, "batches": 0,
+             "resumed_from": start_row, "elapsed_seconds": 0.0, "rows_per_second": 0.0}
+    rejects = _RejectWriter(rejects_path, append=bool(start_row))
+    started = time.monotonic()
+
+    with db_connection() as conn:
+        if not conn:
+            print("无法连接到数据库。正在中止CSV导入。")
+            return None
+
+        cursor = conn.cursor()
+        batch = []
+        last_row = start_row
+
+        def flush():
+            changed_ids = _write_product_batch(conn, cursor, batch, rejects)
+            _save_checkpoint(file_path, last_row)
+            stats["batches"] += 1
+            stats["changed"] += len(changed_ids)
+            if changed_ids and on_batch_committed:
+                on_batch_committed(changed_ids)
+            batch.clear()
+            elapsed = time.monotonic() - started
+            print(f"已提交第 {stats['batches']} 批: 累计处理 {stats['rows']} 行，拒绝 {rejects.count} 行，"
+                  f"{stats['rows'] / elapsed if elapsed else 0:.0f} 行/秒")
+
+        try:
+            for row_number, row in iter_csv_products(file_path, start_row):
+                stats["rows"] += 1
+                last_row = row_number
+                values, reason = validate_product_row(row)
+                if reason:
+                    rejects.write(row_number, row, reason)
+                    continue
+                batch.append((row_number, row, values))
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+            # 全部完成后删除断点，下次导入从头开始
+            if os.path.exists(_checkpoint_path(file_path)):
+                os.remove(_checkpoint_path(file_path))
+        except Error as e:
+            print(f"CSV导入期间数据库错误: {e}。已提交的批次会保留，可使用断点续传继续导入。")
+            conn.rollback()
+        except Exception as e:
+            print(f"发生意外错误: {e}。已提交的批次会保留，可使用断点续传继续导入。")
+        finally:
+            cursor.close()
+            rejects.close()
+
+    stats["rejected"] = rejects.count
+    stats["written"] = stats["rows"] - stats["rejected"]
+    stats["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    stats["rows_per_second"] = round(stats["rows"] / stats["elapsed_seconds"], 1) if stats["elapsed_seconds"] else 0.0
+    print(f"从 {file_path} 导入完成: 处理 {stats['rows']} 行，写入 {stats['written']} 行，"
+          f"拒绝 {stats['rejected']} 行，其中 {stats['changed']} 件商品为新增或有变化，"
+          f"耗时 {stats['elapsed_seconds']}s ({stats['rows_per_second']} 行/秒)。")
+    if stats["rejected"]:
+        print(f"被拒绝的行已写入: {rejects_path}")
+    return stats
+
+def load_products_with_load_data(file_path, on_batch_committed=None, chunk_size=None):
+    """
+    使用 LOAD DATA LOCAL INFILE 批量导入商品，适合超大文件的全量导入。
+    数据先装入临时表，再在服务器端校验、计算变更并合并到 'products' 表。
+    该模式需要MySQL服务器开启 local_infile，不支持断点续传，被拒绝的行同样写入 <文件名>.rejects.csv。
+
+    返回导入统计字典；失败时返回 None。
     """
-    conn = get_db_connection()
+    chunk_size = chunk_size or config.CSV_IMPORT_BATCH_SIZE
+    if not os.path.exists(file_path):
+        print(f"错误: 未找到文件 {file_path}。")
+        return None
+    with open(file_path, mode='r', encoding='utf-8', newline='') as csv_file:
+        header = next(csv.reader(csv_file), [])
+        csv_file.seek(0)
+        first_line = csv_file.readline()
+    line_terminator = '\\r\\n' if first_line.endswith('\r\n') else '\\n'
+    # 未知的列读入用户变量后丢弃
+    load_columns = ', '.join(col if col in PRODUCT_COLUMNS else '@skip' for col in header)
+
+    conn = get_db_connection(allow_local_infile=True)
     if not conn:
         print("无法连接到数据库。正在中止CSV导入。")
-        return
-        
+        return None
+
+    started = time.monotonic()
+    stats = {"rows": 0, "written": 0, "rejected": 0, "changed": 0}
+    columns = ', '.join(PRODUCT_COLUMNS)
     cursor = conn.cursor()
     try:
-        with open(file_path, mode='r', encoding='utf-8') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            products_to_insert = []
-            for row in csv_reader:
-                products_to_insert.append(tuple(row.get(col) for col in ['id', 'name', 'description', 'specifications', 'price', 'activity']))
-
-            if products_to_insert:
-                # 使用 ON DUPLICATE KEY UPDATE 来插入或更新数据
-                query = """
-                    INSERT INTO products (id, name, description, specifications, price, activity) 
-                    VALUES (%s, %s, %s, %s, %s, %s) 
-                    ON DUPLICATE KEY UPDATE 
-                        name=VALUES(name), 
-                        description=VALUES(description), 
-                        specifications=VALUES(specifications), 
-                        price=VALUES(price), 
-                        activity=VALUES(activity)
-                """
-                cursor.executemany(query, products_to_insert)
-                conn.commit()
-                print(f"成功从 {file_path} 插入/更新了 {cursor.rowcount} 件商品。")
+        cursor.execute("""
+            CREATE TEMPORARY TABLE products_staging (
+                id VARCHAR(255), name VARCHAR(255), description TEXT,
+                specifications VARCHAR(255), price VARCHAR(255), activity TEXT
+            ) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """)
+        cursor.execute(f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE products_staging
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+            LINES TERMINATED BY '{line_terminator}'
+            IGNORE 1 LINES ({load_columns})
+        """, (os.path.abspath(file_path),))
+        stats["rows"] = cursor.rowcount
+        print(f"已装入临时表 {stats['rows']} 行，耗时 {time.monotonic() - started:.1f}s。")
 
-    except FileNotFoundError:
-        print(f"错误: 未找到文件 {file_path}。")
+        # 1. 拒绝缺少必填列的行
+        reject_condition = "id IS NULL OR id = '' OR name IS NULL OR name = ''"
+        cursor.execute(f"SELECT {columns} FROM products_staging WHERE {reject_condition}")
+        rejects = _RejectWriter(file_path + '.rejects.csv', append=False)
+        try:
+            for row in cursor.fetchall():
+                rejects.write('', dict(zip(PRODUCT_COLUMNS, row)), "缺少必填列 'id' 或 'name'")
+        finally:
+            rejects.close()
+        stats["rejected"] = rejects.count
+        cursor.execute(f"DELETE FROM products_staging WHERE {reject_condition}")
+
+        # 2. 在服务器端计算新增或有变化的商品
+        unchanged = ' AND '.join(f"p.{col} <=> s.{col}" for col in PRODUCT_COLUMNS[1:])
+        cursor.execute(f"""
+            SELECT DISTINCT s.id FROM products_staging s
+            LEFT JOIN products p ON p.id = s.id
+            WHERE p.id IS NULL OR NOT ({unchanged})
+        """)
+        changed_ids = [row[0] for row in cursor.fetchall()]
+
+        # 3. 合并到正式表
+        cursor.execute(f"""
+            INSERT INTO products ({columns})
+            SELECT {columns} FROM products_staging
+            ON DUPLICATE KEY UPDATE
+                name=VALUES(name),
+                description=VALUES(description),
+                specifications=VALUES(specifications),
+                price=VALUES(price),
+                activity=VALUES(activity),
+                price_value=NULL,
+                discount_rate=NULL,
+                has_activity=NULL
+        """)
+        conn.commit()
+        stats["written"] = stats["rows"] - stats["rejected"]
+        stats["changed"] = len(changed_ids)
+        if on_batch_committed:
+            for start in range(0, len(changed_ids), chunk_size):
+                on_batch_committed(changed_ids[start:start + chunk_size])
     except Error as e:
-        print(f"CSV导入期间数据库错误: {e}")
+        print(f"LOAD DATA 导入期间数据库错误: {e}")
+        if "local" in str(e).lower():
+            print("提醒: 请确认MySQL服务器已开启 local_infile。")
         conn.rollback()
-    except Exception as e:
-        print(f"发生意外错误: {e}")
+        return None
     finally:
         cursor.close()
         conn.close()
 
+    # 价格/活动文本的解析在 Python 中完成，合并时置空的数值列在此补齐
+    backfill_product_attributes(chunk_size)
+    stats["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    stats["rows_per_second"] = round(stats["rows"] / stats["elapsed_seconds"], 1) if stats["elapsed_seconds"] else 0.0
+    print(f"从 {file_path} 批量装载完成: 处理 {stats['rows']} 行，写入 {stats['written']} 行，"
+          f"拒绝 {stats['rejected']} 行，其中 {stats['changed']} 件商品为新增或有变化，"
+          f"耗时 {stats['elapsed_seconds']}s ({stats['rows_per_second']} 行/秒)。")
+    return stats
+
 if __name__ == '__main__':
     print("正在初始化MySQL数据库...")
     init_database()
@@ -198,20 +870,94 @@ if __name__ == '__main__':
     # batch_insert_products_from_csv('path/to/your/products.csv')
 
 def get_all_products_for_vectorization():
-    """获取所有商品的核心信息用于向量化。"""
-    conn = get_db_connection()
-    if not conn:
-        print("无法连接到数据库，无法获取商品列表。")
+    """获取所有商品的核心信息用于向量化和关键词索引。"""
+    with db_connection() as conn:
+        if not conn:
+            print("无法连接到数据库，无法获取商品列表。")
+            return []
+
+        try:
+            with conn.cursor(dictionary=True) as cursor:
+                cursor.execute("SELECT id, name, description, specifications FROM products")
+                return cursor.fetchall()
+        except Error as e:
+            print(f"获取所有商品时出错: {e}")
+            return []
+
+def get_products_for_vectorization(product_ids):
+    """
+    按商品ID获取商品的核心信息，用于向量索引和关键词索引的增量更新。
+    不存在的ID不会出现在结果中；无法查询时返回 None，以免被误当作商品已删除。
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
         return []
-    
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, name, description FROM products")
-        products = cursor.fetchall()
-        return products
-    except Error as e:
-        print(f"获取所有商品时出错: {e}")
+    with db_connection() as conn:
+        if not conn:
+            print("无法连接到数据库，无法获取商品列表。")
+            return None
+
+        try:
+            with conn.cursor(dictionary=True) as cursor:
+                format_strings = ','.join(['%s'] * len(product_ids))
+                cursor.execute(f"SELECT id, name, description, specifications FROM products WHERE id IN ({format_strings})", product_ids)
+                return cursor.fetchall()
+        except Error as e:
+            print(f"获取商品时出错: {e}")
+            return None
+
+def fetch_products_by_ids(product_ids):
+    """
+    一次查询获取多个商品的完整信息，返回 {商品ID: 行字典}，不存在的ID不会出现在结果中。
+    无法连接数据库时返回 None，查询出错时抛出异常。
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return {}
+    with db_connection() as conn:
+        if not conn:
+            return None
+        with conn.cursor(dictionary=True) as cursor:
+            format_strings = ','.join(['%s'] * len(product_ids))
+            cursor.execute(f"SELECT * FROM products WHERE id IN ({format_strings})", product_ids)
+            return {row['id']: row for row in cursor.fetchall()}
+
+def select_product_ids(filters, limit):
+    """
+    返回满足过滤条件的商品ID（最多 limit 个），条件由 SearchFilters.to_sql 生成，走数值列上的索引。
+    无法查询时返回 None。
+    """
+    where, params = filters.to_sql()
+    with db_connection() as conn:
+        if not conn:
+            return None
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT id FROM products WHERE {where} LIMIT %s", params + [int(limit)])
+                return [row[0] for row in cursor.fetchall()]
+        except Error as e:
+            print(f"按条件筛选商品时出错: {e}")
+            return None
+
+def filter_product_ids(product_ids, filters):
+    """
+    从候选商品ID中保留满足过滤条件的部分，保持输入顺序。
+    无法查询时返回 None。
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
         return []
-    finally:
-        if conn.is_connected():
-            conn.close()
\ No newline at end of file
+    where, params = filters.to_sql()
+    with db_connection() as conn:
+        if not conn:
+            return None
+        try:
+            with conn.cursor() as cursor:
+                format_strings = ','.join(['%s'] * len(product_ids))
+                cursor.execute(f"SELECT id FROM products WHERE id IN ({format_strings}) AND {where}",
+                               product_ids + params)
+                matched = {row[0] for row in cursor.fetchall()}
+        except Error as e:
+            print(f"按条件筛选商品时出错: {e}")
+            return None
+    return [product_id for product_id in product_ids if product_id in matched]
@@ -0,0 +1,130 @@
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# --- 商品价格与活动的结构化字段 ---
+# products.price / activity 是 "1499元"、"新品上市9折" 这样的文本，无法在 SQL 中比较或建索引。
+# 导入时解析出数值列（price_value、discount_rate、has_activity），商品搜索的过滤条件直接下推到这些列上。
+
+PRICE_PATTERN = re.compile(r"(\d+(?:,\d{3})*(?:\.\d+)?)")
+DISCOUNT_PATTERN = re.compile(r"(\d+(?:\.\d+)?|[一二三四五六七八九]{1,2})\s*折")
+CHINESE_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+# 表示没有活动的文本
+NO_ACTIVITY_PATTERN = re.compile(r"^\s*(无|暂无|没有|none|null|-)?\s*$|暂无活动|无活动", re.IGNORECASE)
+
+
+def parse_price(text):
+    """从价格文本中取第一个数字，如 "1499元"、"¥1,499.00"；无法解析时返回 None。"""
+    if text is None:
+        return None
+    match = PRICE_PATTERN.search(str(text))
+    if not match:
+        return None
+    return round(float(match.group(1).replace(",", "")), 2)
+
+
+def parse_discount_rate(activity):
+    """
+    从活动文本中解析折扣率（实付比例），如 "9折" -> 0.9、"8.5折" -> 0.85、"八折" -> 0.8、"八五折" -> 0.85；
+    没有折扣（包括满减、赠品等其他活动，以及表示原价的 "10折"）时返回 None。
+    """
+    if not activity:
+        return None
+    match = DISCOUNT_PATTERN.search(str(activity))
+    if not match:
+        return None
+    value = match.group(1)
+    if value[0] in CHINESE_DIGITS:
+        value = int("".join(str(CHINESE_DIGITS[c]) for c in value))
+    else:
+        value = float(value)
+    if value == 10:
+        # "10折" 即原价，不是折扣
+        return None
+    # "9折" 表示 0.9，"95折" 表示 0.95
+    rate = value / 10 if value < 10 else value / 100
+    return round(rate, 3) if 0 < rate < 1 else None
+
+
+def has_activity(activity):
+    return not NO_ACTIVITY_PATTERN.search(str(activity or ""))
+
+
+def derive_product_attributes(price, activity):
+    """返回写入数值列的 (price_value, discount_rate, has_activity)。"""
+    return parse_price(price), parse_discount_rate(activity), 1 if has_activity(activity) else 0
+
+
+class SearchFilters:
+    """
+    商品搜索的结构化过滤条件，全部可选：
+    min_price / max_price（元，含边界）、has_activity（True 只要有活动的商品）、spec_keyword（规格包含的关键词）。
+    无法解析的价格（如模型传入的 "五百"）记录警告后忽略该条件，字段名记在 ignored 中。
+    """
+
+    def __init__(self, min_price=None, max_price=None, has_activity=None, spec_keyword=None):
+        self.ignored = []
+        self.min_price = self._price_bound("min_price", min_price)
+        self.max_price = self._price_bound("max_price", max_price)
+        if isinstance(has_activity, str):
+            has_activity = has_activity.strip().lower() in ("true", "1", "yes", "是") if has_activity.strip() else None
+        self.has_activity = bool(has_activity) if has_activity is not None else None
+        spec_keyword = str(spec_keyword).strip() if spec_keyword is not None else ""
+        self.spec_keyword = spec_keyword or None
+
+    def _price_bound(self, name, value):
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return None
+        try:
+            price = float(value)
+        except (TypeError, ValueError):
+            price = None
+        if price is None or not math.isfinite(price):
+            logger.warning(f"忽略无法解析的价格条件 {name}={value!r}")
+            self.ignored.append(name)
+            return None
+        return price
+
+    def __bool__(self):
+        return any(v is not None for v in (self.min_price, self.max_price, self.has_activity, self.spec_keyword))
+
+    def to_sql(self):
+        """返回 (WHERE 条件, 参数列表)，条件中的列都是 products 表的列。"""
+        conditions, params = [], []
+        if self.min_price is not None:
+            conditions.append("price_value >= %s")
+            params.append(self.min_price)
+        if self.max_price is not None:
+            conditions.append("price_value <= %s")
+            params.append(self.max_price)
+        if self.has_activity is not None:
+            conditions.append("has_activity = %s")
+            params.append(1 if self.has_activity else 0)
+        if self.spec_keyword:
+            conditions.append("specifications LIKE %s")
+            params.append("%" + self.spec_keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        return " AND ".join(conditions) or "1=1", params
+
+    def cache_key(self):
+        """用于搜索结果缓存键的规范化表示，没有过滤条件时为空字符串。"""
+        if not self:
+            return ""
+        return (f"|price={self.min_price}~{self.max_price}"
+                f"|activity={self.has_activity}|spec={(self.spec_keyword or '').lower()}")
+
+    def describe(self):
+        """面向用户的条件说明，如 "价格 ≤ 500元，有活动"。"""
+        parts = []
+        if self.min_price is not None and self.max_price is not None:
+            parts.append(f"价格 {self.min_price:g}~{self.max_price:g}元")
+        elif self.min_price is not None:
+            parts.append(f"价格 ≥ {self.min_price:g}元")
+        elif self.max_price is not None:
+            parts.append(f"价格 ≤ {self.max_price:g}元")
+        if self.has_activity is not None:
+            parts.append("有活动" if self.has_activity else "无活动")
+        if self.spec_keyword:
+            parts.append(f"规格包含 '{self.spec_keyword}'")
+        return "，".join(parts)
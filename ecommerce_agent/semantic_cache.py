@@ -0,0 +1,142 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from ecommerce_agent import config
+
+logger = logging.getLogger(__name__)
+
+# 与订单/用户本人相关的问题，答案因人而异，不能复用
+PERSONAL_PATTERN = re.compile(r"订单|物流|快递|发货|退款|退货|售后|我的|我买|我下单|\d{5,}")
+# 指代上文的问题，答案取决于对话历史，不能复用
+ANAPHORA_PATTERN = re.compile(r"这个|那个|这款|那款|这些|那些|它|上面|刚才|之前|前面|第[一二三四五六七八九十\d]+个")
+
+
+def is_cacheable(question):
+    """只缓存与用户和上下文无关、且不太长的问题。"""
+    if not isinstance(question, str) or not question.strip() or len(question) > 200:
+        return False
+    return not (PERSONAL_PATTERN.search(question) or ANAPHORA_PATTERN.search(question))
+
+
+class SemanticCache:
+    """
+    按问题语义复用 Agent 的回答："有什么适合冬天的衣服" 与 "冬天穿什么好" 这类改写可以命中同一条缓存。
+    问题向量归一化后存放在 IndexIDMap2(IndexFlatIP) 中，内积即余弦相似度，超过 threshold 视为命中。
+    - 条目超过 ttl 秒过期，超过 max_entries 时按 LRU 淘汰；
+    - 目录版本变化（商品导入/更新）时清空，避免返回过时的价格和活动；
+    - 只在进程内缓存，索引规模很小，精确检索的开销远小于一次大模型调用。
+    """
+
+    def __init__(self, threshold, ttl, max_entries):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()  # faiss id -> (问题, 回答, 过期时间)
+        self._next_id = 0
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _check_version(self, catalog_version):
+        """目录版本变化时清空缓存，调用方需持有锁。"""
+        if catalog_version != self._version:
+            if self._entries:
+                self.invalidations += 1
+                logger.info(f"目录版本变为 {catalog_version}，清空 {len(self._entries)} 条语义缓存。")
+            self._index = None
+            self._entries.clear()
+            self._version = catalog_version
+
+    def _remove(self, ids):
+        for entry_id in ids:
+            self._entries.pop(entry_id, None)
+        if self._index is not None and ids:
+            self._index.remove_ids(np.asarray(ids, dtype="int64"))
+
+    def lookup(self, vector, catalog_version):
+        """返回 (回答, 相似度)，未命中时回答为 None。"""
+        query = self._normalize(vector)
+        with self._lock:
+            self._check_version(catalog_version)
+            if self._index is None or self._index.ntotal == 0:
+                self.misses += 1
+                return None, None
+            scores, ids = self._index.search(query, 1)
+            score, entry_id = float(scores[0][0]), int(ids[0][0])
+            entry = self._entries.get(entry_id)
+            if entry is None or score < self.threshold:
+                self.misses += 1
+                return None, score if entry is not None else None
+            question, answer, expires_at = entry
+            if expires_at and expires_at <= time.monotonic():
+                self._remove([entry_id])
+                self.misses += 1
+                return None, score
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+        logger.info(f"语义缓存命中（相似度 {score:.4f}），复用问题 '{question}' 的回答。")
+        return answer, score
+
+    def store(self, vector, question, answer, catalog_version):
+        vector = self._normalize(vector)
+        expires_at = time.monotonic() + self.ttl if self.ttl and self.ttl > 0 else None
+        with self._lock:
+            if catalog_version != self._version:
+                # 回答生成期间目录已更新（lookup 时已切换到新版本），不缓存可能过时的回答
+                return
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype="int64"))
+            self._entries[entry_id] = (question, answer, expires_at)
+            if len(self._entries) > self.max_entries:
+                self._remove(list(self._entries)[:len(self._entries) - self.max_entries])
+
+    def skip(self):
+        """记录一次因问题不可缓存而跳过的查询。"""
+        with self._lock:
+            self.skipped += 1
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "skipped": self.skipped,
+                "invalidations": self.invalidations,
+            }
+
+
+def create_semantic_cache():
+    """按 SEMANTIC_CACHE_* 配置创建语义缓存，未启用时返回 None。"""
+    if not config.SEMANTIC_CACHE_ENABLED:
+        return None
+    return SemanticCache(config.SEMANTIC_CACHE_THRESHOLD, config.SEMANTIC_CACHE_TTL,
+                         config.SEMANTIC_CACHE_MAX_ENTRIES)
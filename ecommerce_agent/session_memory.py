@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import threading
+import weakref
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from ecommerce_agent import config
+from ecommerce_agent.cache import create_backend
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    按会话保存对话历史，替代全局共享的 ConversationBufferWindowMemory。
+    - 历史以 [[问题, 回答], ...] 的形式存放在缓存后端中：默认进程内 LRU/TTL，配置 Redis 时可跨进程、跨重启保留；
+    - 每个会话最多保留 max_turns 轮、max_chars 个字符，超出时丢弃最早的轮次；
+    - 会话数由 max_entries 限制，闲置超过 ttl 秒的会话过期。
+    同一会话的请求通过该会话自己的锁串行执行，保证轮次顺序；不同会话之间互不阻塞。
+    """
+
+    def __init__(self, backend, max_turns, max_chars):
+        self.backend = backend
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        # 每个会话一把锁，以弱引用保存：没有请求持有或等待时自动释放，内存占用只与正在处理的会话数有关
+        self._locks = weakref.WeakValueDictionary()
+        self._async_locks = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+
+    @staticmethod
+    def _key(session_id):
+        return f"session:{session_id}"
+
+    def _session_lock(self, locks, session_id, factory):
+        with self._locks_guard:
+            lock = locks.get(session_id)
+            if lock is None:
+                lock = factory()
+                locks[session_id] = lock
+            return lock
+
+    def lock(self, session_id):
+        """返回该会话专用的锁；调用方在使用期间持有引用，同一会话的并发请求拿到的是同一把锁。"""
+        return self._session_lock(self._locks, session_id, threading.Lock)
+
+    def async_lock(self, session_id):
+        """异步服务模式下该会话专用的 asyncio 锁，等待时不阻塞事件循环。"""
+        return self._session_lock(self._async_locks, session_id, asyncio.Lock)
+
+    def get_turns(self, session_id):
+        try:
+            return self.backend.get(self._key(session_id)) or []
+        except Exception as e:
+            logger.warning(f"读取会话 '{session_id}' 的历史失败: {e}")
+            return []
+
+    def get_messages(self, session_id):
+        """以 LangChain 消息列表的形式返回会话历史，作为 chat_history 传给 Agent。"""
+        messages = []
+        for question, answer in self.get_turns(session_id):
+            messages.append(HumanMessage(content=question))
+            messages.append(AIMessage(content=answer))
+        return messages
+
+    def append(self, session_id, question, answer):
+        """追加一轮对话并按轮数和字符数裁剪；写入的是新列表，不修改已缓存的对象。"""
+        turns = self.get_turns(session_id) + [[question, answer]]
+        turns = turns[-self.max_turns:] if self.max_turns > 0 else []
+        total = sum(len(q) + len(a) for q, a in turns)
+        while len(turns) > 1 and total > self.max_chars:
+            q, a = turns.pop(0)
+            total -= len(q) + len(a)
+        try:
+            self.backend.set(self._key(session_id), turns)
+        except Exception as e:
+            logger.warning(f"保存会话 '{session_id}' 的历史失败: {e}")
+
+    def clear(self, session_id):
+        self.backend.delete(self._key(session_id))
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats["shared_backend"] = self.backend.shared
+        return stats
+
+
+def create_session_store():
+    """按 SESSION_* 配置创建会话存储；SESSION_BACKEND 为空时与 CACHE_BACKEND 相同。"""
+    backend = create_backend(config.SESSION_MAX_ENTRIES, config.SESSION_TTL,
+                             url=config.SESSION_BACKEND or None)
+    return SessionStore(backend, config.SESSION_MAX_TURNS, config.SESSION_MAX_CHARS)
@@ -0,0 +1,68 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 组件状态
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class StartupTracker:
+    """
+    记录分阶段启动中每个组件的状态和加载耗时，供 /health 报告存活与就绪情况。
+    组件加载函数返回 None 或 False、或者抛出异常时视为加载失败。
+    """
+
+    def __init__(self, components=()):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._components = {name: {"status": PENDING, "seconds": None, "error": None} for name in components}
+
+    def run(self, name, load):
+        """加载一个组件并记录耗时，返回加载函数的结果（失败时返回 None）。"""
+        with self._lock:
+            self._components[name] = {"status": LOADING, "seconds": None, "error": None}
+        logger.info(f"正在加载组件 '{name}'...")
+        started = time.monotonic()
+        result, error = None, None
+        try:
+            result = load()
+            if result is None or result is False:
+                error = "加载函数未返回可用结果，请检查日志。"
+        except Exception as e:
+            logger.error(f"加载组件 '{name}' 时出错: {e}", exc_info=True)
+            error = str(e)
+        seconds = round(time.monotonic() - started, 3)
+        with self._lock:
+            self._components[name] = {
+                "status": FAILED if error else READY,
+                "seconds": seconds,
+                "error": error,
+            }
+        if error:
+            logger.warning(f"组件 '{name}' 加载失败 ({seconds}s)。")
+            return None
+        logger.info(f"组件 '{name}' 加载完成，耗时 {seconds}s。")
+        return result
+
+    def status(self, name):
+        with self._lock:
+            return self._components.get(name, {}).get("status", PENDING)
+
+    def is_ready(self, *names):
+        return all(self.status(name) == READY for name in names)
+
+    def is_settled(self, name):
+        """组件已经加载完成，无论成功与否。"""
+        return self.status(name) in (READY, FAILED)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "components": {name: dict(info) for name, info in self._components.items()},
+            }
@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# --- 流式响应 ---
+# Agent 执行过程中的回调被转换为事件，经由队列交给 SSE 响应逐条发送：
+#   start     {"session_id"}                 请求已受理
+#   thinking  {"step"}                       开始一次 LLM 调用
+#   tool_start {"tool", "input"}             开始调用工具
+#   tool_end  {"tool", "elapsed_ms"}         工具调用结束
+#   token     {"text"}                       最终答案的增量文本
+#   final     与 /api/query 相同的响应体
+#   error     {"error"}
+
+
+def format_sse(event, data):
+    """格式化一条 Server-Sent Events 消息。"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class FinalAnswerExtractor:
+    """
+    JSON 对话 Agent 的 LLM 输出是 {"action": ..., "action_input": ...} 形式的 JSON 代码块。
+    逐个喂入流式 token，只在 action 为 "Final Answer" 时增量返回 action_input 字符串的内容（已处理转义）。
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buffer = ""
+        self._pos = None   # action_input 字符串内容在 buffer 中的起始位置，尚未定位时为 None
+        self._done = False
+
+    def feed(self, token):
+        if self._done:
+            return ""
+        self._buffer += token
+        if self._pos is None:
+            if '"Final Answer"' not in self._buffer:
+                return ""
+            key = self._buffer.find('"action_input"')
+            if key == -1:
+                return ""
+            quote = self._buffer.find('"', self._buffer.find(":", key) + 1)
+            if quote == -1 or self._buffer.find(":", key) == -1:
+                return ""
+            self._pos = quote + 1
+        return self._consume()
+
+    def _consume(self):
+        out = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == "\\":
+                if i + 1 >= len(buf):
+                    break  # 转义序列尚未完整，等待下一个 token
+                nxt = buf[i + 1]
+                if nxt == "u":
+                    if i + 6 > len(buf):
+                        break
+                    out.append(chr(int(buf[i + 2:i + 6], 16)))
+                    i += 6
+                    continue
+                out.append(self._ESCAPES.get(nxt, nxt))
+                i += 2
+                continue
+            if ch == '"':
+                self._done = True
+                i += 1
+                break
+            out.append(ch)
+            i += 1
+        self._pos = i
+        return "".join(out)
+
+
+class StreamingCallbackHandler(BaseCallbackHandler):
+    """
+    把 Agent 执行过程转换为流式事件，通过 emit(event, data) 交给调用方（通常是写入队列）。
+    工具可能在线程池中执行，emit 必须是线程安全的。
+    """
+
+    run_inline = True
+
+    def __init__(self, emit):
+        self.emit = emit
+        self._extractor = FinalAnswerExtractor()
+        self._tools = {}  # run_id -> (工具名, 开始时间)
+        self._steps = 0
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._on_llm_start()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._on_llm_start()
+
+    def _on_llm_start(self):
+        with self._lock:
+            self._steps += 1
+            self._extractor.reset()
+            step = self._steps
+        self.emit("thinking", {"step": step})
+
+    def on_llm_new_token(self, token, **kwargs):
+        with self._lock:
+            text = self._extractor.feed(token)
+        if text:
+            self.emit("token", {"text": text})
+
+    def on_tool_start(self, serialized, input_str, run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        with self._lock:
+            self._tools[run_id] = (name, time.monotonic())
+        self.emit("tool_start", {"tool": name, "input": input_str})
+
+    def on_tool_end(self, output, run_id=None, **kwargs):
+        self._finish_tool(run_id)
+
+    def on_tool_error(self, error, run_id=None, **kwargs):
+        self._finish_tool(run_id, error=str(error))
+
+    def _finish_tool(self, run_id, error=None):
+        with self._lock:
+            name, started = self._tools.pop(run_id, ("tool", time.monotonic()))
+        data = {"tool": name, "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+        if error:
+            data["error"] = error
+        self.emit("tool_end", data)
@@ -0,0 +1,52 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ecommerce_agent import config
+
+logger = logging.getLogger(__name__)
+
+# --- 有界线程池 ---
+# 异步服务模式下，阻塞的数据库查询和 CPU 密集的嵌入/FAISS 检索分别放到独立的有界线程池中执行，
+# 事件循环本身只负责等待 LLM 的网络请求。线程数用完时任务在线程池内排队，不会无限制地创建线程。
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def _pool_size(name):
+    if name == "db":
+        # 超过连接池大小的线程只会在等待连接时阻塞
+        return config.DB_THREADS or config.MYSQL_POOL_SIZE
+    if name == "search":
+        return config.SEARCH_THREADS
+    raise ValueError(f"未知的线程池: {name}")
+
+
+def get_executor(name):
+    """返回指定名称（'db' 或 'search'）的线程池，首次使用时创建。"""
+    with _lock:
+        executor = _pools.get(name)
+        if executor is None:
+            size = max(1, _pool_size(name))
+            executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"{name}-pool")
+            _pools[name] = executor
+            logger.info(f"已创建线程池 '{name}'，线程数 {size}。")
+        return executor
+
+
+async def run_blocking(name, func, *args, **kwargs):
+    """在指定线程池中执行阻塞函数并等待结果；函数在调用方上下文的副本中运行，链路追踪的当前 span 随之传递。"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(name), functools.partial(context.run, func, *args, **kwargs))
+
+
+def shutdown():
+    with _lock:
+        for executor in _pools.values():
+            executor.shutdown(wait=False)
+        _pools.clear()
@@ -0,0 +1,509 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from bisect import bisect_left
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from ecommerce_agent import config
+
+logger = logging.getLogger(__name__)
+
+# --- 链路追踪与指标 ---
+# 一次问题处理记录为一棵 span 树：
+#   question -> llm / tool.<工具名> -> embedding / faiss.search / bm25.search / sql.<语句类型>
+# 每个结束的 span 的耗时都记入 Prometheus 直方图（/metrics）。配置了 TRACE_EXPORT 时同时以 Zipkin v2 JSON 导出：
+#   - 文件路径：每行一个 span（JSON Lines），可离线分析；
+#   - http(s):// 开头的地址：后台线程批量 POST 到本地收集器（Zipkin，或带 zipkin receiver 的 OpenTelemetry Collector）。
+# TRACING_ENABLED=False 时 span() 返回空操作对象，数据库连接也不再包装。
+
+SERVICE_NAME = "ecommerce-agent"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Prometheus 客户端的默认分桶（秒），另加 30s/60s 覆盖慢的大模型调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 30.0, 60.0)
+# 提示词 token 数的分桶
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+# 导出的 SQL 语句最多保留的字符数
+SQL_STATEMENT_MAX_CHARS = 200
+SQL_VERBS = ("select", "insert", "update", "delete", "replace", "create", "alter", "load", "show")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+# --- 指标 ---
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """Prometheus 直方图，按标签值分别统计各分桶的累计次数、总和与次数。"""
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # 标签值 -> [各分桶次数..., +Inf次数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[position] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', le)])} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Prometheus 计数器。"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for label_values, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+SPAN_DURATION = Histogram("ecommerce_span_duration_seconds", "各环节（问题、LLM、工具、嵌入、向量检索、SQL）的耗时", ("span",))
+SPAN_ERRORS = Counter("ecommerce_span_errors_total", "以异常结束的 span 数", ("span",))
+SPANS_DROPPED = Counter("ecommerce_spans_dropped_total", "导出队列已满或导出失败而丢弃的 span 数")
+PROMPT_TOKENS = Histogram("ecommerce_prompt_tokens", "每个问题发送给大模型的提示词 token 数（Agent 各步骤之和）",
+                          buckets=TOKEN_BUCKETS)
+METRICS = [SPAN_DURATION, SPAN_ERRORS, SPANS_DROPPED, PROMPT_TOKENS]
+
+
+def render_metrics():
+    """返回 Prometheus 文本格式的全部指标。"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Span ---
+
+class Span:
+    """一个计时区间。attributes 中的值导出为 Zipkin 的 tags。"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "timestamp", "_started", "duration", "attributes", "error")
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.timestamp = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_error(self, error):
+        self.error = str(error) or type(error).__name__
+
+    def finish(self):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        SPAN_DURATION.observe(self.duration, self.name)
+        if self.error is not None:
+            SPAN_ERRORS.inc(self.name)
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export(self)
+
+    def to_zipkin(self):
+        tags = {key: str(value) for key, value in self.attributes.items() if value is not None}
+        if self.error is not None:
+            tags["error"] = self.error
+        data = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.timestamp * 1_000_000),
+            "duration": max(1, int(self.duration * 1_000_000)),
+            "localEndpoint": {"serviceName": SERVICE_NAME},
+            "tags": tags,
+        }
+        if self.parent_id:
+            data["parentId"] = self.parent_id
+        return data
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空操作 span。"""
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def finish(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _SpanScope:
+    """span() 返回的上下文管理器：进入时开始 span 并设为当前 span，退出时结束并恢复。"""
+
+    __slots__ = ("_span", "_token")
+
+    def __init__(self, span_obj):
+        self._span = span_obj
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc is not None:
+            self._span.record_error(exc)
+        self._span.finish()
+        return False
+
+
+class _NoopScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return NOOP_SPAN
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SCOPE = _NoopScope()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def start_span(name, parent=None, **attributes):
+    """开始一个 span 但不设为当前 span（用于在回调中开始、在另一个回调中结束的区间）。"""
+    if not config.TRACING_ENABLED:
+        return NOOP_SPAN
+    return Span(name, parent if parent is not None else _current_span.get(), attributes)
+
+
+def span(name, **attributes):
+    """
+    在 with 代码块中记录一个 span，作为当前 span 的子 span：
+        with tracing.span("faiss.search", k=k) as s:
+            ...
+            s.set(results=len(results))
+    """
+    if not config.TRACING_ENABLED:
+        return _NOOP_SCOPE
+    return _SpanScope(Span(name, _current_span.get(), attributes))
+
+
+# --- LangChain 回调 ---
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    把 AgentExecutor 循环中的每次 LLM 调用和工具调用记录为问题 span 的子 span。
+    工具 span 在执行期间设为当前 span，工具内部的嵌入、向量检索和 SQL span 挂在它下面。
+    """
+
+    run_inline = True
+
+    def __init__(self, parent):
+        self.parent = parent
+        self._spans = {}  # run_id -> (span, contextvar token)
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, run_id=None, **kwargs):
+        self._start(run_id, start_span("llm", parent=self.parent, model=self._model_name(serialized, kwargs)))
+
+    def on_llm_start(self, serialized, prompts, run_id=None, **kwargs):
+        self._start(run_id, start_span("llm", parent=self.parent, model=self._model_name(serialized, kwargs)))
+
+    def on_llm_end(self, response, run_id=None, **kwargs):
+        span_obj, _ = self._pop(run_id)
+        if span_obj is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        span_obj.set(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+        span_obj.finish()
+
+    def on_llm_error(self, error, run_id=None, **kwargs):
+        self._finish(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        attributes = {"input": input_str} if config.LOG_PAYLOADS else {}
+        span_obj = start_span(f"tool.{name}", parent=self.parent, **attributes)
+        self._start(run_id, span_obj, activate=True)
+
+    def on_tool_end(self, output, run_id=None, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, run_id=None, **kwargs):
+        self._finish(run_id, error)
+
+    @staticmethod
+    def _model_name(serialized, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        return params.get("model_name") or params.get("model") or ((serialized or {}).get("kwargs") or {}).get("model_name")
+
+    def _start(self, run_id, span_obj, activate=False):
+        token = _current_span.set(span_obj) if activate and span_obj is not NOOP_SPAN else None
+        with self._lock:
+            self._spans[run_id] = (span_obj, token)
+
+    def _pop(self, run_id):
+        with self._lock:
+            span_obj, token = self._spans.pop(run_id, (None, None))
+        if token is not None:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # 结束回调与开始回调不在同一个上下文中执行，开始时设置的值已随那个上下文一起丢弃
+                pass
+        return span_obj, token
+
+    def _finish(self, run_id, error=None):
+        span_obj, _ = self._pop(run_id)
+        if span_obj is None:
+            return
+        if error is not None:
+            span_obj.record_error(error)
+        span_obj.finish()
+
+
+def with_tracing(callbacks):
+    """在 Agent 的回调列表中加入追踪回调（当前没有问题 span 或追踪关闭时原样返回）。"""
+    parent = _current_span.get()
+    if parent is None or not config.TRACING_ENABLED:
+        return callbacks
+    return list(callbacks or []) + [TracingCallbackHandler(parent)]
+
+
+# --- 数据库游标代理 ---
+
+def _sql_span_name(operation):
+    if isinstance(operation, bytes):
+        operation = operation.decode("utf-8", "replace")
+    verb = operation.lstrip().split(None, 1)[0].lower() if operation.strip() else ""
+    return f"sql.{verb}" if verb in SQL_VERBS else "sql.other", operation
+
+
+class TracedCursor:
+    """DB-API 游标代理：每条 execute / executemany 记录为一个 sql.<语句类型> span。"""
+
+    __slots__ = ("_cursor",)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        name, text = _sql_span_name(operation)
+        with span(name, statement=" ".join(text.split())[:SQL_STATEMENT_MAX_CHARS]) as s:
+            result = self._cursor.execute(operation, params, *args, **kwargs)
+            s.set(rows=self._cursor.rowcount)
+            return result
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        name, text = _sql_span_name(operation)
+        with span(name, statement=" ".join(text.split())[:SQL_STATEMENT_MAX_CHARS], batch=len(seq_params)) as s:
+            result = self._cursor.executemany(operation, seq_params, *args, **kwargs)
+            s.set(rows=self._cursor.rowcount)
+            return result
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._cursor.__exit__(exc_type, exc, tb)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TracedConnection:
+    """数据库连接代理：创建的游标都带有 SQL 追踪，其余属性和方法直接转交原连接。"""
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def trace_connection(conn):
+    """追踪开启时返回连接的代理，否则原样返回。"""
+    if conn is None or not config.TRACING_ENABLED:
+        return conn
+    return TracedConnection(conn)
+
+
+# --- 导出 ---
+
+class FileExporter:
+    """把 span 以 Zipkin v2 JSON 逐行追加到文件。"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, span_obj):
+        line = json.dumps(span_obj.to_zipkin(), ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+class CollectorExporter:
+    """
+    把 span 放入有界队列，后台线程每秒或每攒满一批时以 Zipkin v2 JSON POST 到收集器。
+    队列已满或发送失败时丢弃 span（计入 ecommerce_spans_dropped_total），不阻塞请求处理。
+    """
+
+    def __init__(self, url, batch_size=100, max_queue=10000, interval=1.0, timeout=5.0):
+        self.url = url
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span_obj):
+        try:
+            self._queue.put_nowait(span_obj)
+        except queue.Full:
+            SPANS_DROPPED.inc()
+
+    def _drain(self, block):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.interval) if block else self._queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _send(self, batch):
+        body = json.dumps([s.to_zipkin() for s in batch], ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except Exception as e:
+            SPANS_DROPPED.inc(amount=len(batch))
+            logger.warning(f"导出 {len(batch)} 个 span 到 {self.url} 失败: {e}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._drain(block=True)
+            if batch:
+                self._send(batch)
+
+    def shutdown(self):
+        self._stopped.set()
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                break
+            self._send(batch)
+
+
+_exporter = None
+_exporter_created = False
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """按 TRACE_EXPORT 配置创建导出器（首次调用时），未配置时返回 None。"""
+    global _exporter, _exporter_created
+    if not _exporter_created:
+        with _exporter_lock:
+            if not _exporter_created:
+                target = config.TRACE_EXPORT
+                if target.startswith(("http://", "https://")):
+                    _exporter = CollectorExporter(target)
+                elif target:
+                    _exporter = FileExporter(target)
+                if _exporter is not None:
+                    logger.info(f"链路追踪已启用，span 导出到 {target}。")
+                    atexit.register(_exporter.shutdown)
+                _exporter_created = True
+    return _exporter
+
+
+def set_exporter(exporter):
+    """替换导出器（None 表示不导出），例如基准测试在内存中收集 span 以拆分各阶段耗时。"""
+    global _exporter, _exporter_created
+    with _exporter_lock:
+        _exporter = exporter
+        _exporter_created = True
@@ -0,0 +1,490 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import time
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+from ecommerce_agent import config
+from ecommerce_agent import tracing
+from ecommerce_agent.embedding_pipeline import EmbeddingPipeline
+
+logger = logging.getLogger(__name__)
+
+# 索引目录中的文件
+INDEX_FILE_NAME = "products.faiss"        # ID映射的原始FAISS索引
+MANIFEST_FILE_NAME = "manifest.json"      # 商品ID -> (FAISS整数ID, 内容哈希) 的清单，仅构建和增量更新时需要
+PRODUCT_IDS_FILE_NAME = "product_ids.npy" # FAISS整数ID -> 商品ID 的定长字符串数组，服务进程以 mmap 读取
+META_FILE_NAME = "index_meta.json"        # 模型、维度、索引类型等少量元数据
+
+# 每次保存写入一个新的版本目录 versions/<版本>/，写完后原子替换 CURRENT 指针文件，
+# 读取方看到的总是某个完整的版本；不使用符号链接，Windows 下同样可用
+VERSIONS_DIR_NAME = "versions"
+CURRENT_FILE_NAME = "CURRENT"
+LOCK_FILE_NAME = ".write.lock"
+KEEP_VERSIONS = 3                         # 保留最近几个版本，其他 worker 可能仍在使用较旧的版本
+
+# 以 mmap 方式打开 FAISS 索引的向量数据，多个 worker 通过操作系统页缓存共享同一份内存。
+# 使用 IO_FLAG_MMAP_IFC（整个索引文件 mmap，向量和倒排表数据直接引用映射的页）而不是 IO_FLAG_MMAP：
+# 后者只对 OnDiskInvertedLists 的磁盘倒排表生效，本项目构建的 Flat/HNSW/IVF 索引仍会被读入私有内存。
+MMAP_IO_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+
+
+def build_product_text(product):
+    """生成用于向量化的商品文本，索引构建和增量更新必须使用同一格式。"""
+    return f"商品名称: {product['name']}\n商品描述: {product['description']}"
+
+
+def content_hash(text):
+    """计算向量化文本的内容哈希，用于判断商品是否需要重新嵌入。"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def factory_needs_training(factory):
+    """IVF / PQ / SQ 类索引需要先在样本向量上训练。"""
+    return any(token in factory for token in ("IVF", "PQ", "SQ"))
+
+
+def factory_supports_remove(factory):
+    """HNSW 图索引不支持删除向量，只能标记删除并在检索时过滤。"""
+    return "HNSW" not in factory
+
+
+def build_faiss_index(dim, factory, training_vectors=None):
+    """
+    按 FAISS index_factory 字符串（如 'Flat'、'IVF256,Flat'、'HNSW32'、'IVF256,PQ64'）创建支持自定义ID的索引。
+    需要训练的索引使用 training_vectors 训练，样本不足时抛出异常。
+    """
+    inner = faiss.index_factory(dim, factory)
+    if not inner.is_trained:
+        if training_vectors is None or len(training_vectors) == 0:
+            raise ValueError(f"索引类型 '{factory}' 需要训练样本。")
+        inner.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+    if faiss.try_extract_index_ivf(inner) is not None:
+        # IVF 倒排表本身按外部ID存储并支持按ID删除；IDMap 的删除假设内部位置随之前移，不适用于 IVF
+        return inner
+    return faiss.IndexIDMap2(inner)
+
+
+def apply_search_params(index, factory, nprobe=None, ef_search=None):
+    """设置查询时参数：IVF 类索引的 nprobe，HNSW 索引的 efSearch。"""
+    nprobe = config.FAISS_NPROBE if nprobe is None else nprobe
+    ef_search = config.FAISS_EF_SEARCH if ef_search is None else ef_search
+    params = faiss.ParameterSpace()
+    if "IVF" in factory and nprobe:
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if "HNSW" in factory and ef_search:
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+
+def resolve_index_dir(path):
+    """返回 CURRENT 指向的版本目录；没有 CURRENT 时为旧的平铺格式，文件直接位于 path 下。"""
+    try:
+        with open(os.path.join(path, CURRENT_FILE_NAME), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return path
+    return os.path.join(path, VERSIONS_DIR_NAME, version)
+
+
+def _prune_versions(path, current):
+    """删除较旧的版本目录；已打开或 mmap 的文件在 POSIX 上仍可继续使用，Windows 下删除失败时留到下次。"""
+    versions_dir = os.path.join(path, VERSIONS_DIR_NAME)
+    versions = sorted(name for name in os.listdir(versions_dir) if name != current)
+    for name in versions[:max(0, len(versions) - (KEEP_VERSIONS - 1))]:
+        shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+    # 旧的平铺格式留下的文件
+    for name in (INDEX_FILE_NAME, MANIFEST_FILE_NAME, PRODUCT_IDS_FILE_NAME, META_FILE_NAME):
+        try:
+            os.remove(os.path.join(path, name))
+        except OSError:
+            pass
+
+
+@contextmanager
+def index_write_lock(path):
+    """
+    索引目录的进程间写锁：多个 worker 同时启动时只有一个同步和保存索引，其他的等待后复用结果。
+    以文件锁实现，进程退出时由操作系统释放。
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, LOCK_FILE_NAME), "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # LK_LOCK 最多重试 10 秒后抛出 OSError，继续等待
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ProductVectorIndex:
+    """
+    商品向量索引：FAISS IndexIDMap2 + 商品ID清单。
+    每个商品对应一个稳定的整数ID，因此可以按商品删除或替换向量，而无需重建整个索引。
+    内部索引类型由 factory 决定；不支持删除的索引（HNSW）改为记录墓碑ID，检索时多取并过滤。
+    """
+
+    def __init__(self, index, manifest=None, id_array=None, meta=None, manifest_file=None):
+        self.index = index
+        self._manifest = manifest
+        self._manifest_file = manifest_file
+        self._id_array = id_array
+        self._meta = meta
+        self._id_to_product = None
+        self.mapped = False
+        self.directory = None
+        if manifest is not None:
+            self._index_manifest()
+
+    def _index_manifest(self):
+        self._manifest.setdefault("factory", "Flat")
+        self._manifest.setdefault("tombstones", [])
+        self._id_to_product = {
+            entry["id"]: product_id for product_id, entry in self._manifest["products"].items()
+        }
+
+    @property
+    def manifest(self):
+        """完整清单；以 mmap 方式加载时只在需要计算或应用变更时才读取。"""
+        if self._manifest is None:
+            # 加载时已打开的文件句柄：版本目录被后来的保存清理后仍可读取
+            self._manifest_file.seek(0)
+            self._manifest = json.load(self._manifest_file)
+            self._manifest_file.close()
+            self._index_manifest()
+        return self._manifest
+
+    def _info(self, key, default=None):
+        source = self._manifest if self._manifest is not None else self._meta
+        return source.get(key, default)
+
+    def _product_of(self, faiss_id):
+        if self._id_to_product is not None:
+            return self._id_to_product.get(faiss_id)
+        if 0 <= faiss_id < len(self._id_array):
+            return str(self._id_array[faiss_id]) or None
+        return None
+
+    @classmethod
+    def create(cls, dim, model, factory=None, training_vectors=None):
+        """
+        创建一个空索引（L2距离，与原先 LangChain FAISS 的默认行为一致）。
+        训练样本不足以训练所选索引类型时回退为 Flat 精确索引。
+        """
+        factory = requested_factory = factory or config.FAISS_INDEX_FACTORY
+        try:
+            index = build_faiss_index(dim, factory, training_vectors)
+        except Exception as e:
+            logger.warning(f"无法创建 '{factory}' 索引 ({e})，回退为 Flat 精确索引。")
+            factory = "Flat"
+            index = build_faiss_index(dim, factory)
+        apply_search_params(index, factory)
+        manifest = {"model": model, "dim": dim, "factory": factory, "requested_factory": requested_factory,
+                    "next_id": 0, "products": {}, "tombstones": []}
+        return cls(index, manifest)
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """
+        从目录加载 CURRENT 指向的版本（兼容旧的平铺格式），目录中缺少文件时返回 None。
+        mmap=True 时向量数据以只读 mmap 方式打开、商品ID数组按需分页读取，不解析清单；
+        旧格式的索引目录或不支持 mmap 的 FAISS 版本会回退为完整加载。
+        """
+        directory = resolve_index_dir(path)
+        index_file = os.path.join(directory, INDEX_FILE_NAME)
+        manifest_file = os.path.join(directory, MANIFEST_FILE_NAME)
+        if not (os.path.exists(index_file) and os.path.exists(manifest_file)):
+            return None
+        ids_file = os.path.join(directory, PRODUCT_IDS_FILE_NAME)
+        meta_file = os.path.join(directory, META_FILE_NAME)
+        if mmap and MMAP_IO_FLAGS is not None and os.path.exists(ids_file) and os.path.exists(meta_file):
+            with open(meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            index = faiss.read_index(index_file, MMAP_IO_FLAGS | faiss.IO_FLAG_READ_ONLY)
+            id_array = np.load(ids_file, mmap_mode="r", allow_pickle=False)
+            vector_index = cls(index, id_array=id_array, meta=meta,
+                               manifest_file=open(manifest_file, "r", encoding="utf-8"))
+            vector_index.mapped = True
+        else:
+            if mmap:
+                logger.info(f"'{path}' 不支持 mmap 加载，改为完整加载。")
+            with open(manifest_file, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            index = faiss.read_index(index_file)
+            vector_index = cls(index, manifest)
+        vector_index.directory = directory
+        apply_search_params(index, vector_index.factory)
+        return vector_index
+
+    def save(self, path):
+        """
+        写入新的版本目录后原子替换 CURRENT，读取方不会看到新旧文件混合的索引；已 mmap 的旧版本仍可继续使用。
+        多个进程可能同时保存时由调用方持有 index_write_lock。
+        """
+        version = f"{time.time_ns()}-{os.getpid()}"
+        directory = os.path.join(path, VERSIONS_DIR_NAME, version)
+        os.makedirs(directory)
+        manifest = self.manifest
+        products = manifest["products"]
+        width = max((len(pid) for pid in products), default=1)
+        id_array = np.zeros(manifest["next_id"], dtype=f"<U{width}")
+        for product_id, entry in products.items():
+            id_array[entry["id"]] = product_id
+        meta = {key: manifest.get(key) for key in ("model", "dim", "factory", "requested_factory")}
+        meta["tombstones"] = len(manifest["tombstones"])
+
+        faiss.write_index(self.index, os.path.join(directory, INDEX_FILE_NAME))
+        with open(os.path.join(directory, PRODUCT_IDS_FILE_NAME), "wb") as f:
+            np.save(f, id_array, allow_pickle=False)
+        for name, data in ((MANIFEST_FILE_NAME, manifest), (META_FILE_NAME, meta)):
+            with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+
+        current_file = os.path.join(path, CURRENT_FILE_NAME)
+        with open(current_file + ".tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(current_file + ".tmp", current_file)
+        self.directory = directory
+        _prune_versions(path, version)
+
+    def copy(self):
+        """复制索引和清单；在副本上修改后再替换引用，正在进行的检索不受影响。"""
+        if self.mapped:
+            # mmap 的只读数据不能 clone 后修改，序列化后重新读入内存
+            index = faiss.deserialize_index(faiss.serialize_index(self.index))
+        else:
+            index = faiss.clone_index(self.index)
+        apply_search_params(index, self.factory)
+        return ProductVectorIndex(index, copy.deepcopy(self.manifest))
+
+    def __len__(self):
+        return self.index.ntotal
+
+    @property
+    def model(self):
+        return self._info("model")
+
+    @property
+    def factory(self):
+        return self._info("factory", "Flat")
+
+    @property
+    def requested_factory(self):
+        """创建时配置的索引类型；回退为 Flat 后仍据此判断配置是否变化，避免每次启动都重建。"""
+        return self._info("requested_factory") or self.factory
+
+    @property
+    def tombstone_count(self):
+        if self._manifest is not None:
+            return len(self._manifest["tombstones"])
+        return self._meta.get("tombstones", 0)
+
+    @property
+    def supports_remove(self):
+        return factory_supports_remove(self.factory)
+
+    def needs_rebuild(self, max_tombstone_ratio=0.2):
+        """墓碑向量占比过高时，检索需要多取的候选过多，应完整重建索引。"""
+        return self.tombstone_count > max_tombstone_ratio * max(1, self.index.ntotal)
+
+    def _check_writable(self):
+        if self.mapped:
+            raise RuntimeError("以 mmap 方式加载的索引是只读的，请先调用 copy()。")
+
+    def get_hash(self, product_id):
+        entry = self.manifest["products"].get(product_id)
+        return entry["hash"] if entry else None
+
+    def product_ids(self):
+        return list(self.manifest["products"].keys())
+
+    def upsert(self, product_ids, vectors, hashes):
+        """
+        写入一批向量。已存在的商品会先删除旧向量再以原整数ID写入新向量；
+        索引不支持删除时，旧向量记为墓碑，新向量使用新的整数ID。
+        """
+        self._check_writable()
+        products = self.manifest["products"]
+        existing = [pid for pid in product_ids if pid in products]
+        if existing:
+            if self.supports_remove:
+                self.index.remove_ids(np.array([products[pid]["id"] for pid in existing], dtype=np.int64))
+            else:
+                self.remove(existing)
+
+        ids = []
+        for product_id, h in zip(product_ids, hashes):
+            entry = products.get(product_id)
+            if entry is None:
+                entry = {"id": self.manifest["next_id"]}
+                self.manifest["next_id"] += 1
+                products[product_id] = entry
+                self._id_to_product[entry["id"]] = product_id
+            entry["hash"] = h
+            ids.append(entry["id"])
+        self.index.add_with_ids(
+            np.ascontiguousarray(vectors, dtype=np.float32),
+            np.array(ids, dtype=np.int64)
+        )
+
+    def remove(self, product_ids):
+        """按商品ID删除向量，返回实际删除的数量。"""
+        self._check_writable()
+        products = self.manifest["products"]
+        ids = []
+        for product_id in product_ids:
+            entry = products.pop(product_id, None)
+            if entry is not None:
+                ids.append(entry["id"])
+                self._id_to_product.pop(entry["id"], None)
+        if ids:
+            if self.supports_remove:
+                self.index.remove_ids(np.array(ids, dtype=np.int64))
+            else:
+                self.manifest["tombstones"].extend(ids)
+        return len(ids)
+
+    def _faiss_ids_of(self, product_ids):
+        """商品ID -> FAISS整数ID，不在索引中的商品被忽略。"""
+        if self._manifest is not None:
+            products = self._manifest["products"]
+            return [products[pid]["id"] for pid in product_ids if pid in products]
+        # ID 数组是定长的 <U{width}，更长的ID转换时会被截断成另一个商品的ID，因此先排除
+        # （它们本来就不可能在索引中），与清单方式加载时的结果保持一致；空字符串表示已删除的位置
+        width = self._id_array.dtype.itemsize // 4
+        wanted = [pid for pid in product_ids if 0 < len(pid) <= width]
+        if not wanted:
+            return []
+        wanted = np.asarray(wanted, dtype=self._id_array.dtype)
+        return np.nonzero(np.isin(self._id_array, wanted))[0].tolist()
+
+    def _selector_params(self, faiss_ids):
+        """只在给定ID范围内检索的参数：IVF 需要同时带上 nprobe，IDMap 会把内部位置翻译成这里的外部ID。"""
+        selector = faiss.IDSelectorBatch(np.asarray(faiss_ids, dtype=np.int64))
+        if isinstance(self.index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.index.nprobe), selector
+        return faiss.SearchParameters(sel=selector), selector
+
+    def search(self, query_vector, k, product_ids=None):
+        """
+        返回 [(商品ID, L2距离)]，分数越低越相关。
+        给出 product_ids 时只在这些商品中检索（结构化过滤的预筛选结果）。
+        """
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        with tracing.span("faiss.search", k=k, queries=1, filtered=product_ids is not None):
+            if product_ids is not None:
+                faiss_ids = self._faiss_ids_of(product_ids)
+                if not faiss_ids:
+                    return []
+                params, selector = self._selector_params(faiss_ids)
+                distances, ids = self.index.search(query, min(k, len(faiss_ids)), params=params)
+            else:
+                # 墓碑向量仍在索引中，多取一些候选再过滤
+                k_search = min(k + self.tombstone_count, max(1, self.index.ntotal))
+                distances, ids = self.index.search(query, k_search)
+            return self._collect(distances[0], ids[0], k)
+
+    def search_batch(self, query_vectors, k):
+        """多个查询向量一次矩阵检索，返回与输入顺序对应的 [[(商品ID, L2距离)], ...]。"""
+        queries = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        if len(queries) == 0:
+            return []
+        k_search = min(k + self.tombstone_count, max(1, self.index.ntotal))
+        with tracing.span("faiss.search", k=k, queries=len(queries), filtered=False):
+            distances, ids = self.index.search(queries, k_search)
+        return [self._collect(row_distances, row_ids, k) for row_distances, row_ids in zip(distances, ids)]
+
+    def _collect(self, distances, ids, k):
+        results = []
+        for score, faiss_id in zip(distances, ids):
+            if faiss_id == -1:
+                continue
+            product_id = self._product_of(int(faiss_id))
+            if product_id is not None:
+                results.append((product_id, float(score)))
+                if len(results) == k:
+                    break
+        return results
+
+
+def plan_index_sync(vector_index, products, scope=None):
+    """
+    比较数据库中的商品与索引清单，返回 (待嵌入列表, 待删除ID列表, 统计)。
+    待嵌入列表的元素为 (商品ID, 向量化文本, 内容哈希)。
+    scope 为 None 时 products 视为全量商品；否则只在 scope 这些商品ID范围内计算删除。
+    """
+    stats = {"added": 0, "updated": 0, "removed": 0, "skipped": 0}
+    to_embed = []
+    seen = set()
+    for product in products:
+        product_id = product["id"]
+        seen.add(product_id)
+        text = build_product_text(product)
+        h = content_hash(text)
+        old_hash = vector_index.get_hash(product_id) if vector_index is not None else None
+        if old_hash == h:
+            stats["skipped"] += 1
+            continue
+        stats["added" if old_hash is None else "updated"] += 1
+        to_embed.append((product_id, text, h))
+
+    to_remove = []
+    if vector_index is not None:
+        candidates = vector_index.product_ids() if scope is None else scope
+        to_remove = [pid for pid in candidates if pid not in seen and vector_index.get_hash(pid) is not None]
+    stats["removed"] = len(to_remove)
+    return to_embed, to_remove, stats
+
+
+def _sample_training_vectors(pipeline, to_embed):
+    """为需要训练的索引抽样嵌入一批向量。"""
+    sample_size = min(len(to_embed), config.FAISS_TRAIN_SAMPLE_SIZE)
+    sample = random.Random(0).sample(to_embed, sample_size)
+    logger.info(f"正在嵌入 {sample_size} 条训练样本...")
+    return np.concatenate([vectors for _, vectors in pipeline.iter_batches(sample)])
+
+
+def apply_index_sync(vector_index, embeddings, model, to_embed, to_remove, pipeline=None, factory=None):
+    """
+    执行增量同步：嵌入新增/变更的商品并删除已下架的商品。
+    向量由嵌入流水线逐批产出并直接写入索引，不会一次性保存全部向量。
+    vector_index 为 None 时按 factory（默认 FAISS_INDEX_FACTORY）新建索引，
+    需要训练的索引类型先在抽样的向量上训练，返回更新后的索引。
+    以 mmap 方式加载的只读索引会先复制一份再修改。
+    """
+    if vector_index is not None and vector_index.mapped:
+        vector_index = vector_index.copy()
+    if to_remove and vector_index is not None:
+        vector_index.remove(to_remove)
+    if to_embed:
+        pipeline = pipeline or EmbeddingPipeline(embeddings)
+        factory = factory or config.FAISS_INDEX_FACTORY
+        if vector_index is None and factory_needs_training(factory):
+            training_vectors = _sample_training_vectors(pipeline, to_embed)
+            vector_index = ProductVectorIndex.create(training_vectors.shape[1], model, factory, training_vectors)
+        for batch, vectors in pipeline.iter_batches(to_embed):
+            if vector_index is None:
+                vector_index = ProductVectorIndex.create(vectors.shape[1], model, factory)
+            vector_index.upsert([item[0] for item in batch], vectors, [item[2] for item in batch])
+    return vector_index
@@ -1,6 +1,7 @@
 import argparse
 import os
 from ecommerce_agent import mysql_db
+from ecommerce_agent import change_feed
 
 def main():
     """
@@ -19,6 +20,37 @@ def main():
         action="store_true",
         help="在导入前，先运行数据库初始化（创建表）。"
     )
+    parser.add_argument(
+        "--no-feed",
+        action="store_true",
+        help="不把变更的商品ID写入变更流（运行中的服务将不会自动更新向量索引）。"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="每批提交的行数（默认读取 CSV_IMPORT_BATCH_SIZE，为1000）。"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="从上次中断时最后提交的批次继续导入。"
+    )
+    parser.add_argument(
+        "--rejects",
+        default=None,
+        help="被拒绝行的输出文件（默认 <CSV文件>.rejects.csv）。"
+    )
+    parser.add_argument(
+        "--changes-out",
+        default=None,
+        help="把新增或有变化的商品ID逐行写入该文件。"
+    )
+    parser.add_argument(
+        "--load-data",
+        action="store_true",
+        help="使用 LOAD DATA LOCAL INFILE 批量装载（需服务器开启 local_infile，不支持断点续传）。"
+    )
     
     print("\n--- CSV商品数据导入工具 ---")
     print("""
@@ -44,9 +76,42 @@ def main():
         mysql_db.init_database()
         print("数据库初始化完成。")
 
+    changes_out = open(args.changes_out, "w", encoding="utf-8") if args.changes_out else None
+
+    def on_batch_committed(changed_ids):
+        """每批提交后输出变更的商品ID，并写入变更流供运行中的服务更新索引。"""
+        if changes_out:
+            changes_out.write("\n".join(changed_ids) + "\n")
+        if not args.no_feed:
+            change_feed.publish(changed_ids, source=os.path.basename(args.csv_file))
+
     # 执行批量导入
     print(f"\n正在从 '{args.csv_file}' 文件导入数据...")
-    mysql_db.batch_insert_products_from_csv(args.csv_file)
+    try:
+        if args.load_data:
+            stats = mysql_db.load_products_with_load_data(
+                args.csv_file, on_batch_committed=on_batch_committed, chunk_size=args.batch_size
+            )
+        else:
+            stats = mysql_db.batch_insert_products_from_csv(
+                args.csv_file,
+                batch_size=args.batch_size,
+                resume=args.resume,
+                rejects_path=args.rejects,
+                on_batch_committed=on_batch_committed
+            )
+    finally:
+        if changes_out:
+            changes_out.close()
+
+    if stats and stats["changed"]:
+        print(f"\n共有 {stats['changed']} 件商品为新增或有变化。")
+        if changes_out:
+            print(f"变更的商品ID已写入: {args.changes_out}")
+        if not args.no_feed:
+            print("已写入变更流，运行中的服务将自动更新向量索引。")
+    elif stats:
+        print("\n没有新增或有变化的商品。")
     print("---------------------------------")
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+from langchain_core.agents import AgentAction
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from ecommerce_agent.context_budget import ContextBudget, TokenCounter, compact_observation
+
+
+def make_budget(**budgets):
+    # 不加载 tiktoken 编码，按字符估算，结果与环境无关
+    budget = ContextBudget(counter=TokenCounter())
+    for name, value in budgets.items():
+        setattr(budget, name, value)
+    return budget
+
+
+def history(turns):
+    messages = []
+    for i in range(turns):
+        messages.extend([HumanMessage(content=f"问题{i}"), AIMessage(content=f"回答{i}")])
+    return messages
+
+
+def test_token_counter_estimate():
+    counter = TokenCounter()
+    assert counter.count("") == 0
+    assert counter.count("订单") == 2
+    assert counter.count("abcdefgh") == 2
+
+
+def test_fit_history_keeps_short_history_unchanged():
+    messages = history(2)
+    fitted = make_budget(recent_turns=3, history_tokens=1000).fit_history(messages)
+    assert [m.content for m in fitted] == [m.content for m in messages]
+
+
+def test_fit_history_summarizes_older_turns():
+    fitted = make_budget(recent_turns=2, history_tokens=1000, summary_tokens=200).fit_history(history(5))
+    assert isinstance(fitted[0], SystemMessage)
+    assert "问：问题0 答：回答0" in fitted[0].content
+    assert "问题3" not in fitted[0].content
+    assert [m.content for m in fitted[1:]] == ["问题3", "回答3", "问题4", "回答4"]
+
+
+def test_fit_history_truncates_an_oversized_latest_turn():
+    messages = [HumanMessage(content="问题"), AIMessage(content="长" * 500)]
+    fitted = make_budget(recent_turns=3, history_tokens=50).fit_history(messages)
+    assert len(fitted) == 2
+    assert fitted[1].content.endswith("…")
+    assert TokenCounter().count(fitted[1].content) <= 50
+
+
+def test_fit_history_empty():
+    assert make_budget().fit_history([]) == []
+    assert make_budget().fit_history(None) is None
+
+
+def test_compact_observation_merges_field_lines_and_drops_scores():
+    text = "1. 商品A\n   价格: 99元\n   相关度: 0.91\n\n2. 商品B"
+    assert compact_observation(text) == "1. 商品A｜价格: 99元\n2. 商品B"
+
+
+def test_compact_steps_shortens_older_observations_first():
+    action = AgentAction(tool="search_products", tool_input={}, log="")
+    observation = "\n".join(f"第{i}行商品信息" for i in range(20))
+    steps = [(action, observation), (action, observation)]
+    compacted = make_budget(observation_tokens=1000, scratchpad_tokens=200).compact_steps(steps)
+    assert compacted[0][0] is action
+    assert compacted[0][1] == "第0行商品信息（详细内容已省略）"
+    assert compacted[1][1] == observation
+
+
+def test_compact_steps_truncates_a_long_observation_by_lines():
+    action = AgentAction(tool="search_products", tool_input={}, log="")
+    observation = "\n".join(f"第{i}行商品信息" for i in range(20))
+    [(_, compacted)] = make_budget(observation_tokens=30, scratchpad_tokens=1000).compact_steps([(action, observation)])
+    assert compacted.startswith("第0行商品信息\n第1行商品信息")
+    assert compacted.endswith("行已省略）")
@@ -0,0 +1,41 @@
+from ecommerce_agent.lexical_index import reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_splits_cjk_into_bigrams():
+    assert tokenize("冲锋衣") == ["冲锋", "锋衣"]
+    assert tokenize("鞋") == ["鞋"]
+
+
+def test_tokenize_keeps_models_and_specs_with_their_parts():
+    tokens = tokenize("Gore-Tex 16GB 2.8K")
+    assert tokens[:3] == ["gore-tex", "gore", "tex"]
+    assert "16gb" in tokens
+    assert "2.8k" in tokens
+
+
+def test_tokenize_normalizes_full_width_and_case():
+    assert tokenize("ＡＢＣ") == tokenize("abc") == ["abc"]
+
+
+def test_tokenize_empty():
+    assert tokenize("") == []
+    assert tokenize(None) == []
+
+
+def test_reciprocal_rank_fusion_sums_ranks_across_sources():
+    fused = reciprocal_rank_fusion({
+        "vector": [("a", 0.9), ("b", 0.5)],
+        "bm25": [("b", 3.0), ("c", 1.0)],
+    }, k=60)
+    assert [product_id for product_id, _ in fused] == ["b", "a", "c"]
+    info = dict(fused)["b"]
+    assert info["rrf"] == round(1 / 62 + 1 / 61, 5)
+    assert info["vector"] == {"rank": 2, "score": 0.5}
+    assert info["bm25"] == {"rank": 1, "score": 3.0}
+    assert "bm25" not in dict(fused)["a"]
+
+
+def test_reciprocal_rank_fusion_limit():
+    fused = reciprocal_rank_fusion({"vector": [("a", 1.0), ("b", 0.5), ("c", 0.1)]}, limit=2)
+    assert [product_id for product_id, _ in fused] == ["a", "b"]
+    assert reciprocal_rank_fusion({}) == []
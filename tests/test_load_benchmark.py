@@ -0,0 +1,45 @@
+from langchain_core.messages import HumanMessage
+
+from benchmarks.fake_llm import INPUT_MARKER, TOOL_RESPONSE_MARKER, ScriptedChatModel
+from benchmarks.load_benchmark import make_questions, parse_size
+
+
+def action_of(message):
+    return message.content.split('"action": "', 1)[1].split('"', 1)[0]
+
+
+def ask(question, *observations):
+    messages = [HumanMessage(content=f"{INPUT_MARKER} ...\n\n{question}")]
+    messages += [HumanMessage(content=f"{TOOL_RESPONSE_MARKER}\n---------------------\n{o}") for o in observations]
+    return ScriptedChatModel().invoke(messages)
+
+
+def test_parse_size():
+    assert parse_size("1k") == 1_000
+    assert parse_size("100K") == 100_000
+    assert parse_size("1M") == 1_000_000
+    assert parse_size(" 2500 ") == 2500
+
+
+def test_make_questions_is_deterministic():
+    first = make_questions("mixed", 50, order_count=100, seed=7)
+    assert first == make_questions("mixed", 50, order_count=100, seed=7)
+    assert first != make_questions("mixed", 50, order_count=100, seed=8)
+    assert {kind for kind, _ in first} == {"order", "search"}
+
+
+def test_make_questions_scenarios():
+    assert all(kind == "order" and "订单" in question for kind, question in make_questions("order", 20, 10))
+    assert all(kind == "search" for kind, _ in make_questions("search", 20, 10))
+
+
+def test_scripted_model_picks_tools_by_question():
+    assert action_of(ask("订单12345到哪了")) == "query_order"
+    assert action_of(ask("商品P001还有货吗")) == "query_product"
+    assert action_of(ask("500元以内的冲锋衣")) == "search_products"
+
+
+def test_scripted_model_answers_after_tool_response():
+    answer = ask("500元以内的冲锋衣", "找到 3 件商品\n1. 冲锋衣A")
+    assert action_of(answer) == "Final Answer"
+    assert "找到 3 件商品" in answer.content
@@ -0,0 +1,28 @@
+from ecommerce_agent.mysql_db import order_item_rows, split_ids
+
+
+def test_split_ids_accepts_strings_lists_and_numbers():
+    assert split_ids("12345") == ["12345"]
+    assert split_ids(12345) == ["12345"]
+    assert split_ids("12345, 12346；12347、12348 12349") == ["12345", "12346", "12347", "12348", "12349"]
+    assert split_ids(["001", "002，003"]) == ["001", "002", "003"]
+
+
+def test_split_ids_strips_list_literals_written_as_strings():
+    assert split_ids('["12345", "12346"]') == ["12345", "12346"]
+    assert split_ids("['001']") == ["001"]
+
+
+def test_split_ids_deduplicates_in_order():
+    assert split_ids(["002", "001", "002"]) == ["002", "001"]
+
+
+def test_split_ids_empty():
+    assert split_ids(None) == []
+    assert split_ids("") == []
+    assert split_ids([None, " , "]) == []
+
+
+def test_order_item_rows_skips_blank_ids():
+    assert order_item_rows("12345", "001, ,002") == [("12345", 0, "001"), ("12345", 1, "002")]
+    assert order_item_rows("12345", None) == []
@@ -0,0 +1,53 @@
+from ecommerce_agent.product_filters import SearchFilters, derive_product_attributes, parse_discount_rate
+
+
+def test_search_filters_parse_tool_arguments():
+    filters = SearchFilters(min_price="100", max_price=500, has_activity="是", spec_keyword=" 16GB ")
+    assert (filters.min_price, filters.max_price) == (100.0, 500.0)
+    assert filters.has_activity is True
+    assert filters.spec_keyword == "16GB"
+    assert filters.describe() == "价格 100~500元，有活动，规格包含 '16GB'"
+
+
+def test_search_filters_blank_values_mean_no_filter():
+    filters = SearchFilters(min_price="", max_price=None, has_activity=" ", spec_keyword="  ")
+    assert not filters
+    assert filters.cache_key() == ""
+    assert filters.to_sql() == ("1=1", [])
+
+
+def test_search_filters_ignore_malformed_prices():
+    filters = SearchFilters(min_price="五百", max_price="nan", spec_keyword="XL")
+    assert (filters.min_price, filters.max_price) == (None, None)
+    assert filters.ignored == ["min_price", "max_price"]
+    assert filters.to_sql() == ("specifications LIKE %s", ["%XL%"])
+
+
+def test_search_filters_has_activity_strings():
+    assert SearchFilters(has_activity="false").has_activity is False
+    assert SearchFilters(has_activity="TRUE").has_activity is True
+    assert SearchFilters(has_activity=False).has_activity is False
+
+
+def test_search_filters_to_sql_escapes_like_wildcards():
+    where, params = SearchFilters(max_price=300, spec_keyword="100%_棉").to_sql()
+    assert where == "price_value <= %s AND specifications LIKE %s"
+    assert params == [300.0, "%100\\%\\_棉%"]
+
+
+def test_search_filters_cache_key_ignores_keyword_case():
+    assert SearchFilters(spec_keyword="XL").cache_key() == SearchFilters(spec_keyword="xl").cache_key()
+
+
+def test_derive_product_attributes():
+    assert derive_product_attributes("¥1,499.00", "新品上市9折") == (1499.0, 0.9, 1)
+    assert derive_product_attributes("299元", "八折") == (299.0, 0.8, 1)
+    assert derive_product_attributes("299元", "满300减50") == (299.0, None, 1)
+    assert derive_product_attributes("无", "暂无活动") == (None, None, 0)
+
+
+def test_parse_discount_rate():
+    assert parse_discount_rate("限时95折") == 0.95
+    assert parse_discount_rate("八五折") == 0.85
+    assert parse_discount_rate("10折") is None
+    assert parse_discount_rate("赠品") is None
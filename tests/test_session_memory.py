@@ -0,0 +1,42 @@
+import gc
+import threading
+
+from ecommerce_agent.cache import LRUTTLCache
+from ecommerce_agent.session_memory import SessionStore
+
+
+def make_store():
+    return SessionStore(LRUTTLCache(100, 60), max_turns=2, max_chars=100)
+
+
+def test_each_session_has_its_own_lock():
+    store = make_store()
+    lock = store.lock("a")
+    assert store.lock("a") is lock
+    assert all(store.lock(f"s{i}") is not lock for i in range(1000))
+
+
+def test_other_sessions_are_not_blocked():
+    store = make_store()
+    with store.lock("a"):
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(store.lock("b").acquire(timeout=1)))
+        thread.start()
+        thread.join()
+    assert acquired == [True]
+
+
+def test_unused_locks_are_released():
+    store = make_store()
+    with store.lock("a"):
+        assert "a" in store._locks
+    gc.collect()
+    assert "a" not in store._locks
+
+
+def test_append_keeps_recent_turns():
+    store = make_store()
+    for i in range(3):
+        store.append("a", f"问题{i}", f"回答{i}")
+    assert store.get_turns("a") == [["问题1", "回答1"], ["问题2", "回答2"]]
+    assert [m.content for m in store.get_messages("a")] == ["问题1", "回答1", "问题2", "回答2"]
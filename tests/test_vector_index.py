@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from ecommerce_agent.vector_index import MMAP_IO_FLAGS, ProductVectorIndex
+
+
+@pytest.fixture(params=[False, True], ids=["manifest", "mmap"])
+def index(request, tmp_path):
+    """以清单方式和 mmap 方式加载的同一个索引。"""
+    if request.param and MMAP_IO_FLAGS is None:
+        pytest.skip("当前 FAISS 版本不支持 mmap 加载")
+    vectors = np.random.default_rng(0).random((4, 8), dtype=np.float32)
+    built = ProductVectorIndex.create(8, "test", "Flat")
+    built.upsert(["001", "002", "003", "004"], vectors, ["h"] * 4)
+    built.remove(["004"])
+    built.save(str(tmp_path))
+    loaded = ProductVectorIndex.load(str(tmp_path), mmap=request.param)
+    assert loaded.mapped == request.param
+    return loaded
+
+
+def test_faiss_ids_of_known_products(index):
+    assert sorted(index._faiss_ids_of(["001", "003"])) == [0, 2]
+
+
+def test_faiss_ids_of_ignores_unknown_and_removed_products(index):
+    assert index._faiss_ids_of(["999", "004", ""]) == []
+
+
+def test_faiss_ids_of_ignores_ids_longer_than_stored_ones(index):
+    # 回归：mmap 方式下ID数组是定长的 <U3，"0010" 曾被截断成 "001" 而误命中
+    assert index._faiss_ids_of(["0010", "0020"]) == []
+    assert index._faiss_ids_of(["0010", "002"]) == [1]
+
+
+def test_search_restricted_to_product_ids(index):
+    query = np.ones(8, dtype=np.float32)
+    assert [product_id for product_id, _ in index.search(query, 5, product_ids={"002", "0030"})] == ["002"]